@@ -1,3 +1,62 @@
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 
-# Register your models here.
+from .models import RequestProfile
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """Профили запросов: файл открывается в https://www.speedscope.app"""
+    list_display = [
+        'created_at', 'method', 'view', 'path', 'status_code',
+        'duration_ms', 'query_count', 'sample_count', 'user', 'download_link'
+    ]
+    list_filter = ['method', 'status_code']
+    search_fields = ['path', 'view']
+    list_select_related = ['user']
+    date_hierarchy = 'created_at'
+    readonly_fields = [
+        'created_at', 'user', 'method', 'path', 'view', 'status_code',
+        'duration_ms', 'query_count', 'sample_count', 'file_name', 'download_link'
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path(
+                '<int:pk>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='api_requestprofile_download'
+            ),
+        ] + super().get_urls()
+
+    def download_view(self, request, pk):
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        if not self.has_view_permission(request, profile):
+            raise PermissionDenied
+        if not profile.file_path.is_file():
+            raise Http404("Файл профиля не найден")
+        return FileResponse(open(profile.file_path, 'rb'), as_attachment=True, filename=profile.file_name)
+
+    @admin.display(description="Профиль")
+    def download_link(self, obj):
+        url = reverse('admin:api_requestprofile_download', args=[obj.pk])
+        return format_html('<a href="{}">speedscope.json</a>', url)
+
+    def delete_queryset(self, request, queryset):
+        for profile in queryset:
+            profile.file_path.unlink(missing_ok=True)
+        super().delete_queryset(request, queryset)
+
+    def delete_model(self, request, obj):
+        obj.file_path.unlink(missing_ok=True)
+        super().delete_model(request, obj)
@@ -0,0 +1,90 @@
+"""
+Сжатие ответов: brotli (если установлен пакет brotli и клиент его принимает) или gzip
+
+В отличие от django.middleware.gzip.GZipMiddleware сжимает и потоковые ответы brotli,
+а обычные - только начиная с RESPONSE_COMPRESSION_MIN_BYTES: на маленьких ответах
+сжатие не окупается.
+Сжимаются только типы ответов API; HTML (админка, формы с CSRF-токеном) и любой ответ,
+для которого выдавался CSRF-токен, отдаются без сжатия - иначе по размеру сжатого ответа
+токен можно подобрать (BREACH).
+"""
+import re
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+ACCEPTS_BR_RE = re.compile(r'\bbr\b')
+ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+COMPRESSIBLE_RE = re.compile(r'^(text/csv|application/(json|msgpack|x-ndjson))\b')
+
+
+def _brotli_sequence(sequence, quality):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in sequence:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('Content-Encoding') or not response.streaming and (
+            len(response.content) < settings.RESPONSE_COMPRESSION_MIN_BYTES
+        ):
+            return response
+        if not COMPRESSIBLE_RE.match(response.get('Content-Type', '')):
+            return response
+        if request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+            # get_token() при формировании ответа: в теле может быть CSRF-токен
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and ACCEPTS_BR_RE.search(accept_encoding):
+            encoding = 'br'
+        elif ACCEPTS_GZIP_RE.search(accept_encoding):
+            encoding = 'gzip'
+        else:
+            return response
+
+        quality = settings.RESPONSE_COMPRESSION_BROTLI_QUALITY
+        if response.streaming:
+            if response.is_async:  # pragma: no cover - асинхронные ответы оставляем без сжатия
+                return response
+            if encoding == 'br':
+                response.streaming_content = _brotli_sequence(response.streaming_content, quality)
+            else:
+                response.streaming_content = compress_sequence(
+                    response.streaming_content, max_random_bytes=GZipMiddleware.max_random_bytes
+                )
+            del response.headers['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(response.content, quality=quality)
+            else:
+                compressed = compress_string(response.content, max_random_bytes=GZipMiddleware.max_random_bytes)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # Сжатое тело отличается от исходного - сильный ETag становится слабым
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
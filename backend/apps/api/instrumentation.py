@@ -0,0 +1,173 @@
+"""
+Инструментирование запросов: SQL, время БД, сериализации и общее время
+
+Включается настройкой REQUEST_INSTRUMENTATION (переменная окружения
+REQUEST_INSTRUMENTATION=1). Для каждого запроса:
+- заголовки X-Query-Count и Server-Timing (db, serializer, total);
+- структурированная строка лога (JSON) - WARNING для запросов медленнее
+  REQUEST_INSTRUMENTATION_SLOW_MS, DEBUG для остальных;
+- отпечатки SQL (текст запроса без параметров): если один и тот же запрос
+  выполнен REQUEST_INSTRUMENTATION_DUPLICATE_THRESHOLD раз и больше,
+  это помечается как вероятный N+1 (лог + заголовок X-Duplicate-Queries).
+
+MetricsMiddleware (включен всегда) пишет гистограмму времени запросов
+по представлениям для эндпоинта /metrics.
+"""
+import contextvars
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import connections
+
+from apps import metrics
+
+
+logger = logging.getLogger(__name__)
+
+_current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Нормализованный текст запроса: списки IN (...) схлопываются, пробелы сжимаются"""
+    return WHITESPACE_RE.sub(' ', IN_LIST_RE.sub('IN (...)', sql)).strip()
+
+
+def view_label(request):
+    """ViewSet.action для DRF, имя URL для остальных представлений"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    func = match.func
+    view_class = getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    if view_class is None:
+        return match.view_name or match._func_path
+    actions = getattr(func, 'actions', None)
+    if actions:
+        return f'{view_class.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+    return view_class.__name__
+
+
+@dataclass
+class RequestMetrics:
+    query_count: int = 0
+    db_time: float = 0.0
+    serializer_time: float = 0.0
+    serializer_depth: int = 0
+    fingerprints: Counter = field(default_factory=Counter)
+
+    def __call__(self, execute, sql, params, many, context):
+        """execute_wrapper: считает запросы и время БД"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.query_count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self, threshold):
+        return {sql: count for sql, count in self.fingerprints.items() if count >= threshold}
+
+
+def current_metrics():
+    """Метрики текущего запроса (None, если инструментирование выключено)"""
+    return _current_metrics.get()
+
+
+class TimedSerializerMixin:
+    """
+    Учитывает время сериализации верхнего уровня в метриках запроса
+    Вложенные сериализаторы не считаются повторно; запросы к БД, выполненные
+    во время сериализации, входят и во время serializer, и во время db.
+    """
+
+    def to_representation(self, instance):
+        metrics = _current_metrics.get()
+        if metrics is None or metrics.serializer_depth:
+            return super().to_representation(instance)
+        metrics.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer_time += time.perf_counter() - started
+            metrics.serializer_depth -= 1
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'REQUEST_INSTRUMENTATION_SLOW_MS', 500)
+        self.duplicate_threshold = getattr(settings, 'REQUEST_INSTRUMENTATION_DUPLICATE_THRESHOLD', 5)
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        total_ms = (time.perf_counter() - started) * 1000
+        db_ms = metrics.db_time * 1000
+        serializer_ms = metrics.serializer_time * 1000
+        duplicates = metrics.duplicates(self.duplicate_threshold)
+
+        response['X-Query-Count'] = str(metrics.query_count)
+        response['Server-Timing'] = (
+            f'db;dur={db_ms:.1f};desc="{metrics.query_count} queries", '
+            f'serializer;dur={serializer_ms:.1f}, total;dur={total_ms:.1f}'
+        )
+        if duplicates:
+            response['X-Duplicate-Queries'] = str(len(duplicates))
+
+        view = view_label(request)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 1),
+            'db_ms': round(db_ms, 1),
+            'serializer_ms': round(serializer_ms, 1),
+            'queries': metrics.query_count,
+            'duplicate_queries': sum(duplicates.values()),
+        }
+        if total_ms >= self.slow_ms:
+            logger.warning('slow_request %s', json.dumps(record, ensure_ascii=False))
+        else:
+            logger.debug('request %s', json.dumps(record, ensure_ascii=False))
+        for sql, count in duplicates.items():
+            logger.warning('n_plus_one %s', json.dumps(
+                {'view': view, 'path': request.path, 'count': count, 'sql': sql[:500]},
+                ensure_ascii=False
+            ))
+        return response
+
+
+class MetricsMiddleware:
+    """Гистограмма времени обработки запросов по ViewSet.action / имени URL"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        metrics.http_request_duration.observe(
+            time.perf_counter() - started,
+            view=view_label(request), method=request.method, status=response.status_code
+        )
+        return response
@@ -0,0 +1,264 @@
+"""
+Нагрузочный тест API
+
+Воспроизводит типичную смесь запросов пользователей ВОР против работающего
+API (по HTTP, как фронтенд): списки, детальный просмотр, создание разделов и
+типов работ, PATCH площадей и процентов. Считает p50/p95/p99 и пропускную
+способность по каждому эндпоинту.
+"""
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+
+# Смесь сценариев: имя -> вес
+DEFAULT_MIX = {
+    'estimates_list': 30,
+    'estimate_detail': 25,
+    'items_list': 15,
+    'section_create': 5,
+    'work_type_create': 5,
+    'section_area_patch': 10,
+    'work_type_percentage_patch': 10,
+}
+
+
+# Ошибки запроса: HTTP-статусы (HTTPError - подкласс URLError), сеть, некорректный JSON
+REQUEST_ERRORS = (urllib.error.URLError, OSError, ValueError)
+
+
+class ScenarioSetupError(Exception):
+    """Не удался подготовительный запрос сценария; label - эндпоинт для статистики"""
+
+    def __init__(self, label):
+        super().__init__(label)
+        self.label = label
+
+
+def percentile(sorted_values, percent):
+    """Перцентиль методом ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+@dataclass
+class EndpointStats:
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+
+    def summary(self, elapsed):
+        values = sorted(self.latencies)
+        return {
+            'requests': len(values),
+            'errors': self.errors,
+            'rps': round(len(values) / elapsed, 2) if elapsed else 0.0,
+            'mean_ms': round(sum(values) / len(values), 2) if values else 0.0,
+            'p50_ms': round(percentile(values, 50), 2),
+            'p95_ms': round(percentile(values, 95), 2),
+            'p99_ms': round(percentile(values, 99), 2),
+        }
+
+
+class ApiClient:
+    def __init__(self, base_url, token, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def request(self, method, path, data=None):
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(f'{self.base_url}{path}', data=body, method=method)
+        request.add_header('Authorization', f'Token {self.token}')
+        request.add_header('Accept', 'application/json')
+        if body is not None:
+            request.add_header('Content-Type', 'application/json')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            payload = response.read()
+        return json.loads(payload) if payload else None
+
+    def list_all(self, path, max_pages=10):
+        results = []
+        url = path
+        for _ in range(max_pages):
+            page = self.request('GET', url)
+            results.extend(page['results'] if isinstance(page, dict) else page)
+            if not isinstance(page, dict) or not page.get('next'):
+                break
+            url = page['next'][len(self.base_url):]
+        return results
+
+
+class LoadTest:
+    """
+    Запускает concurrency потоков на duration секунд (или до total_requests запросов)
+    и собирает статистику по именам эндпоинтов.
+    """
+
+    def __init__(self, client, concurrency=8, duration=30, total_requests=None, mix=None, seed=None):
+        self.client = client
+        self.concurrency = concurrency
+        self.duration = duration
+        self.total_requests = total_requests
+        self.mix = mix or DEFAULT_MIX
+        self.random = random.Random(seed)
+        self.stats = defaultdict(EndpointStats)
+        self._lock = threading.Lock()
+        self._issued = 0
+
+    # ---------- подготовка ----------
+
+    def discover(self):
+        """Собирает id существующих объектов через API"""
+        self.estimate_ids = [e['id'] for e in self.client.list_all('/estimates/')]
+        self.sections = self.client.list_all('/estimate-sections/')
+        self.section_work_types = self.client.list_all('/estimate-section-work-types/')
+        self.category_ids = [c['id'] for c in self.client.list_all('/work-categories/')]
+        work_types = self.client.list_all('/work-types/', max_pages=50)
+        self.work_types_by_category = defaultdict(list)
+        for work_type in work_types:
+            self.work_types_by_category[work_type['category']].append(work_type['id'])
+        if not self.estimate_ids or not self.category_ids:
+            raise RuntimeError('В базе нет ВОР или видов работ - восстановите backup.sql или сгенерируйте данные')
+        # Разделы, созданные тестом: [(section_id, category_id, [work_type_id, ...])]
+        self.created_sections = []
+        self._scratch = {'estimate': None, 'free_categories': []}
+
+    # ---------- сценарии ----------
+
+    def estimates_list(self):
+        page = self.random.randint(1, max(1, len(self.estimate_ids) // 20))
+        return 'GET /estimates/', ('GET', f'/estimates/?page={page}', None)
+
+    def estimate_detail(self):
+        estimate_id = self.random.choice(self.estimate_ids)
+        return 'GET /estimates/{id}/', ('GET', f'/estimates/{estimate_id}/', None)
+
+    def items_list(self):
+        if not self.section_work_types:
+            return self.estimate_detail()
+        swt = self.random.choice(self.section_work_types)
+        return 'GET /estimate-items/', ('GET', f"/estimate-items/?section_work_type={swt['id']}", None)
+
+    def section_create(self):
+        with self._lock:
+            if not self._scratch['free_categories']:
+                try:
+                    estimate = self.client.request('POST', '/estimates/', {
+                        'name': f'loadtest {time.time_ns()}', 'object_name': 'loadtest', 'status': 'draft'
+                    })
+                except REQUEST_ERRORS as error:
+                    raise ScenarioSetupError('POST /estimates/') from error
+                self._scratch = {'estimate': estimate['id'], 'free_categories': list(self.category_ids)}
+            category_id = self._scratch['free_categories'].pop()
+            estimate_id = self._scratch['estimate']
+        data = {
+            'estimate': estimate_id, 'work_category': category_id,
+            'total_area': round(self.random.uniform(50, 5000), 2)
+        }
+        return 'POST /estimate-sections/', ('POST', '/estimate-sections/', data), (
+            lambda section: self.created_sections.append(
+                (section['id'], category_id, list(self.work_types_by_category[category_id]))
+            )
+        )
+
+    def work_type_create(self):
+        with self._lock:
+            candidates = [s for s in self.created_sections if s[2]]
+            if not candidates:
+                return None
+            section_id, _, free_work_types = self.random.choice(candidates)
+            work_type_id = free_work_types.pop()
+        data = {'section': section_id, 'work_type': work_type_id, 'percentage': 50}
+        return 'POST /estimate-section-work-types/', ('POST', '/estimate-section-work-types/', data)
+
+    def section_area_patch(self):
+        section = self.random.choice(self.sections)
+        area = round(section['total_area'] * self.random.uniform(0.9, 1.1), 2)
+        return 'PATCH /estimate-sections/{id}/', (
+            'PATCH', f"/estimate-sections/{section['id']}/", {'total_area': area}
+        )
+
+    def work_type_percentage_patch(self):
+        swt = self.random.choice(self.section_work_types)
+        percentage = round(min(100, max(1, swt['percentage'] + self.random.uniform(-5, 5))), 2)
+        return 'PATCH /estimate-section-work-types/{id}/', (
+            'PATCH', f"/estimate-section-work-types/{swt['id']}/", {'percentage': percentage}
+        )
+
+    # ---------- выполнение ----------
+
+    def _next_scenario(self):
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        while True:
+            name = self.random.choices(names, weights)[0]
+            if name in ('section_area_patch',) and not self.sections:
+                continue
+            if name in ('work_type_percentage_patch',) and not self.section_work_types:
+                continue
+            scenario = getattr(self, name)()
+            if scenario is not None:
+                return scenario
+
+    def _take_slot(self):
+        with self._lock:
+            if self.total_requests is not None and self._issued >= self.total_requests:
+                return False
+            self._issued += 1
+            return True
+
+    def _worker(self, deadline):
+        while time.monotonic() < deadline and self._take_slot():
+            try:
+                label, (method, path, data), *callback = self._next_scenario()
+            except ScenarioSetupError as error:
+                with self._lock:
+                    self.stats[error.label].errors += 1
+                continue
+            started = time.perf_counter()
+            try:
+                result = self.client.request(method, path, data)
+            except REQUEST_ERRORS:
+                with self._lock:
+                    self.stats[label].errors += 1
+                continue
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.stats[label].latencies.append(elapsed_ms)
+            if callback:
+                with self._lock:
+                    callback[0](result)
+
+    def run(self):
+        self.discover()
+        deadline = time.monotonic() + self.duration
+        threads = [
+            threading.Thread(target=self._worker, args=(deadline,), daemon=True)
+            for _ in range(self.concurrency)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        endpoints = {label: stats.summary(elapsed) for label, stats in sorted(self.stats.items())}
+        total = EndpointStats(
+            latencies=[v for stats in self.stats.values() for v in stats.latencies],
+            errors=sum(stats.errors for stats in self.stats.values()),
+        )
+        return {
+            'concurrency': self.concurrency,
+            'elapsed_s': round(elapsed, 2),
+            'endpoints': endpoints,
+            'total': total.summary(elapsed),
+        }
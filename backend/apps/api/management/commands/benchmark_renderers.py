@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
+
+from apps.api.renderers import ORJSONRenderer, MessagePackRenderer, msgpack, orjson
+from apps.api.compression import brotli
+from apps.api.serializers import EstimateDetailSerializer
+from apps.estimates.models import Estimate
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает рендереры на ответе EstimateDetailSerializer: время рендеринга, размер ответа '
+        'без сжатия, с gzip и с brotli'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--estimate', type=int, default=None,
+                            help='id ВОР (по умолчанию - ВОР с наибольшим числом работ)')
+        parser.add_argument('--repeat', type=int, default=20, help='Повторов рендеринга')
+
+    def handle(self, *args, **options):
+        if options['estimate']:
+            estimate = Estimate.objects.filter(pk=options['estimate']).first()
+        else:
+            estimate = (
+                Estimate.objects.annotate(items=Count('sections__work_types__items'))
+                .order_by('-items').first()
+            )
+        if estimate is None:
+            raise CommandError('ВОР не найдена')
+
+        started = time.perf_counter()
+        data = EstimateDetailSerializer(estimate).data
+        self.stdout.write(
+            f'ВОР {estimate.pk} «{estimate.name}»: сериализация {(time.perf_counter() - started) * 1000:.1f} мс'
+        )
+
+        renderers = [('json (DRF)', JSONRenderer())]
+        if orjson is not None:
+            renderers.append(('orjson', ORJSONRenderer()))
+        if msgpack is not None:
+            renderers.append(('msgpack', MessagePackRenderer()))
+
+        header = f"{'Рендерер':12} {'мс':>8} {'байт':>11} {'gzip':>10} {'gzip мс':>8} {'br':>10} {'br мс':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for label, renderer in renderers:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                body = renderer.render(data)
+                timings.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            gzip_size = len(compress_string(body))
+            gzip_ms = (time.perf_counter() - started) * 1000
+            br_size, br_ms = '-', '-'
+            if brotli is not None:
+                started = time.perf_counter()
+                br_size = len(brotli.compress(body, quality=5))
+                br_ms = f'{(time.perf_counter() - started) * 1000:.1f}'
+            self.stdout.write(
+                f'{label:12} {statistics.median(timings):>8.2f} {len(body):>11} {gzip_size:>10} '
+                f'{gzip_ms:>8.1f} {br_size:>10} {br_ms:>8}'
+            )
@@ -0,0 +1,65 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.api.query_plans import HOT_QUERIES, QueryPlanError, collect_plans, compare
+
+
+class Command(BaseCommand):
+    help = (
+        'Снимает планы горячих запросов (EXPLAIN) и сравнивает с базовыми: '
+        'ошибка, если появился полный просмотр таблицы или стоимость выросла больше порога'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', default=str(Path(settings.BASE_DIR) / 'query_plans.json'),
+                            help='Файл базовых планов (по умолчанию backend/query_plans.json)')
+        parser.add_argument('--update', action='store_true',
+                            help='Записать текущие планы как базовые')
+        parser.add_argument('--threshold', type=float, default=1.5,
+                            help='Допустимый рост стоимости (PostgreSQL), во сколько раз')
+        parser.add_argument('--query', action='append', dest='queries', choices=sorted(HOT_QUERIES),
+                            help='Проверить только указанные запросы (можно несколько раз)')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Обновить статистику планировщика (ANALYZE) перед проверкой')
+
+    def handle(self, *args, **options):
+        if options['analyze']:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        try:
+            plans = collect_plans(options['queries'])
+        except QueryPlanError as e:
+            raise CommandError(str(e))
+
+        path = Path(options['baseline'])
+        baselines = json.loads(path.read_text(encoding='utf-8')) if path.exists() else {}
+        vendor_baselines = baselines.setdefault(connection.vendor, {})
+
+        if options['update']:
+            vendor_baselines.update(plans)
+            path.write_text(json.dumps(baselines, ensure_ascii=False, indent=2) + '\n', encoding='utf-8')
+            self.stdout.write(self.style.SUCCESS(f'Базовые планы ({connection.vendor}) записаны в {path}'))
+            return
+
+        regressions = 0
+        for name, plan in plans.items():
+            cost = f"{plan['cost']:.1f}" if plan['cost'] is not None else '-'
+            baseline = vendor_baselines.get(name)
+            if baseline is None:
+                self.stdout.write(self.style.WARNING(f'{name}: нет базового плана (cost {cost})'))
+                continue
+            problems = compare(plan, baseline, options['threshold'])
+            if problems:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(f"{name}: {'; '.join(problems)}"))
+                for line in plan['plan']:
+                    self.stdout.write(f'    {line}')
+            else:
+                self.stdout.write(f'{name}: OK (cost {cost})')
+
+        if regressions:
+            raise CommandError(f'Регрессии планов: {regressions}')
@@ -0,0 +1,73 @@
+import json
+import math
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.api.loadtest import DEFAULT_MIX, ApiClient, LoadTest
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест API: смесь запросов (списки, детали, создание разделов и типов работ, '
+        'PATCH площадей и процентов) с заданной конкурентностью; выводит p50/p95/p99 и RPS'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000/api',
+                            help='URL API (по умолчанию http://localhost:8000/api)')
+        parser.add_argument('--token', required=True, help='Токен пользователя API')
+        parser.add_argument('--concurrency', type=int, default=8, help='Количество параллельных клиентов')
+        parser.add_argument('--duration', type=float, default=30, help='Длительность теста, секунд')
+        parser.add_argument('--requests', type=int, default=None,
+                            help='Ограничение общего количества запросов')
+        parser.add_argument('--mix', default=None,
+                            help='Веса сценариев, например estimates_list=30,estimate_detail=20')
+        parser.add_argument('--seed', type=int, default=None, help='Seed выбора сценариев')
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help='Сохранить результаты в JSON-файл')
+
+    def handle(self, *args, **options):
+        mix = dict(DEFAULT_MIX)
+        if options['mix']:
+            mix = {}
+            for part in options['mix'].split(','):
+                name, _, weight = part.partition('=')
+                if name not in DEFAULT_MIX:
+                    raise CommandError(f"Неизвестный сценарий '{name}'. Допустимые: {', '.join(DEFAULT_MIX)}")
+                try:
+                    mix[name] = float(weight or 1)
+                except ValueError:
+                    raise CommandError(f"Вес сценария '{name}' должен быть числом: '{weight}'")
+                if not math.isfinite(mix[name]) or mix[name] < 0:
+                    raise CommandError(f"Вес сценария '{name}' должен быть неотрицательным числом: '{weight}'")
+            if not any(mix.values()):
+                raise CommandError('Хотя бы один сценарий --mix должен иметь вес больше нуля')
+
+        client = ApiClient(options['base_url'], options['token'])
+        load_test = LoadTest(
+            client,
+            concurrency=options['concurrency'],
+            duration=options['duration'],
+            total_requests=options['requests'],
+            mix=mix,
+            seed=options['seed'],
+        )
+        try:
+            report = load_test.run()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        header = f"{'Эндпоинт':48} {'запр.':>7} {'ошиб.':>6} {'RPS':>8} {'p50':>9} {'p95':>9} {'p99':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for label, row in [*report['endpoints'].items(), ('ИТОГО', report['total'])]:
+            self.stdout.write(
+                f"{label:48} {row['requests']:>7} {row['errors']:>6} {row['rps']:>8} "
+                f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}"
+            )
+        self.stdout.write(f"Время: {report['elapsed_s']} с, параллельных клиентов: {report['concurrency']} (мс)")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Результаты сохранены в {options['json_path']}"))
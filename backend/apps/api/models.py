@@ -1,3 +1,40 @@
+from pathlib import Path
+
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class RequestProfile(models.Model):
+    """
+    Профиль запроса (см. profiling.py)
+    Сам профиль хранится файлом speedscope в REQUEST_PROFILE_DIR
+    """
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Дата")
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='request_profiles',
+        verbose_name="Пользователь"
+    )
+    method = models.CharField(max_length=10, verbose_name="Метод")
+    path = models.CharField(max_length=500, verbose_name="Путь")
+    view = models.CharField(max_length=255, verbose_name="Эндпоинт")
+    status_code = models.PositiveSmallIntegerField(verbose_name="Статус")
+    duration_ms = models.FloatField(verbose_name="Длительность (мс)")
+    query_count = models.PositiveIntegerField(verbose_name="SQL-запросов")
+    sample_count = models.PositiveIntegerField(verbose_name="Сэмплов")
+    file_name = models.CharField(max_length=255, verbose_name="Файл")
+
+    class Meta:
+        verbose_name = "Профиль запроса"
+        verbose_name_plural = "Профили запросов"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms} мс)"
+
+    @property
+    def file_path(self):
+        return Path(settings.REQUEST_PROFILE_DIR) / self.file_name
@@ -0,0 +1,173 @@
+"""
+Профилирование запросов по требованию
+
+Сотрудник (is_staff) добавляет к запросу заголовок X-Profile: 1 или параметр ?_profile=1 -
+запрос выполняется под сэмплирующим профилировщиком (отдельный поток раз в
+REQUEST_PROFILE_INTERVAL секунд снимает стек потока запроса через sys._current_frames).
+Результат сохраняется в формате speedscope (https://www.speedscope.app) в каталог
+REQUEST_PROFILE_DIR, запись о нем - в модель RequestProfile (список в админке).
+"""
+import json
+import sys
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .instrumentation import RequestMetrics, _current_metrics, view_label
+
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = '_profile'
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+class SamplingProfiler:
+    """Сэмплирует стек одного потока; стеки хранятся от корня к листу"""
+
+    def __init__(self, thread_id=None, interval=0.001):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.frames = []
+        self._frame_index = {}
+        self.samples = []
+        self.weights = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _frame_id(self, code):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append({'name': code.co_name, 'file': code.co_filename, 'line': code.co_firstlineno})
+        return index
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(self._frame_id(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _run(self):
+        previous = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            stack = self._sample()
+            now = time.perf_counter()
+            if stack:
+                self.samples.append(stack)
+                self.weights.append((now - previous) * 1000)
+            previous = now
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def to_speedscope(self, name):
+        total = sum(self.weights)
+        return {
+            '$schema': SPEEDSCOPE_SCHEMA,
+            'name': name,
+            'exporter': 'vor-request-profiler',
+            'shared': {'frames': self.frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': total,
+                'samples': self.samples,
+                'weights': self.weights,
+            }],
+        }
+
+
+def profile_requested(request):
+    return request.headers.get(PROFILE_HEADER) == '1' or request.GET.get(PROFILE_PARAM) == '1'
+
+
+def request_user(request):
+    """Пользователь по сессии или токену (DRF-аутентификация выполняется позже, во view)"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    try:
+        result = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+class ProfilingMiddleware:
+    """Запускает профилировщик для запросов сотрудников с X-Profile: 1 / ?_profile=1"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profile_requested(request):
+            return self.get_response(request)
+        user = request_user(request)
+        if user is None or not user.is_staff:
+            return self.get_response(request)
+        return self.profile(request, user)
+
+    def profile(self, request, user):
+        from .models import RequestProfile
+
+        metrics = _current_metrics.get()
+        own_metrics = metrics is None
+        if own_metrics:
+            metrics = RequestMetrics()
+        queries_before = metrics.query_count
+        token = _current_metrics.set(metrics)
+        profiler = SamplingProfiler(interval=settings.REQUEST_PROFILE_INTERVAL)
+        try:
+            with ExitStack() as stack:
+                if own_metrics:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(metrics))
+                profiler.start()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.stop()
+        finally:
+            _current_metrics.reset(token)
+
+        view = view_label(request)
+        directory = Path(settings.REQUEST_PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        file_name = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}.speedscope.json'
+        (directory / file_name).write_text(
+            json.dumps(profiler.to_speedscope(f'{request.method} {request.path} ({view})')),
+            encoding='utf-8'
+        )
+        profile = RequestProfile.objects.create(
+            user=user,
+            method=request.method,
+            path=request.get_full_path()[:500],
+            view=view,
+            status_code=response.status_code,
+            duration_ms=round(profiler.duration * 1000, 2),
+            query_count=metrics.query_count - queries_before,
+            sample_count=len(profiler.samples),
+            file_name=file_name,
+        )
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
@@ -0,0 +1,227 @@
+"""
+Контроль планов выполнения горячих запросов
+
+Реестр HOT_QUERIES - именованные запросы API и движка ВОР (фильтры и сортировки
+из ViewSet'ов строятся теми же filter backends, что и в API). Для каждого запроса
+снимается план:
+- PostgreSQL: EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) - стоимость, время, буферы, Seq Scan;
+- SQLite: EXPLAIN QUERY PLAN - полные просмотры таблиц (SCAN без индекса), стоимости нет.
+Планы сравниваются с базовыми (JSON-файл, отдельно для каждой СУБД): регрессия -
+появление полного просмотра таблицы или рост стоимости больше порога.
+"""
+import json
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, Sum
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from apps.estimates.models import Estimate, EstimateItem, EstimateItemResource
+from apps.reference.models import WorkTypeWork, WorkResource
+from .views import (
+    EstimateViewSet, EstimateSectionViewSet, EstimateSectionWorkTypeViewSet,
+    EstimateItemViewSet, EstimateItemResourceViewSet
+)
+
+
+class QueryPlanError(RuntimeError):
+    """План запроса нельзя снять: нет данных или СУБД не поддерживается"""
+
+
+HOT_QUERIES = {}
+
+SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+
+
+def hot_query(name):
+    """Регистрирует функцию ids -> QuerySet в реестре горячих запросов"""
+    def decorator(func):
+        HOT_QUERIES[name] = func
+        return func
+    return decorator
+
+
+def viewset_queryset(viewset_class, params):
+    """QuerySet страницы списка ViewSet'а с query-параметрами params (как в API)"""
+    request = Request(APIRequestFactory().get('/', params))
+    view = viewset_class(request=request, format_kwarg=None, action='list', args=(), kwargs={})
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    return view.filter_queryset(view.get_queryset())[:page_size]
+
+
+def sample_ids():
+    """id существующих строк для параметров запросов"""
+    item_resource = EstimateItemResource.objects.select_related(
+        'estimate_item__section_work_type__section'
+    ).order_by('pk').first()
+    if item_resource is None:
+        return None
+    item = item_resource.estimate_item
+    section_work_type = item.section_work_type
+    return {
+        'estimate': section_work_type.section.estimate_id,
+        'section': section_work_type.section_id,
+        'section_work_type': section_work_type.pk,
+        'work_type': section_work_type.work_type_id,
+        'estimate_item': item.pk,
+        'work': item.work_id,
+        'resource': item_resource.resource_id,
+    }
+
+
+# ---------- реестр ----------
+
+@hot_query('estimates.list_by_status')
+def _estimates_by_status(ids):
+    return viewset_queryset(EstimateViewSet, {'status': Estimate.objects.get(pk=ids['estimate']).status})
+
+
+@hot_query('estimate_sections.by_estimate')
+def _sections_by_estimate(ids):
+    return viewset_queryset(EstimateSectionViewSet, {'estimate': ids['estimate']})
+
+
+@hot_query('section_work_types.by_section')
+def _section_work_types_by_section(ids):
+    return viewset_queryset(EstimateSectionWorkTypeViewSet, {'section': ids['section']})
+
+
+@hot_query('estimate_items.by_section_work_type')
+def _items_by_section_work_type(ids):
+    return viewset_queryset(EstimateItemViewSet, {'section_work_type': ids['section_work_type']})
+
+
+@hot_query('estimate_items.by_work')
+def _items_by_work(ids):
+    return viewset_queryset(EstimateItemViewSet, {'work': ids['work']})
+
+
+@hot_query('estimate_items.by_work_ordered')
+def _items_by_work_ordered(ids):
+    return viewset_queryset(EstimateItemViewSet, {'work': ids['work'], 'ordering': '-section_work_type'})
+
+
+@hot_query('estimate_item_resources.by_estimate_item')
+def _item_resources_by_item(ids):
+    return viewset_queryset(EstimateItemResourceViewSet, {'estimate_item': ids['estimate_item']})
+
+
+@hot_query('estimate_item_resources.by_resource')
+def _item_resources_by_resource(ids):
+    return viewset_queryset(EstimateItemResourceViewSet, {'resource': ids['resource']})
+
+
+@hot_query('estimate_item_resources.by_resource_ordered')
+def _item_resources_by_resource_ordered(ids):
+    return viewset_queryset(EstimateItemResourceViewSet, {'resource': ids['resource'], 'ordering': '-estimate_item'})
+
+
+@hot_query('engine.template_works')
+def _template_works(ids):
+    return WorkTypeWork.objects.filter(work_type_id=ids['work_type']).order_by('order_index')
+
+
+@hot_query('engine.template_resources')
+def _template_resources(ids):
+    return WorkResource.objects.filter(work_type_id=ids['work_type'], work_id=ids['work'])
+
+
+@hot_query('engine.section_items')
+def _section_items(ids):
+    return EstimateItem.objects.filter(section_work_type__section_id=ids['section'])
+
+
+@hot_query('usage.by_work')
+def _usage_by_work(ids):
+    return EstimateItem.objects.filter(
+        work_id=ids['work'], section_work_type__section__estimate__deleted_at__isnull=True
+    ).values(
+        estimate_key=F('section_work_type__section__estimate_id')
+    ).annotate(total=Sum('volume')).order_by('-total')[:100]
+
+
+@hot_query('usage.by_resource')
+def _usage_by_resource(ids):
+    return EstimateItemResource.objects.filter(
+        resource_id=ids['resource'], estimate__deleted_at__isnull=True
+    ).values(
+        estimate_key=F('estimate_id')
+    ).annotate(total=Sum('quantity')).order_by('-total')[:100]
+
+
+# ---------- планы ----------
+
+def _postgres_plan(cursor, sql, params):
+    cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}', params)
+    result = cursor.fetchone()[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+    root = result[0]
+    nodes, stack = [], [root['Plan']]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.get('Plans', []))
+    plan = root['Plan']
+    return {
+        'cost': plan['Total Cost'],
+        'execution_ms': root.get('Execution Time'),
+        'buffers': plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0),
+        'seq_scans': sorted({
+            node['Relation Name'] for node in nodes if node['Node Type'] == 'Seq Scan'
+        }),
+        'plan': [
+            f"{node['Node Type']}" + (f" on {node['Relation Name']}" if 'Relation Name' in node else '')
+            + (f" using {node['Index Name']}" if 'Index Name' in node else '')
+            for node in nodes
+        ],
+    }
+
+
+def _sqlite_plan(cursor, sql, params):
+    cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+    details = [row[3] for row in cursor.fetchall()]
+    return {
+        'cost': None,
+        'execution_ms': None,
+        'buffers': None,
+        'seq_scans': sorted({
+            match.group(1) for match in map(SQLITE_SCAN_RE.match, details) if match
+        }),
+        'plan': details,
+    }
+
+
+def explain(queryset):
+    connection = connections[queryset.db]
+    plan = {'postgresql': _postgres_plan, 'sqlite': _sqlite_plan}.get(connection.vendor)
+    if plan is None:
+        raise QueryPlanError(f'Планы запросов для {connection.vendor} не поддерживаются (только PostgreSQL и SQLite)')
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        return plan(cursor, sql, params)
+
+
+def collect_plans(names=None):
+    ids = sample_ids()
+    if ids is None:
+        raise QueryPlanError('В базе нет ВОР с ресурсами - сгенерируйте данные (generate_synthetic_data)')
+    return {
+        name: explain(HOT_QUERIES[name](ids))
+        for name in (names or HOT_QUERIES)
+    }
+
+
+def compare(plan, baseline, cost_threshold):
+    """Список регрессий плана относительно базового"""
+    problems = []
+    new_scans = sorted(set(plan['seq_scans']) - set(baseline['seq_scans']))
+    if new_scans:
+        problems.append(f"полный просмотр таблицы: {', '.join(new_scans)}")
+    if plan['cost'] is not None and baseline.get('cost'):
+        ratio = plan['cost'] / baseline['cost']
+        if ratio > cost_threshold:
+            problems.append(f"стоимость {baseline['cost']:.1f} → {plan['cost']:.1f} (×{ratio:.2f})")
+    return problems
@@ -5,20 +5,25 @@ from apps.reference.models import (
 )
 from apps.estimates.models import (
     Estimate, EstimateSection, EstimateSectionWorkType,
-    EstimateItem, EstimateItemResource
+    EstimateItem, EstimateItemResource, EstimateSnapshot
 )
+from .instrumentation import TimedSerializerMixin
+
+
+class InstrumentedModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """ModelSerializer с учетом времени сериализации (см. instrumentation.py)"""
 
 
 # ========== Reference Serializers ==========
 
-class WorkCategorySerializer(serializers.ModelSerializer):
+class WorkCategorySerializer(InstrumentedModelSerializer):
     class Meta:
         model = WorkCategory
         fields = ['id', 'name']
         read_only_fields = ['id']
 
 
-class WorkTypeSerializer(serializers.ModelSerializer):
+class WorkTypeSerializer(InstrumentedModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     
     class Meta:
@@ -27,21 +32,21 @@ class WorkTypeSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class WorkSerializer(serializers.ModelSerializer):
+class WorkSerializer(InstrumentedModelSerializer):
     class Meta:
         model = Work
         fields = ['id', 'name', 'unit']
         read_only_fields = ['id']
 
 
-class ResourceSerializer(serializers.ModelSerializer):
+class ResourceSerializer(InstrumentedModelSerializer):
     class Meta:
         model = Resource
         fields = ['id', 'name', 'unit']
         read_only_fields = ['id']
 
 
-class WorkTypeWorkSerializer(serializers.ModelSerializer):
+class WorkTypeWorkSerializer(InstrumentedModelSerializer):
     work_type_name = serializers.CharField(source='work_type.name', read_only=True)
     work_name = serializers.CharField(source='work.name', read_only=True)
     work_unit = serializers.CharField(source='work.unit', read_only=True)
@@ -55,7 +60,7 @@ class WorkTypeWorkSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class WorkResourceSerializer(serializers.ModelSerializer):
+class WorkResourceSerializer(InstrumentedModelSerializer):
     work_type_name = serializers.CharField(source='work_type.name', read_only=True)
     work_name = serializers.CharField(source='work.name', read_only=True)
     resource_name = serializers.CharField(source='resource.name', read_only=True)
@@ -72,7 +77,7 @@ class WorkResourceSerializer(serializers.ModelSerializer):
 
 # ========== Estimates Serializers ==========
 
-class EstimateSerializer(serializers.ModelSerializer):
+class EstimateSerializer(InstrumentedModelSerializer):
     sections_count = serializers.IntegerField(source='sections.count', read_only=True)
     
     class Meta:
@@ -83,7 +88,7 @@ class EstimateSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class EstimateSectionSerializer(serializers.ModelSerializer):
+class EstimateSectionSerializer(InstrumentedModelSerializer):
     estimate_name = serializers.CharField(source='estimate.name', read_only=True)
     work_category_name = serializers.CharField(source='work_category.name', read_only=True)
     work_types_count = serializers.IntegerField(source='work_types.count', read_only=True)
@@ -96,8 +101,13 @@ class EstimateSectionSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id']
 
+    def validate_estimate(self, estimate):
+        if estimate.status == 'archived' and hasattr(estimate, 'cold_storage'):
+            raise serializers.ValidationError('ВОР в холодном хранении: сначала смените статус с «Архив»')
+        return estimate
+
 
-class EstimateSectionWorkTypeSerializer(serializers.ModelSerializer):
+class EstimateSectionWorkTypeSerializer(InstrumentedModelSerializer):
     section_info = serializers.CharField(source='section.__str__', read_only=True)
     work_type_name = serializers.CharField(source='work_type.name', read_only=True)
     items_count = serializers.IntegerField(source='items.count', read_only=True)
@@ -111,7 +121,7 @@ class EstimateSectionWorkTypeSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class EstimateItemSerializer(serializers.ModelSerializer):
+class EstimateItemSerializer(InstrumentedModelSerializer):
     section_work_type_info = serializers.CharField(source='section_work_type.__str__', read_only=True)
     work_name = serializers.CharField(source='work.name', read_only=True)
     work_unit = serializers.CharField(source='work.unit', read_only=True)
@@ -126,7 +136,7 @@ class EstimateItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class EstimateItemResourceSerializer(serializers.ModelSerializer):
+class EstimateItemResourceSerializer(InstrumentedModelSerializer):
     estimate_item_info = serializers.CharField(source='estimate_item.__str__', read_only=True)
     resource_name = serializers.CharField(source='resource.name', read_only=True)
     resource_unit = serializers.CharField(source='resource.unit', read_only=True)
@@ -134,10 +144,16 @@ class EstimateItemResourceSerializer(serializers.ModelSerializer):
     class Meta:
         model = EstimateItemResource
         fields = [
-            'id', 'estimate_item', 'estimate_item_info', 'resource', 'resource_name',
+            'id', 'estimate', 'estimate_item', 'estimate_item_info', 'resource', 'resource_name',
             'resource_unit', 'quantity'
         ]
-        read_only_fields = ['id']
+        read_only_fields = ['id', 'estimate']
+
+    def validate(self, attrs):
+        """ВОР ресурса - всегда ВОР работы"""
+        if 'estimate_item' in attrs:
+            attrs['estimate_id'] = attrs['estimate_item'].section_work_type.section.estimate_id
+        return attrs
 
 
 # ========== Nested Serializers для детального просмотра ==========
@@ -171,4 +187,17 @@ class EstimateDetailSerializer(EstimateSerializer):
     sections = EstimateSectionDetailSerializer(many=True, read_only=True)
     
     class Meta(EstimateSerializer.Meta):
-        fields = EstimateSerializer.Meta.fields + ['sections']
\ No newline at end of file
+        fields = EstimateSerializer.Meta.fields + ['sections']
+
+# ========== Estimate Snapshots ==========
+
+class EstimateSnapshotSerializer(InstrumentedModelSerializer):
+    is_delta = serializers.SerializerMethodField()
+
+    class Meta:
+        model = EstimateSnapshot
+        fields = ['id', 'estimate', 'version', 'comment', 'created_at', 'is_delta', 'size', 'rows_count']
+        read_only_fields = fields
+
+    def get_is_delta(self, obj):
+        return obj.base_id is not None
@@ -1,3 +1,885 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import tempfile
+import urllib.error
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import ProtectedError, Sum
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from apps import metrics
+from apps.estimates.synthetic import SyntheticConfig, generate_synthetic_data
+from apps.estimates.models import (
+    Estimate, EstimateSectionWorkType, EstimateItemResource, EstimateColdStorage, EstimateSnapshot
+)
+from apps.reference.models import WorkType, Work, Resource
+from apps.estimates import calculation, export
+from apps.estimates.transfer import export_archive, export_querysets, import_archive
+from . import compression, renderers
+from .loadtest import EndpointStats, LoadTest, percentile
+from .models import RequestProfile
+from .query_plans import HOT_QUERIES, QueryPlanError, explain
+
+
+class ApiTestCase(TestCase):
+    """Небольшой синтетический набор данных и авторизованный клиент API"""
+
+    synthetic_config = SyntheticConfig(
+        estimates=2, categories=2, work_types_per_category=2, work_types_per_section=2,
+        works_per_type=3, resources_per_work=2, works_pool=10, resources_pool=10,
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_synthetic_data(cls.synthetic_config)
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.estimate = Estimate.objects.order_by('pk').first()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class FakeLoadTestClient:
+    """Клиент нагрузочного теста без HTTP: фиксированные данные, ошибки по пути запроса"""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self._next_id = 1000
+
+    def list_all(self, path, max_pages=10):
+        return {
+            '/estimates/': [{'id': 1}],
+            '/estimate-sections/': [{'id': 10, 'total_area': 100.0}],
+            '/estimate-section-work-types/': [{'id': 20, 'percentage': 50.0}],
+            '/work-categories/': [{'id': 1}, {'id': 2}],
+            '/work-types/': [{'id': 5, 'category': 1}, {'id': 6, 'category': 2}],
+        }[path]
+
+    def request(self, method, path, data=None):
+        if any(path.startswith(prefix) for prefix in self.failing):
+            raise urllib.error.HTTPError(path, 500, 'Server Error', {}, None)
+        self._next_id += 1
+        return {'id': self._next_id}
+
+
+class LoadTestTests(TestCase):
+
+    def test_percentile_and_summary(self):
+        values = [float(value) for value in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile(values, 100), 100.0)
+        self.assertEqual(percentile([], 95), 0.0)
+        self.assertEqual(percentile([7.0], 1), 7.0)
+        summary = EndpointStats(latencies=[30.0, 10.0, 20.0], errors=1).summary(elapsed=2)
+        self.assertEqual(summary, {
+            'requests': 3, 'errors': 1, 'rps': 1.5, 'mean_ms': 20.0,
+            'p50_ms': 20.0, 'p95_ms': 30.0, 'p99_ms': 30.0,
+        })
+        self.assertEqual(EndpointStats().summary(elapsed=0)['rps'], 0.0)
+
+    def test_run_counts_requests_and_errors(self):
+        client = FakeLoadTestClient(failing=['/estimate-sections/10/'])
+        report = LoadTest(client, concurrency=2, duration=30, total_requests=200, seed=1).run()
+        self.assertEqual(report['total']['requests'] + report['total']['errors'], 200)
+        self.assertEqual(report['endpoints']['PATCH /estimate-sections/{id}/']['requests'], 0)
+        self.assertGreater(report['endpoints']['PATCH /estimate-sections/{id}/']['errors'], 0)
+        self.assertGreater(report['endpoints']['POST /estimate-sections/']['requests'], 0)
+
+    def test_failed_estimate_create_is_recorded(self):
+        client = FakeLoadTestClient(failing=['/estimates/'])
+        report = LoadTest(client, concurrency=2, duration=30, total_requests=20,
+                          mix={'section_create': 1}, seed=1).run()
+        self.assertEqual(report['endpoints']['POST /estimates/']['errors'], 20)
+        self.assertEqual(report['total']['errors'], 20)
+
+    def test_command_rejects_bad_mix(self):
+        for mix in ('estimates_list=abc', 'estimates_list=-1', 'estimates_list=0,estimate_detail=0', 'unknown=1'):
+            with self.assertRaises(CommandError, msg=mix):
+                call_command('load_test', token='token', mix=mix, stdout=StringIO())
+
+
+@modify_settings(MIDDLEWARE={'append': 'apps.api.instrumentation.QueryInstrumentationMiddleware'})
+@override_settings(REQUEST_INSTRUMENTATION_DUPLICATE_THRESHOLD=3)
+class QueryInstrumentationMiddlewareTests(ApiTestCase):
+
+    def test_headers_and_duplicate_queries(self):
+        with self.assertLogs('apps.api.instrumentation', level='WARNING') as logs:
+            response = self.client.get(f'/api/estimates/{self.estimate.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response['X-Query-Count']), 0)
+        self.assertIn('serializer;dur=', response['Server-Timing'])
+        self.assertIn('X-Duplicate-Queries', response)
+        self.assertTrue(any('n_plus_one' in line for line in logs.output))
+
+
+class MetricsEndpointTests(ApiTestCase):
+
+    def test_engine_and_request_metrics_are_exposed(self):
+        section = self.estimate.sections.first()
+        work_type = section.work_types.first()
+        instantiations = metrics.template_instantiations.value()
+        recalculations = metrics.recalculation_duration.count(scope='section_work_type')
+
+        response = self.client.patch(
+            f'/api/estimate-section-work-types/{work_type.pk}/', {'percentage': 10}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(metrics.recalculation_duration.count(scope='section_work_type'), recalculations + 1)
+
+        work_type.delete()
+        EstimateSectionWorkType.objects.create(section=section, work_type=work_type.work_type, percentage=10)
+        self.assertEqual(metrics.template_instantiations.value(), instantiations + 1)
+
+        self.client.force_login(self.user)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('# TYPE vor_estimate_recalculation_duration_seconds histogram', body)
+        self.assertIn(
+            'vor_http_request_duration_seconds_count{view="EstimateSectionWorkTypeViewSet.partial_update",'
+            'method="PATCH",status="200"}', body
+        )
+        self.assertIn('vor_estimate_template_resources_written_bucket{le="+Inf"}', body)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_token_or_staff_required_without_debug(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(User.objects.create_user('user', password='password'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with override_settings(DEBUG=True):
+            self.client.logout()
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class RequestProfilingTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(REQUEST_PROFILE_DIR=directory.name))
+
+    def test_staff_request_is_profiled(self):
+        # Профилировщик определяет пользователя в middleware - нужен настоящий токен
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        response = self.client.get(f'/api/estimates/{self.estimate.pk}/', {'_profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertEqual(profile.view, 'EstimateViewSet.retrieve')
+        self.assertGreater(profile.query_count, 0)
+        data = json.loads(profile.file_path.read_text(encoding='utf-8'))
+        self.assertEqual(data['profiles'][0]['type'], 'sampled')
+        self.assertEqual(len(data['profiles'][0]['samples']), profile.sample_count)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('admin:api_requestprofile_changelist'))
+        self.assertContains(response, 'EstimateViewSet.retrieve')
+
+        url = reverse('admin:api_requestprofile_download', args=[profile.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # сотрудник без права просмотра профилей файл не получает
+        self.client.force_login(User.objects.create_user('staff', password='password', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_non_staff_request_is_not_profiled(self):
+        user = User.objects.create_user('user', password='password')
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        response = self.client.get('/api/estimates/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+
+class CheckQueryPlansTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.baseline = Path(directory.name) / 'query_plans.json'
+
+    def test_plans_match_own_baseline(self):
+        call_command('check_query_plans', baseline=self.baseline, update=True, stdout=StringIO())
+        self.assertEqual(set(json.loads(self.baseline.read_text())[connection.vendor]), set(HOT_QUERIES))
+        call_command('check_query_plans', baseline=self.baseline, stdout=StringIO())
+
+    def test_new_sequential_scan_fails(self):
+        # status без индекса (и без фильтра по deleted_at) - полный просмотр ожидаем
+        by_status = {'estimates.all_by_status': lambda ids: Estimate.all_objects.filter(status='draft')}
+        with mock.patch.dict(HOT_QUERIES, by_status):
+            call_command('check_query_plans', baseline=self.baseline, update=True, stdout=StringIO())
+            baselines = json.loads(self.baseline.read_text())
+            plan = baselines[connection.vendor]['estimates.all_by_status']
+            self.assertTrue(plan['seq_scans'])
+            plan['seq_scans'] = []
+            self.baseline.write_text(json.dumps(baselines))
+            stdout = StringIO()
+            with self.assertRaises(CommandError):
+                call_command('check_query_plans', baseline=self.baseline, stdout=stdout)
+        self.assertIn('estimates.all_by_status', stdout.getvalue())
+
+    def test_unsupported_vendor(self):
+        queryset = Estimate.objects.all()
+        with mock.patch.object(connection, 'vendor', 'oracle'), self.assertRaises(QueryPlanError):
+            explain(queryset)
+
+
+class ColdStorageTests(ApiTestCase):
+
+    def flat(self, detail):
+        return sorted(
+            (section['work_category_name'], section['total_area'], work_type['work_type_name'],
+             work_type['percentage'], item['work_name'], item['volume'], resource['resource_name'],
+             resource['quantity'], resource['estimate_item_info'])
+            for section in detail['sections'] for work_type in section['work_types']
+            for item in work_type['items'] for resource in item['resources']
+        )
+
+    def test_archive_detail_and_rehydrate(self):
+        from apps.estimates.cold_storage import archive_estimate
+
+        url = f'/api/estimates/{self.estimate.pk}/'
+        hot = self.client.get(url).json()
+        rows = EstimateItemResource.objects.filter(estimate_item__section_work_type__section__estimate=self.estimate)
+        count = rows.count()
+        self.assertEqual(self.client.patch(url, {'status': 'archived'}, format='json').status_code, 200)
+        cold = archive_estimate(self.estimate)
+        self.assertFalse(rows.exists())
+        self.assertGreater(cold.rows_count, count)
+
+        detail = self.client.get(url).json()
+        self.assertEqual(detail['cold_storage']['rows_count'], cold.rows_count)
+        self.assertEqual(detail['sections_count'], hot['sections_count'])
+        self.assertEqual(self.flat(detail), self.flat(hot))
+        response = self.client.post('/api/estimate-sections/', {
+            'estimate': self.estimate.pk, 'work_category': hot['sections'][0]['work_category'], 'total_area': 1,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(self.client.patch(url, {'status': 'active'}, format='json').status_code, 200)
+        self.assertEqual(rows.count(), count)
+        detail = self.client.get(url).json()
+        self.assertNotIn('cold_storage', detail)
+        self.assertEqual(self.flat(detail), self.flat(hot))
+
+    def archive(self):
+        from apps.estimates.cold_storage import archive_estimate
+        Estimate.objects.filter(pk=self.estimate.pk).update(status='archived')
+        self.estimate.refresh_from_db()
+        return archive_estimate(self.estimate)
+
+    def test_referenced_catalog_is_protected(self):
+        resource = EstimateItemResource.objects.filter(estimate=self.estimate).first().resource
+        self.archive()
+        # Других ВОР с ресурсом нет - удаление держат только ссылки документа
+        EstimateItemResource.objects.filter(resource=resource).delete()
+        with self.assertRaises(ProtectedError):
+            resource.delete()
+        self.assertEqual(self.client.get(f'/api/estimates/{self.estimate.pk}/').status_code, 200)
+
+    def test_missing_reference_is_reported(self):
+        from apps.estimates.models import EstimateColdStorageReference
+        resource = EstimateItemResource.objects.filter(estimate=self.estimate).first().resource
+        self.archive()
+        # Документ, перенесенный до появления ссылок
+        EstimateColdStorageReference.objects.all().delete()
+        EstimateItemResource.objects.filter(resource=resource).delete()
+        resource_id = resource.pk
+        resource.delete()
+
+        url = f'/api/estimates/{self.estimate.pk}/'
+        names = [
+            row['resource_name'] for section in self.client.get(url).json()['sections']
+            for work_type in section['work_types'] for item in work_type['items'] for row in item['resources']
+            if row['resource'] == resource_id
+        ]
+        self.assertTrue(names)
+        self.assertTrue(all('удален' in name for name in names))
+        response = self.client.patch(url, {'status': 'active'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(resource_id), response.json()['status'][0])
+        self.estimate.refresh_from_db()
+        self.assertEqual(self.estimate.status, 'archived')
+        self.assertTrue(EstimateColdStorage.objects.filter(estimate=self.estimate).exists())
+
+    def test_substitution_rewrites_documents(self):
+        from apps.estimates.substitution import substitute_resource
+        rows = EstimateItemResource.objects.filter(estimate=self.estimate)
+        source = rows.first().resource
+        target = Resource.objects.exclude(pk__in=rows.values('resource')).first() or Resource.objects.create(
+            name='Новый ресурс', unit='кг'
+        )
+        expected = sorted(
+            (row.estimate_item.work_id, target.pk if row.resource_id == source.pk else row.resource_id,
+             round(row.quantity * (2 if row.resource_id == source.pk else 1), 6))
+            for row in rows.select_related('estimate_item')
+        )
+        self.archive()
+        result = substitute_resource(source, target, coefficient=2, templates=False, estimate_ids=[self.estimate.pk])
+        self.assertEqual(result['estimates'], [self.estimate.pk])
+        self.assertFalse(EstimateColdStorage.objects.filter(references__resource=source).exists())
+
+        self.estimate.status = 'active'
+        self.estimate.save()
+        self.assertEqual(sorted(
+            (row.estimate_item.work_id, row.resource_id, round(row.quantity, 6))
+            for row in rows.select_related('estimate_item')
+        ), expected)
+
+    def test_save_without_status_change_skips_cold_storage(self):
+        estimate = Estimate.objects.get(pk=self.estimate.pk)
+        estimate.name = 'Другое название'
+        with CaptureQueriesContext(connection) as queries:
+            estimate.save()
+        self.assertEqual(len(queries), 1)
+        with CaptureQueriesContext(connection) as queries:
+            estimate.save(update_fields=['name'])
+        self.assertEqual(len(queries), 1)
+
+
+class EstimateSnapshotTests(ApiTestCase):
+
+    def snapshot(self, comment=''):
+        response = self.client.post(f'/api/estimates/{self.estimate.pk}/snapshots/', {'comment': comment}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_snapshot_diff_and_restore(self):
+        first = self.snapshot('до правки')
+        work_type = EstimateSectionWorkType.objects.filter(section__estimate=self.estimate).first()
+        old_percentage = work_type.percentage
+        work_type.percentage = old_percentage / 2
+        work_type.save()
+        second = self.snapshot('после правки')
+        self.assertTrue(second['is_delta'])
+        # Дельта после правки одного типа работ много меньше полной версии
+        self.assertLess(second['size'], first['size'] / 2)
+
+        response = self.client.get(f'/api/estimates/{self.estimate.pk}/snapshots/diff/', {
+            'a': first['id'], 'b': second['id']
+        })
+        self.assertEqual(response.status_code, 200)
+        changes = response.json()
+        self.assertEqual(len(changes['work_types']['changed']), 1)
+        self.assertEqual(changes['work_types']['changed'][0]['old'], old_percentage)
+        self.assertEqual(len(changes['items']['changed']), self.synthetic_config.works_per_type)
+        self.assertFalse(changes['sections']['changed'])
+
+        response = self.client.post(f'/api/estimates/{self.estimate.pk}/snapshots/{first["id"]}/restore/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['backup']['version'], 3)
+        work_type = EstimateSectionWorkType.objects.get(section__estimate=self.estimate, work_type=work_type.work_type)
+        self.assertEqual(work_type.percentage, old_percentage)
+        current = self.client.get(f'/api/estimates/{self.estimate.pk}/snapshots/diff/', {'a': first['id']}).json()
+        self.assertFalse(any(changes for table in ('sections', 'work_types', 'items', 'resources')
+                             for changes in current[table].values()))
+
+        versions = self.client.get(f'/api/estimates/{self.estimate.pk}/snapshots/').json()
+        self.assertEqual([v['version'] for v in versions], [3, 2, 1])
+
+    def test_non_object_body(self):
+        first = self.snapshot('версия')
+        url = f'/api/estimates/{self.estimate.pk}/snapshots/'
+        self.assertEqual(self.client.post(url, ['комментарий'], format='json').status_code, 400)
+        response = self.client.post(f'{url}{first["id"]}/restore/', [False], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(EstimateSnapshot.objects.filter(estimate=self.estimate).count(), 1)
+
+
+class EstimateCompareTests(ApiTestCase):
+
+    def compare(self, a, b):
+        response = self.client.get('/api/estimates/compare/', {'a': a.pk, 'b': b.pk})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))
+
+    def export_estimate(self):
+        buffer = io.BytesIO()
+        export_archive(buffer, export_querysets(estimate_ids=[self.estimate.pk]))
+        buffer.seek(0)
+        return buffer
+
+    def test_identical_estimates_have_no_differences(self):
+        result = self.compare(self.estimate, self.estimate)
+        self.assertEqual(result['summary'], {'sections': 0, 'work_types': 0, 'items': 0, 'resources': 0})
+
+    def test_changed_percentage_and_removed_section(self):
+        import_archive(self.export_estimate(), mode='merge')
+        copy = Estimate.objects.order_by('-pk')[0]
+        work_type = EstimateSectionWorkType.objects.filter(section__estimate=copy).first()
+        old_percentage = work_type.percentage
+        work_type.percentage = old_percentage * 2
+        work_type.save()
+        removed = copy.sections.exclude(pk=work_type.section_id).first()
+        removed.delete()
+
+        result = self.compare(self.estimate, copy)
+        self.assertEqual(result['summary']['sections'], 1)
+        self.assertEqual(result['sections'][0]['status'], 'removed')
+        self.assertEqual(result['sections'][0]['work_category'], removed.work_category_id)
+        changed = [row for row in result['work_types'] if row['status'] == 'changed']
+        self.assertEqual(len(changed), 1)
+        self.assertAlmostEqual(changed[0]['relative'], 1.0)
+        self.assertAlmostEqual(changed[0]['delta'], old_percentage)
+        self.assertTrue(all(row['resource_name'] for row in result['resources']))
+
+    def test_unknown_estimate(self):
+        response = self.client.get('/api/estimates/compare/', {'a': self.estimate.pk, 'b': 0})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cold_storage_estimate_rejected(self):
+        from apps.estimates.cold_storage import archive_estimate
+        import_archive(self.export_estimate(), mode='merge')
+        copy = Estimate.objects.order_by('-pk')[0]
+        Estimate.objects.filter(pk=copy.pk).update(status='archived')
+        archive_estimate(copy)
+        response = self.client.get('/api/estimates/compare/', {'a': self.estimate.pk, 'b': copy.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(copy.pk), response.json()['error'])
+
+
+class EstimatePreviewTests(ApiTestCase):
+
+    def resource_totals(self):
+        return dict(
+            EstimateItemResource.objects.filter(estimate_item__section_work_type__section__estimate=self.estimate)
+            .order_by().values('resource_id').annotate(total=Sum('quantity')).values_list('resource_id', 'total')
+        )
+
+    def assert_preview_matches_save(self, changes, apply):
+        before = self.resource_totals()
+        response = self.client.post(f'/api/estimates/{self.estimate.pk}/preview/', changes, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.resource_totals(), before)  # ничего не записано
+        apply()
+        after = self.resource_totals()
+        preview = {row['resource']: row for row in response.json()['resources']}
+        for resource_id in before.keys() | after.keys():
+            expected = after.get(resource_id, 0.0)
+            if resource_id in preview:
+                self.assertAlmostEqual(preview[resource_id]['new_quantity'], expected, places=6)
+            else:
+                self.assertAlmostEqual(before.get(resource_id, 0.0), expected, places=6)
+        return response.json()
+
+    def test_area_and_percentage_changes_match_saved_recalculation(self):
+        section = self.estimate.sections.order_by('pk').first()
+        work_type = EstimateSectionWorkType.objects.filter(section__estimate=self.estimate).order_by('pk').last()
+        changes = {
+            'sections': [{'id': section.pk, 'total_area': section.total_area * 1.5}],
+            'work_types': [{'id': work_type.pk, 'percentage': 10}],
+        }
+
+        def apply():
+            section.total_area *= 1.5
+            section.save()
+            work_type.refresh_from_db()
+            work_type.percentage = 10
+            work_type.save()
+
+        result = self.assert_preview_matches_save(changes, apply)
+        self.assertTrue(result['items'])
+
+    def test_added_and_deleted_work_types(self):
+        section = self.estimate.sections.order_by('pk').first()
+        present = set(section.work_types.values_list('work_type_id', flat=True))
+        new_work_type = WorkType.objects.exclude(pk__in=present).first()
+        removed = section.work_types.order_by('pk').first()
+        changes = {'work_types': [
+            {'id': removed.pk, 'delete': True},
+            {'section': section.pk, 'work_type': new_work_type.pk, 'percentage': 25},
+        ]}
+
+        def apply():
+            removed.delete()
+            EstimateSectionWorkType.objects.create(section=section, work_type=new_work_type, percentage=25)
+
+        self.assert_preview_matches_save(changes, apply)
+
+    def test_invalid_changes(self):
+        response = self.client.post(f'/api/estimates/{self.estimate.pk}/preview/', {
+            'sections': [{'id': 0, 'total_area': 10}]
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+    def test_malformed_changes(self):
+        section = self.estimate.sections.order_by('pk').first()
+        bodies = [
+            [{'id': section.pk, 'total_area': 10}],
+            {'sections': [1]},
+            {'sections': 'abc'},
+            {'work_types': {'id': 1}},
+            {'sections': [{'id': [section.pk], 'total_area': 10}]},
+            {'work_types': [{'id': {'pk': 1}, 'percentage': 10}]},
+            {'work_types': [{'section': section.pk, 'work_type': [1], 'percentage': 10}]},
+            {'sections': [{'id': section.pk, 'total_area': 'nan'}]},
+            {'sections': [{'id': section.pk, 'total_area': 'inf'}]},
+        ]
+        for body in bodies:
+            with self.subTest(body=body):
+                response = self.client.post(f'/api/estimates/{self.estimate.pk}/preview/', body, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+
+class WorkTypeSweepTests(ApiTestCase):
+
+    def test_sweep_matches_estimate_totals(self):
+        section = self.estimate.sections.order_by('pk').first()
+        work_types = list(section.work_types.order_by('pk').values_list('work_type_id', 'percentage'))
+        expected = dict(
+            EstimateItemResource.objects.filter(estimate_item__section_work_type__section=section)
+            .order_by().values('resource_id').annotate(total=Sum('quantity')).values_list('resource_id', 'total')
+        )
+        response = self.client.post('/api/work-types/sweep/', {
+            'work_types': [work_type_id for work_type_id, _ in work_types],
+            'areas': [section.total_area, section.total_area * 2],
+            'mixes': [[percentage for _, percentage in work_types], [0] * len(work_types)],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        resource_ids = [resource['id'] for resource in data['resources']]
+        self.assertEqual(set(resource_ids), set(expected))
+        for k, resource_id in enumerate(resource_ids):
+            self.assertAlmostEqual(data['totals'][0][0][k], expected[resource_id], places=4)
+            self.assertAlmostEqual(data['totals'][1][0][k], expected[resource_id] * 2, places=4)
+            self.assertEqual(data['totals'][0][1][k], 0)
+
+    def test_invalid_mix(self):
+        work_type_id = self.estimate.sections.first().work_types.first().work_type_id
+        response = self.client.post('/api/work-types/sweep/', {
+            'work_types': [work_type_id], 'areas': [100], 'mixes': [[50, 50]],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_malformed_body(self):
+        work_type_id = self.estimate.sections.first().work_types.first().work_type_id
+        for body in ([work_type_id], {'work_types': [[work_type_id]], 'areas': [100], 'mixes': [[50]]},
+                     {'work_types': work_type_id, 'areas': [100], 'mixes': [[50]]}):
+            with self.subTest(body=body):
+                response = self.client.post('/api/work-types/sweep/', body, format='json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_result_size_is_bounded(self):
+        work_type_id = self.estimate.sections.first().work_types.first().work_type_id
+        with mock.patch.object(calculation, 'MAX_SWEEP_VALUES', 3):
+            response = self.client.post('/api/work-types/sweep/', {
+                'work_types': [work_type_id], 'areas': [100, 200], 'mixes': [[50], [100]],
+            }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ресурсов', response.json()['error'])
+
+
+class RenderingAndCompressionTests(ApiTestCase):
+
+    @skipUnless(renderers.msgpack, 'нужен msgpack')
+    def test_msgpack_matches_json(self):
+        url = f'/api/estimates/{self.estimate.pk}/'
+        as_json = self.client.get(url).json()
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content), as_json)
+
+    @skipUnless(compression.brotli, 'нужен brotli')
+    def test_large_response_is_compressed(self):
+        url = f'/api/estimates/{self.estimate.pk}/'
+        plain = self.client.get(url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(compression.brotli.decompress(response.content), plain.content)
+
+    @override_settings(RESPONSE_COMPRESSION_MIN_BYTES=0)
+    def test_html_with_csrf_token_is_not_compressed(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/admin/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'csrfmiddlewaretoken', response.content)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(RESPONSE_COMPRESSION_MIN_BYTES=0)
+    def test_response_after_get_token_is_not_compressed(self):
+        from django.middleware.csrf import get_token
+
+        def view(request, with_token):
+            return JsonResponse({'csrf': get_token(request) if with_token else None, 'rows': ['x' * 100] * 10})
+
+        for with_token, encoding in ((False, 'gzip'), (True, None)):
+            request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+            response = compression.CompressionMiddleware(lambda request: view(request, with_token))(request)
+            self.assertEqual(response.get('Content-Encoding'), encoding)
+
+    @override_settings(RESPONSE_COMPRESSION_MIN_BYTES=10 ** 9)
+    def test_small_response_is_not_compressed(self):
+        response = self.client.get(f'/api/estimates/{self.estimate.pk}/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_streaming_response_is_compressed(self):
+        response = self.client.get(
+            '/api/estimates/compare/', {'a': self.estimate.pk, 'b': self.estimate.pk}, HTTP_ACCEPT_ENCODING='gzip'
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        result = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual(result['a'], self.estimate.pk)
+
+
+class ExportTests(ApiTestCase):
+
+    def fetch_ndjson(self, url, params=None):
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_item_resources_are_denormalized(self):
+        rows = self.fetch_ndjson('/api/export/estimate-item-resources.ndjson')
+        self.assertEqual(len(rows), EstimateItemResource.objects.count())
+        resource = EstimateItemResource.objects.select_related(
+            'resource', 'estimate_item__section_work_type__section__estimate'
+        ).get(pk=rows[0]['id'])
+        self.assertEqual(rows[0]['resource_name'], resource.resource.name)
+        self.assertEqual(rows[0]['quantity'], resource.quantity)
+        self.assertEqual(rows[0]['estimate'], resource.estimate_item.section_work_type.section.estimate_id)
+
+    def test_items_filtered_by_estimate(self):
+        rows = self.fetch_ndjson('/api/export/estimate-items.ndjson', {'estimate': self.estimate.pk})
+        self.assertTrue(rows)
+        self.assertEqual({row['estimate'] for row in rows}, {self.estimate.pk})
+        self.assertEqual([row['id'] for row in rows], sorted(row['id'] for row in rows))
+
+    def test_invalid_status(self):
+        response = self.client.get('/api/export/estimate-items.ndjson', {'status': 'unknown'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_facts_csv(self):
+        response = self.client.get('/api/export/facts.csv', {'estimate': self.estimate.pk})
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(','), export.FACT_COLUMNS)
+        self.assertEqual(len(lines) - 1, EstimateItemResource.objects.filter(
+            estimate_item__section_work_type__section__estimate=self.estimate
+        ).count())
+
+    @skipUnless(export.pyarrow, 'нужен pyarrow')
+    def test_facts_parquet(self):
+        import pyarrow.parquet
+
+        response = self.client.get('/api/export/facts.parquet')
+        self.assertEqual(response.status_code, 200)
+        table = pyarrow.parquet.read_table(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.column_names, export.FACT_COLUMNS)
+        self.assertEqual(table.num_rows, EstimateItemResource.objects.count())
+        self.assertAlmostEqual(
+            sum(table.column('quantity').to_pylist()),
+            EstimateItemResource.objects.aggregate(total=Sum('quantity'))['total'], places=6
+        )
+
+    def test_base_view_maps_kind_and_format(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from .views import ExportView
+
+        request = APIRequestFactory().get('/', {'estimate': self.estimate.pk})
+        force_authenticate(request, self.user)
+        response = ExportView.as_view(kind='facts')(request)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="facts.ndjson"')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(list(rows[0]), export.FACT_COLUMNS)
+        with self.assertRaises(ImproperlyConfigured):
+            ExportView.as_view(kind='estimate-items', file_format='csv')(request)
+
+
+class UsageTests(ApiTestCase):
+
+    def test_resource_usage_totals(self):
+        item_resource = EstimateItemResource.objects.order_by('pk').first()
+        resource_id = item_resource.resource_id
+        rows = EstimateItemResource.objects.filter(resource_id=resource_id)
+        expected = {}
+        for estimate_id, quantity in rows.values_list('estimate_item__section_work_type__section__estimate_id',
+                                                      'quantity'):
+            expected[estimate_id] = expected.get(estimate_id, 0) + quantity
+
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/resources/{resource_id}/usage/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], len(expected))
+        totals = [row['total'] for row in data['results']]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+        for row in data['results']:
+            self.assertAlmostEqual(row['total'], expected[row['estimate']], places=6)
+            self.assertAlmostEqual(sum(section['total'] for section in row['sections']), row['total'], places=6)
+
+    def test_work_usage_filtered_by_status(self):
+        work_id = EstimateItemResource.objects.order_by('pk').first().estimate_item.work_id
+        Estimate.objects.update(status='draft')
+        response = self.client.get(f'/api/works/{work_id}/usage/', {'status': 'active'})
+        self.assertEqual(response.json(), {'count': 0, 'results': []})
+        response = self.client.get(f'/api/works/{work_id}/usage/', {'status': 'draft', 'ordering': 'estimate'})
+        self.assertTrue(response.json()['results'])
+
+    def test_invalid_ordering(self):
+        response = self.client.get(f'/api/works/{Work.objects.first().pk}/usage/', {'ordering': 'name'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_limit_and_offset(self):
+        url = f'/api/works/{Work.objects.first().pk}/usage/'
+        for params in ({'limit': -1}, {'limit': 0}, {'offset': -1}, {'limit': 'abc'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+
+class SyncTests(TransactionTestCase):
+    """
+    Строки каждого теста зафиксированы: в PostgreSQL синхронизация не выдает строки
+    незавершенных транзакций, в том числе транзакции теста
+    """
+
+    def setUp(self):
+        generate_synthetic_data(ApiTestCase.synthetic_config)
+        self.estimate = Estimate.objects.order_by('pk').first()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def sync(self, since, limit=50):
+        response = self.client.get('/api/sync/', {'since': since, 'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_full_then_incremental_sync(self):
+        from apps.estimates.sync import KINDS
+
+        since, rows, cursors = '0', {kind: set() for kind in KINDS}, []
+        while True:
+            data = self.sync(since, limit=7)
+            for kind, changed in data['changes'].items():
+                rows[kind].update(row['id'] for row in changed)
+                cursors.extend((row['change_xid'], row['change_seq']) for row in changed)
+            since = data['next']
+            if not data['has_more']:
+                break
+        self.assertEqual(cursors, sorted(cursors))
+        self.assertEqual(len(cursors), len(set(cursors)))
+        for kind, model in KINDS.items():
+            self.assertEqual(rows[kind], set(model._base_manager.values_list('pk', flat=True)))
+        self.assertEqual(self.sync(since), {
+            'since': since, 'next': since, 'has_more': False,
+            'changes': {kind: [] for kind in KINDS}, 'deleted': {kind: [] for kind in KINDS},
+        })
+
+        changed, deleted = EstimateItemResource.objects.order_by('pk')[:2]
+        EstimateItemResource.objects.filter(pk=changed.pk).update(quantity=123.0)
+        deleted_id = deleted.pk
+        deleted.delete()
+        self.estimate.delete()
+        # отметка очистки, граница видимости (PostgreSQL), таблицы, удаления, проверка удаленных id
+        with self.assertNumQueries(len(KINDS) + 3 + (connection.vendor == 'postgresql')):
+            data = self.sync(since)
+        self.assertEqual([row['id'] for row in data['changes']['estimates']], [self.estimate.pk])
+        self.assertIsNotNone(data['changes']['estimates'][0]['deleted_at'])
+        self.assertEqual([(row['id'], row['quantity']) for row in data['changes']['estimate-item-resources']],
+                         [(changed.pk, 123.0)])
+        self.assertEqual(data['deleted']['estimate-item-resources'], [deleted_id])
+        estimate = data['changes']['estimates'][0]
+        self.assertEqual(data['next'], f"{estimate['change_xid']}:{estimate['change_seq']}")
+
+    def test_invalid_params(self):
+        for params in ({'since': 'x'}, {'since': 5}, {'since': '1:-2'}, {'since': '1:2:3'}, {'limit': 0}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/sync/', params).status_code, 400)
+
+    def test_tombstone_retention(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from apps.estimates import sync
+        from apps.estimates.models import EstimateTombstone
+
+        since = self.sync('0', limit=10000)['next']
+        deleted = list(EstimateItemResource.objects.order_by('pk')[:3])
+        for row in deleted:
+            row.delete()
+        EstimateTombstone.objects.update(deleted_at=timezone.now() - timedelta(days=40))
+        kept = EstimateItemResource.objects.order_by('pk').first()
+        kept_id = kept.pk
+        kept.delete()
+
+        call_command('purge_deleted_estimates', batch_size=2, stdout=StringIO())
+        self.assertEqual(list(EstimateTombstone.objects.values_list('kind', flat=True)),
+                         [sync.PRUNED, 'estimate-item-resources'])
+        response = self.client.get('/api/sync/', {'since': since})
+        self.assertEqual(response.status_code, 410)
+        # новая полная синхронизация: удаленных строк нет в таблицах, в deleted - только после очистки
+        data = self.sync('0', limit=10000)
+        self.assertEqual(data['deleted']['estimate-item-resources'], [kept_id])
+        self.assertEqual(self.sync(data['next'])['changes']['estimates'], [])
+
+    def test_deleted_row_that_exists_again(self):
+        from apps.estimates.models import EstimateTombstone
+
+        since = self.sync('0', limit=10000)['next']
+        row = EstimateItemResource.objects.order_by('pk').first()
+        # удаление старше строки с тем же id (загрузка архива вернула строку)
+        EstimateTombstone.objects.create(kind='estimate-item-resources', row_id=row.pk, change_seq=10 ** 12)
+        EstimateItemResource.objects.filter(pk=row.pk).update(quantity=5.0)
+        data = self.sync(since)
+        self.assertEqual(data['deleted']['estimate-item-resources'], [])
+        self.assertEqual([item['id'] for item in data['changes']['estimate-item-resources']], [row.pk])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'номера транзакций - только PostgreSQL')
+class SyncVisibilityTests(TransactionTestCase):
+    """Строка, зафиксированная после выдачи курсора, но записанная раньше, не теряется"""
+
+    def test_rows_of_running_transactions_are_held_back(self):
+        from django.db import connections
+        from apps.estimates import sync
+
+        generate_synthetic_data(ApiTestCase.synthetic_config)
+        first, second = EstimateItemResource.objects.order_by('pk')[:2]
+        since = sync.parse_cursor(sync.changes(limit=10000)['next'])
+
+        other = connections.create_connection('default')
+        try:
+            other.set_autocommit(False)
+            with other.cursor() as cursor:
+                # номер изменения раньше, фиксация позже
+                cursor.execute(
+                    f'UPDATE {EstimateItemResource._meta.db_table} SET quantity = 1 WHERE id = %s', [first.pk]
+                )
+            EstimateItemResource.objects.filter(pk=second.pk).update(quantity=2)
+            held = sync.changes(since)
+            self.assertEqual(held['changes']['estimate-item-resources'], [])
+            self.assertEqual(sync.parse_cursor(held['next']), since)
+            other.commit()
+        finally:
+            other.close()
+
+        changed = sync.changes(since)['changes']['estimate-item-resources']
+        self.assertEqual([(row['id'], row['quantity']) for row in changed], [(first.pk, 1.0), (second.pk, 2.0)])
+        self.assertTrue(all(row['change_xid'] > 0 for row in changed))
@@ -5,6 +5,7 @@ from .views import (
     WorkTypeWorkViewSet, WorkResourceViewSet,
     EstimateViewSet, EstimateSectionViewSet, EstimateSectionWorkTypeViewSet,
     EstimateItemViewSet, EstimateItemResourceViewSet,
+    ReferenceAutocompleteView, CatalogImportView, NDJSONExportView, FactExportView, SyncView,
     CustomAuthToken, LogoutView
 )
 
@@ -23,6 +24,15 @@ router.register(r'estimate-item-resources', EstimateItemResourceViewSet, basenam
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('reference/autocomplete/', ReferenceAutocompleteView.as_view(), name='reference_autocomplete'),
+    path('reference/import/', CatalogImportView.as_view(), name='reference_import'),
+    path('export/estimate-items.ndjson', NDJSONExportView.as_view(kind='estimate-items'),
+         name='export_estimate_items'),
+    path('export/estimate-item-resources.ndjson', NDJSONExportView.as_view(kind='estimate-item-resources'),
+         name='export_estimate_item_resources'),
+    path('export/facts.parquet', FactExportView.as_view(file_format='parquet'), name='export_facts_parquet'),
+    path('export/facts.csv', FactExportView.as_view(file_format='csv'), name='export_facts_csv'),
+    path('sync/', SyncView.as_view(), name='sync'),
     path('auth/login/', CustomAuthToken.as_view(), name='api_token_auth'),
     path('auth/logout/', LogoutView.as_view(), name='api_logout'),
 ]
\ No newline at end of file
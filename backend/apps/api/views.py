@@ -1,9 +1,20 @@
 from rest_framework import viewsets, filters, views, permissions, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+
+from apps.reference.search import RankedSearchFilter, RankedOrderingFilter
+from apps.reference import autocomplete
+from apps.reference.importer import FORMATS as CATALOG_FORMATS, CatalogImportError, import_catalog, read_rows
+from apps import metrics
 
 from apps.reference.models import (
     WorkCategory, WorkType, Work, Resource,
@@ -11,8 +22,9 @@ from apps.reference.models import (
 )
 from apps.estimates.models import (
     Estimate, EstimateSection, EstimateSectionWorkType,
-    EstimateItem, EstimateItemResource
+    EstimateItem, EstimateItemResource, EstimateSnapshot, EstimateColdStorage
 )
+from apps.estimates import calculation, cold_storage, compare, export, snapshots, substitution, sync, usage
 from .serializers import (
     WorkCategorySerializer, WorkTypeSerializer, WorkSerializer,
     ResourceSerializer, WorkTypeWorkSerializer, WorkResourceSerializer,
@@ -20,9 +32,17 @@ from .serializers import (
     EstimateSectionWorkTypeSerializer, EstimateItemSerializer,
     EstimateItemResourceSerializer,
     EstimateDetailSerializer, EstimateSectionDetailSerializer,
-    EstimateSectionWorkTypeDetailSerializer, EstimateItemDetailSerializer
+    EstimateSectionWorkTypeDetailSerializer, EstimateItemDetailSerializer,
+    EstimateSnapshotSerializer
 )
 
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _flag(data, name, default=True):
+    """Флаг из JSON (true/false) или формы ('true'/'false', '1'/'0')"""
+    return str(data.get(name, default)).lower() not in ('false', '0')
+
 
 # ========== Reference ViewSets ==========
 
@@ -38,29 +58,122 @@ class WorkCategoryViewSet(viewsets.ModelViewSet):
 class WorkTypeViewSet(viewsets.ModelViewSet):
     queryset = WorkType.objects.select_related('category').all()
     serializer_class = WorkTypeSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, RankedSearchFilter, RankedOrderingFilter]
     filterset_fields = ['category']
     search_fields = ['name', 'category__name']
     ordering_fields = ['category', 'name']
     ordering = ['category', 'name']
 
+    @action(detail=False, methods=['post'], url_path='sweep')
+    def sweep(self, request):
+        """
+        Итоги по ресурсам для вариантов площадь x набор процентов без создания ВОР:
+        {"work_types": [id, ...], "areas": [...], "mixes": [[% по типам работ], ...]}
+        totals[i][j] - итоги варианта areas[i], mixes[j] в порядке списка resources
+        """
+        data = request.data
+        if not isinstance(data, dict):
+            return Response(
+                {'error': 'Ожидается объект с work_types, areas и mixes'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            resource_ids, totals = calculation.sweep(
+                data.get('work_types') or [], data.get('areas') or [], data.get('mixes') or []
+            )
+        except calculation.CalculationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        names = {
+            pk: (name, unit)
+            for pk, name, unit in Resource.objects.filter(pk__in=resource_ids).values_list('pk', 'name', 'unit')
+        }
+        return Response({
+            'resources': [
+                {'id': pk, 'name': names[pk][0], 'unit': names[pk][1]} for pk in resource_ids
+            ],
+            'totals': totals.round(6).tolist(),
+        })
+
+
+class UsageMixin:
+    """
+    GET .../{id}/usage/?status=active&ordering=-quantity&limit=100&offset=0
+    ВОР и разделы, где используется работа / ресурс, с объемами / количествами
+    """
+    usage_kind = None
+    usage_max_limit = 1000
+
+    @action(detail=True, methods=['get'], url_path='usage')
+    def usage(self, request, pk=None):
+        obj = self.get_object()
+        params = request.query_params
+        status_filter = params.get('status')
+        if status_filter and status_filter not in dict(Estimate.STATUS_CHOICES):
+            return Response({'error': f'Неизвестный статус: {status_filter}'}, status=status.HTTP_400_BAD_REQUEST)
+        ordering = params.get('ordering', '-quantity')
+        if ordering not in usage.ORDERINGS:
+            return Response(
+                {'error': f"ordering: {', '.join(usage.ORDERINGS)}"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = int(params.get('limit', 100))
+            offset = int(params.get('offset', 0))
+        except ValueError:
+            return Response({'error': 'limit и offset должны быть числами'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1 or offset < 0:
+            return Response({'error': 'limit >= 1, offset >= 0'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = min(limit, self.usage_max_limit)
+        return Response(usage.usage(self.usage_kind, obj.pk, status_filter, ordering, limit, offset))
+
 
-class WorkViewSet(viewsets.ModelViewSet):
+class WorkViewSet(UsageMixin, viewsets.ModelViewSet):
     queryset = Work.objects.all()
     serializer_class = WorkSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [RankedSearchFilter, RankedOrderingFilter]
     search_fields = ['name', 'unit']
     ordering_fields = ['name']
     ordering = ['name']
+    usage_kind = 'work'
 
 
-class ResourceViewSet(viewsets.ModelViewSet):
+class ResourceViewSet(UsageMixin, viewsets.ModelViewSet):
     queryset = Resource.objects.all()
     serializer_class = ResourceSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [RankedSearchFilter, RankedOrderingFilter]
     search_fields = ['name', 'unit']
     ordering_fields = ['name']
     ordering = ['name']
+    usage_kind = 'resource'
+
+    @action(detail=True, methods=['post'], url_path='substitute', permission_classes=[permissions.IsAdminUser])
+    def substitute(self, request, pk=None):
+        """
+        Замена ресурса на другой в шаблонах и/или ВОР:
+        {"target": id, "coefficient": 1.0, "templates": true, "estimates": true, "estimate_ids": [...]}
+        """
+        source = self.get_object()
+        data = request.data
+        if not isinstance(data, dict):
+            return Response({'error': 'Ожидается объект JSON'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            target = Resource.objects.get(pk=int(data.get('target')))
+        except (TypeError, ValueError, Resource.DoesNotExist):
+            return Response({'error': 'Не найден ресурс для замены (target)'}, status=status.HTTP_400_BAD_REQUEST)
+        estimate_ids = data.get('estimate_ids')
+        if estimate_ids is not None and not (
+            isinstance(estimate_ids, list) and all(isinstance(value, int) for value in estimate_ids)
+        ):
+            return Response({'error': 'estimate_ids: ожидается список id ВОР'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = substitution.substitute_resource(
+                source, target,
+                coefficient=data.get('coefficient', 1.0),
+                templates=_flag(data, 'templates'),
+                estimates=_flag(data, 'estimates'),
+                estimate_ids=estimate_ids,
+            )
+        except substitution.SubstitutionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
 
 
 class WorkTypeWorkViewSet(viewsets.ModelViewSet):
@@ -83,6 +196,57 @@ class WorkResourceViewSet(viewsets.ModelViewSet):
     ordering = ['work_type', 'work', 'resource']
 
 
+class ReferenceAutocompleteView(views.APIView):
+    """
+    Автодополнение по справочникам из индекса в памяти процесса
+    GET /api/reference/autocomplete/?kind=work&q=плен&limit=20
+    kind: work, resource, work_type, work_category
+    """
+    serializer_class = None
+    max_limit = 100
+
+    def get(self, request):
+        kind = request.query_params.get('kind', 'work')
+        if kind not in autocomplete.KINDS:
+            return Response(
+                {'error': f"Неизвестный kind '{kind}'. Допустимые: {', '.join(autocomplete.KINDS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), self.max_limit)
+        except ValueError:
+            return Response({'error': 'limit должен быть числом'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'limit >= 1'}, status=status.HTTP_400_BAD_REQUEST)
+        query = request.query_params.get('q', '')
+        return Response(autocomplete.autocomplete(kind, query, limit))
+
+
+class CatalogImportView(views.APIView):
+    """
+    Массовая загрузка справочника и норм расхода (см. apps.reference.importer)
+    POST /api/reference/import/ multipart: file, format (csv/xlsx/json, по умолчанию по расширению), dry_run
+    """
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+    serializer_class = None
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Не передан файл (file)'}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('format') or upload.name.rsplit('.', 1)[-1].lower()
+        if file_format not in CATALOG_FORMATS:
+            return Response({'error': f"Формат: {', '.join(CATALOG_FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        try:
+            stats = import_catalog(read_rows(upload.file, file_format), dry_run=dry_run)
+        except CatalogImportError as e:
+            return Response({'error': str(e), 'errors': e.errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'dry_run': dry_run, 'stats': stats})
+
+
 # ========== Estimates ViewSets ==========
 
 class EstimateViewSet(viewsets.ModelViewSet):
@@ -98,9 +262,118 @@ class EstimateViewSet(viewsets.ModelViewSet):
             return EstimateDetailSerializer
         return EstimateSerializer
 
+    def perform_update(self, serializer):
+        # Смена статуса с «Архив» возвращает строки из холодного хранения (Estimate.save)
+        try:
+            serializer.save()
+        except cold_storage.ColdStorageError as e:
+            raise ValidationError({'status': [str(e)]})
+
+    def retrieve(self, request, *args, **kwargs):
+        """Архивная ВОР из холодного хранения раскрывается из сжатого документа"""
+        estimate = self.get_object()
+        data = self.get_serializer(estimate).data
+        cold = None
+        if estimate.status == 'archived':
+            cold = EstimateColdStorage.objects.filter(estimate=estimate).first()
+        if cold is not None:
+            data['sections'] = cold_storage.tree(estimate, cold)
+            data['sections_count'] = len(data['sections'])
+            data['cold_storage'] = {'archived_at': cold.archived_at, 'size': cold.size, 'rows_count': cold.rows_count}
+        return Response(data)
+
+    @action(detail=False, methods=['get'], url_path='compare')
+    def compare(self, request):
+        """
+        Сравнение двух ВОР: ?a=<id>&b=<id>[&tolerance=1e-9]
+        Только отличающиеся разделы, типы работ, объемы работ и итоги по ресурсам
+        с абсолютной и относительной разницей; ответ отдается потоком.
+        """
+        try:
+            ids = [int(request.query_params[name]) for name in ('a', 'b')]
+            tolerance = float(request.query_params.get('tolerance', compare.DEFAULT_TOLERANCE))
+        except (KeyError, ValueError):
+            return Response({'error': 'Укажите id ВОР в параметрах a и b'}, status=status.HTTP_400_BAD_REQUEST)
+        found = set(self.get_queryset().filter(pk__in=ids).values_list('pk', flat=True))
+        missing = [str(pk) for pk in ids if pk not in found]
+        if missing:
+            return Response({'error': f"ВОР не найдены: {', '.join(missing)}"}, status=status.HTTP_404_NOT_FOUND)
+        cold = sorted(EstimateColdStorage.objects.filter(estimate__in=ids).values_list('estimate_id', flat=True))
+        if cold:
+            return Response(
+                {'error': f"ВОР в холодном хранении, сначала смените статус: {', '.join(map(str, cold))}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return StreamingHttpResponse(compare.stream_json(*ids, tolerance=tolerance), content_type='application/json')
+
+    @action(detail=True, methods=['post'], url_path='preview')
+    def preview(self, request, pk=None):
+        """
+        Предпросмотр изменений без сохранения: площади разделов, проценты,
+        добавление и удаление типов работ (формат - calculation.preview)
+        """
+        estimate = self.get_object()
+        try:
+            result = calculation.preview(estimate, request.data)
+        except calculation.CalculationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
+
+    @action(detail=True, methods=['get', 'post'], url_path='snapshots')
+    def snapshots(self, request, pk=None):
+        """Версии ВОР: GET - список, POST {"comment": ...} - сохранить текущее состояние"""
+        estimate = self.get_object()
+        if request.method == 'POST':
+            if not isinstance(request.data, dict):
+                return Response({'error': 'Ожидается объект JSON'}, status=status.HTTP_400_BAD_REQUEST)
+            snapshot = snapshots.create_snapshot(estimate, comment=str(request.data.get('comment', ''))[:255])
+            return Response(EstimateSnapshotSerializer(snapshot).data, status=status.HTTP_201_CREATED)
+        queryset = EstimateSnapshot.objects.filter(estimate=estimate).defer('data').order_by('-version')
+        return Response(EstimateSnapshotSerializer(queryset, many=True).data)
+
+    @action(detail=True, methods=['get'], url_path='snapshots/diff')
+    def snapshots_diff(self, request, pk=None):
+        """Сравнение версий: ?a=<id>&b=<id>; без b - с текущим состоянием ВОР"""
+        estimate = self.get_object()
+        documents = {}
+        for name in ('a', 'b'):
+            snapshot_id = request.query_params.get(name)
+            if snapshot_id is None and name == 'b':
+                documents[name] = snapshots.capture(estimate)
+                continue
+            try:
+                snapshot = EstimateSnapshot.objects.get(estimate=estimate, pk=int(snapshot_id))
+            except (TypeError, ValueError, EstimateSnapshot.DoesNotExist):
+                return Response({'error': f'Версия {name} не найдена'}, status=status.HTTP_400_BAD_REQUEST)
+            documents[name] = snapshots.load(snapshot)
+        return Response({
+            'a': int(request.query_params['a']),
+            'b': int(request.query_params['b']) if 'b' in request.query_params else None,
+            **snapshots.diff(documents['a'], documents['b']),
+        })
+
+    @action(detail=True, methods=['post'], url_path=r'snapshots/(?P<snapshot_id>\d+)/restore')
+    def snapshots_restore(self, request, pk=None, snapshot_id=None):
+        """Восстановление версии; текущее состояние сохраняется новой версией (backup=false - без этого)"""
+        estimate = self.get_object()
+        try:
+            snapshot = EstimateSnapshot.objects.get(estimate=estimate, pk=snapshot_id)
+        except EstimateSnapshot.DoesNotExist:
+            return Response({'error': 'Версия не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Ожидается объект JSON'}, status=status.HTTP_400_BAD_REQUEST)
+        backup = _flag(request.data, 'backup')
+        backup_snapshot = snapshots.restore_snapshot(snapshot, backup=backup)
+        return Response({
+            'restored': EstimateSnapshotSerializer(snapshot).data,
+            'backup': EstimateSnapshotSerializer(backup_snapshot).data if backup_snapshot else None,
+        })
+
 
 class EstimateSectionViewSet(viewsets.ModelViewSet):
-    queryset = EstimateSection.objects.select_related('estimate', 'work_category').prefetch_related('work_types').all()
+    queryset = EstimateSection.objects.select_related('estimate', 'work_category').prefetch_related('work_types').filter(
+        estimate__deleted_at__isnull=True
+    )
     serializer_class = EstimateSectionSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['estimate', 'work_category']
@@ -115,7 +388,9 @@ class EstimateSectionViewSet(viewsets.ModelViewSet):
 
 
 class EstimateSectionWorkTypeViewSet(viewsets.ModelViewSet):
-    queryset = EstimateSectionWorkType.objects.select_related('section', 'work_type').prefetch_related('items').all()
+    queryset = EstimateSectionWorkType.objects.select_related('section', 'work_type').prefetch_related('items').filter(
+        section__estimate__deleted_at__isnull=True
+    )
     serializer_class = EstimateSectionWorkTypeSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['section', 'work_type']
@@ -130,7 +405,9 @@ class EstimateSectionWorkTypeViewSet(viewsets.ModelViewSet):
 
 
 class EstimateItemViewSet(viewsets.ModelViewSet):
-    queryset = EstimateItem.objects.select_related('section_work_type', 'work').prefetch_related('resources').all()
+    queryset = EstimateItem.objects.select_related('section_work_type', 'work').prefetch_related('resources').filter(
+        section_work_type__section__estimate__deleted_at__isnull=True
+    )
     serializer_class = EstimateItemSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['section_work_type', 'work']
@@ -145,15 +422,105 @@ class EstimateItemViewSet(viewsets.ModelViewSet):
 
 
 class EstimateItemResourceViewSet(viewsets.ModelViewSet):
-    queryset = EstimateItemResource.objects.select_related('estimate_item', 'resource').all()
+    queryset = EstimateItemResource.objects.select_related('estimate_item', 'resource').filter(
+        estimate__deleted_at__isnull=True
+    )
     serializer_class = EstimateItemResourceSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['estimate_item', 'resource']
+    filterset_fields = ['estimate', 'estimate_item', 'resource']
     search_fields = ['resource__name', 'estimate_item__work__name']
     ordering_fields = ['estimate_item', 'resource']
     ordering = ['estimate_item', 'resource']
 
 
+class ExportView(views.APIView):
+    """
+    Потоковые выгрузки строк ВОР; фильтры ?estimate=<id> (можно несколько) и ?status=
+    kind - выгрузка из export.EXPORTS; file_format: ndjson - любая выгрузка, csv и parquet - таблица фактов
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = None
+    kind = None
+    file_format = 'ndjson'
+    CONTENT_TYPES = {
+        'ndjson': export.NDJSON_CONTENT_TYPE,
+        'csv': 'text/csv; charset=utf-8',
+        'parquet': 'application/vnd.apache.parquet',
+    }
+
+    def get(self, request):
+        try:
+            estimate_ids = [int(value) for value in request.query_params.getlist('estimate')]
+        except ValueError:
+            return Response({'error': 'estimate: ожидается id ВОР'}, status=status.HTTP_400_BAD_REQUEST)
+        status_filter = request.query_params.get('status')
+        if status_filter and status_filter not in dict(Estimate.STATUS_CHOICES):
+            return Response({'error': f'Неизвестный статус: {status_filter}'}, status=status.HTTP_400_BAD_REQUEST)
+        return self.stream(estimate_ids, status_filter)
+
+    def stream(self, estimate_ids, status_filter):
+        if self.kind not in export.EXPORTS or self.file_format not in self.CONTENT_TYPES or (
+            self.file_format != 'ndjson' and self.kind != 'facts'
+        ):
+            raise ImproperlyConfigured(f'Нет выгрузки {self.kind} в формате {self.file_format}')
+        if self.file_format == 'ndjson':
+            content = export.iter_ndjson(self.kind, estimate_ids, status_filter)
+        elif self.file_format == 'csv':
+            content = export.iter_csv(estimate_ids, status_filter)
+        elif export.pyarrow is None:
+            return Response({'error': 'Для выгрузки в Parquet нужен пакет pyarrow'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        else:
+            content = export.iter_parquet(estimate_ids, status_filter)
+        return self.attachment(content, self.CONTENT_TYPES[self.file_format], f'{self.kind}.{self.file_format}')
+
+    def attachment(self, content, content_type, file_name):
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+        return response
+
+
+class NDJSONExportView(ExportView):
+    """
+    Выгрузка строк ВОР в NDJSON для интеграций
+    GET /api/export/estimate-items.ndjson?estimate=1&estimate=2&status=active
+    """
+
+
+class FactExportView(ExportView):
+    """
+    Таблица фактов для аналитики: GET /api/export/facts.parquet или /api/export/facts.csv
+    """
+    kind = 'facts'
+    file_format = None
+
+
+class SyncView(views.APIView):
+    """
+    Изменения строк ВОР после курсора: GET /api/sync/?since=<next>&limit=1000
+    (см. apps/estimates/sync.py); 410 - курсор устарел, синхронизация заново с since=0
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = None
+
+    def get(self, request):
+        try:
+            since = sync.parse_cursor(request.query_params.get('since', '0'))
+        except ValueError:
+            return Response({'error': "since - 0 или next прошлого ответа ('<xid>:<seq>')"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', sync.LIMIT))
+        except ValueError:
+            return Response({'error': 'limit должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'limit >= 1'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return Response(sync.changes(since, min(limit, sync.MAX_LIMIT)))
+        except sync.CursorExpired as e:
+            return Response({'error': str(e)}, status=status.HTTP_410_GONE)
+
+
 # ========== Authentication Views ==========
 
 class CustomAuthToken(ObtainAuthToken):
@@ -182,4 +549,22 @@ class LogoutView(views.APIView):
                           status=status.HTTP_200_OK)
         except Exception as e:
             return Response({'error': str(e)}, 
-                          status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+                          status=status.HTTP_400_BAD_REQUEST)
+
+
+# ========== Metrics ==========
+
+def metrics_view(request):
+    """
+    Метрики в текстовом формате Prometheus
+    Доступ - по заголовку Authorization: Bearer <METRICS_TOKEN> или сотруднику (сессия админки);
+    без токена в настройках и с DEBUG метрики открыты.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        allowed = settings.DEBUG
+    if not (allowed or request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.REGISTRY.expose(), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,9 +1,16 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.db.models import Count, OuterRef, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils.html import format_html
 from django.urls import reverse
+from apps.reference.admin_utils import (
+    WorkTypeListFilter, AutocompleteListFilter, AutocompleteFilterMixin,
+    EstimatedCountPaginator
+)
+from apps.reference.expressions import SubqueryCount
 from .models import (
     Estimate, EstimateSection, EstimateSectionWorkType,
-    EstimateItem, EstimateItemResource
+    EstimateItem, EstimateItemResource, EstimateSnapshot, EstimateColdStorage
 )
 
 
@@ -64,6 +71,7 @@ class EstimateAdmin(admin.ModelAdmin):
     list_display_links = ['name']
     inlines = [EstimateSectionInline]
     readonly_fields = ['created_at']
+    actions = ['move_to_cold_storage']
     
     fieldsets = (
         ('Основная информация', {
@@ -76,38 +84,74 @@ class EstimateAdmin(admin.ModelAdmin):
         }),
     )
     
+    @admin.action(description="Перенести в холодное хранение (статус «Архив»)", permissions=['change'])
+    def move_to_cold_storage(self, request, queryset):
+        """Строки ВОР сжимаются в документ и удаляются из таблиц (см. cold_storage.py)"""
+        from .cold_storage import archivable, archive_estimate
+
+        estimates = list(archivable().filter(pk__in=queryset.values('pk')))
+        rows = sum(archive_estimate(estimate).rows_count for estimate in estimates)
+        skipped = queryset.count() - len(estimates)
+        self.message_user(
+            request, f"В холодное хранение перенесено ВОР: {len(estimates)} (строк: {rows})", messages.SUCCESS
+        )
+        if skipped:
+            self.message_user(
+                request, f"Пропущено ВОР: {skipped} - статус не «Архив» или уже в холодном хранении",
+                messages.WARNING
+            )
+
+    def get_deleted_objects(self, objs, request):
+        """
+        Удаление мягкое (строки ВОР удаляет purge_deleted_estimates), поэтому на странице
+        подтверждения - только сами ВОР, без обхода всего дерева сборщиком удаления
+        """
+        objs = list(objs)
+        return [str(obj) for obj in objs], {self.model._meta.verbose_name_plural: len(objs)}, set(), []
+
+    def get_queryset(self, request):
+        """Счетчики считаются подзапросами в одном SQL-запросе списка"""
+        qs = super().get_queryset(request)
+        return qs.annotate(
+            _sections_count=SubqueryCount(
+                EstimateSection.objects.filter(estimate=OuterRef('pk')).order_by().values('pk')
+            ),
+            _works_count=SubqueryCount(
+                EstimateItem.objects.filter(
+                    section_work_type__section__estimate=OuterRef('pk')
+                ).order_by().values('pk')
+            ),
+            _resources_count=SubqueryCount(
+                EstimateItemResource.objects.filter(estimate=OuterRef('pk')).order_by().values('pk')
+            ),
+        )
+    
     def sections_count(self, obj):
         """Количество видов работ в ВОР"""
-        count = obj.sections.count()
         return format_html(
             '<span style="font-weight: bold; color: #0066cc;">{} видов работ</span>',
-            count
+            obj._sections_count
         )
     sections_count.short_description = "Видов работ"
+    sections_count.admin_order_field = '_sections_count'
     
     def works_count(self, obj):
         """Количество работ в ВОР"""
-        from .models import EstimateItem
-        count = EstimateItem.objects.filter(
-            section_work_type__section__estimate=obj
-        ).count()
         return format_html(
             '<span style="font-weight: bold; color: #28a745;">{} работ</span>',
-            count
+            obj._works_count
         )
     works_count.short_description = "Работ"
+    works_count.admin_order_field = '_works_count'
     
     def resources_count(self, obj):
         """Количество ресурсов в ВОР"""
-        from .models import EstimateItemResource
-        count = EstimateItemResource.objects.filter(
-            estimate_item__section_work_type__section__estimate=obj
-        ).count()
         return format_html(
             '<span style="font-weight: bold; color: #ffc107;">{} ресурсов</span>',
-            count
+            obj._resources_count
         )
     resources_count.short_description = "Ресурсов"
+    resources_count.admin_order_field = '_resources_count'
     
     def view_works_link(self, obj):
         """Ссылка на просмотр всех работ ВОР"""
@@ -139,6 +183,7 @@ class EstimateSectionAdmin(admin.ModelAdmin):
     list_display_links = ['work_category']
     inlines = [EstimateSectionWorkTypeInline]
     autocomplete_fields = ['estimate', 'work_category']
+    list_select_related = ['estimate', 'work_category']
     
     fieldsets = (
         ('Основная информация', {
@@ -147,6 +192,14 @@ class EstimateSectionAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        """Количество типов работ и сумма процентов - агрегатами в запросе списка"""
+        qs = super().get_queryset(request).filter(estimate__deleted_at__isnull=True)
+        return qs.annotate(
+            _work_types_count=Count('work_types'),
+            _total_percentage=Coalesce(Sum('work_types__percentage'), Value(0.0)),
+        )
+    
     def estimate_link(self, obj):
         """Ссылка на ВОР"""
         url = reverse('admin:estimates_estimate_change', args=[obj.estimate.id])
@@ -166,25 +219,26 @@ class EstimateSectionAdmin(admin.ModelAdmin):
     
     def work_types_count(self, obj):
         """Количество типов работ в разделе"""
-        count = obj.work_types.count()
-        total_percentage = sum(wt.percentage for wt in obj.work_types.all())
+        total_percentage = obj._total_percentage
         color = '#28a745' if abs(total_percentage - 100) < 0.01 else '#dc3545'
         return format_html(
             '<span style="font-weight: bold; color: {};">{} типов ({}%)</span>',
-            color, count, total_percentage
+            color, obj._work_types_count, total_percentage
         )
     work_types_count.short_description = "Типов работ"
+    work_types_count.admin_order_field = '_work_types_count'
 
 
 @admin.register(EstimateSectionWorkType)
 class EstimateSectionWorkTypeAdmin(admin.ModelAdmin):
     """Тип работ в разделе ВОР с процентом"""
     list_display = ['id', 'section_link', 'work_type_link', 'percentage_display', 'items_count']
-    list_filter = ['section__work_category', 'work_type']
+    list_filter = ['section__work_category', ('work_type', WorkTypeListFilter)]
     search_fields = ['section__estimate__name', 'work_type__name']
     list_display_links = ['work_type_link']
     inlines = [EstimateItemInline]
     autocomplete_fields = ['section', 'work_type']
+    list_select_related = ['section__estimate', 'section__work_category', 'work_type__category']
     
     fieldsets = (
         ('Основная информация', {
@@ -193,6 +247,10 @@ class EstimateSectionWorkTypeAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        """Количество работ - агрегатом в запросе списка"""
+        qs = super().get_queryset(request).filter(section__estimate__deleted_at__isnull=True)
+        return qs.annotate(_items_count=Count('items'))
     
     def section_link(self, obj):
         """Ссылка на раздел"""
@@ -222,23 +280,26 @@ class EstimateSectionWorkTypeAdmin(admin.ModelAdmin):
     
     def items_count(self, obj):
         """Количество работ в типе"""
-        count = obj.items.count()
         return format_html(
             '<span style="font-weight: bold; color: #28a745;">{} работ</span>',
-            count
+            obj._items_count
         )
     items_count.short_description = "Работ"
+    items_count.admin_order_field = '_items_count'
 
 
 @admin.register(EstimateItem)
-class EstimateItemAdmin(admin.ModelAdmin):
+class EstimateItemAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     """Работа в ВОР (создается автоматически из шаблона типа работ)"""
     list_display = ['id', 'work_link', 'estimate_link', 'section_work_type_link', 'volume_display']
     list_filter = [
-        'section_work_type__section__estimate',  # Фильтр по ВОР
+        ('section_work_type__section__estimate', AutocompleteListFilter),  # Фильтр по ВОР
         'section_work_type__section__work_category', 
-        'work'
+        ('work', AutocompleteListFilter),
     ]
+    # Таблица большая: оценка количества строк вместо COUNT(*)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     search_fields = [
         'section_work_type__section__estimate__name', 
         'section_work_type__section__estimate__object_name',
@@ -247,6 +308,12 @@ class EstimateItemAdmin(admin.ModelAdmin):
     list_display_links = ['work_link']
     inlines = [EstimateItemResourceInline]
     readonly_fields = ['section_work_type', 'work', 'volume']
+    list_select_related = [
+        'work',
+        'section_work_type__section__estimate',
+        'section_work_type__section__work_category',
+        'section_work_type__work_type',
+    ]
     
     fieldsets = (
         ('Основная информация', {
@@ -255,6 +322,9 @@ class EstimateItemAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(section_work_type__section__estimate__deleted_at__isnull=True)
+
     def has_add_permission(self, request):
         """Запрещаем ручное создание - только через шаблон"""
         return False
@@ -299,14 +369,17 @@ class EstimateItemAdmin(admin.ModelAdmin):
 
 
 @admin.register(EstimateItemResource)
-class EstimateItemResourceAdmin(admin.ModelAdmin):
+class EstimateItemResourceAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     """Ресурс для работы в ВОР (создается автоматически из шаблона)"""
     list_display = ['id', 'resource_link', 'estimate_link', 'estimate_item_link', 'quantity_display']
     list_filter = [
-        'estimate_item__section_work_type__section__estimate',  # Фильтр по ВОР
-        'resource', 
+        ('estimate_item__section_work_type__section__estimate', AutocompleteListFilter),  # Фильтр по ВОР
+        ('resource', AutocompleteListFilter),
         'estimate_item__section_work_type__section__work_category'
     ]
+    # Самая большая таблица: оценка количества строк вместо COUNT(*)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     search_fields = [
         'estimate_item__section_work_type__section__estimate__name',
         'estimate_item__section_work_type__section__estimate__object_name',
@@ -315,6 +388,11 @@ class EstimateItemResourceAdmin(admin.ModelAdmin):
     ]
     list_display_links = ['resource_link']
     readonly_fields = ['estimate_item', 'resource', 'quantity']
+    list_select_related = [
+        'resource',
+        'estimate_item__work',
+        'estimate_item__section_work_type__section__estimate',
+    ]
     
     fieldsets = (
         ('Основная информация', {
@@ -323,6 +401,9 @@ class EstimateItemResourceAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(estimate__deleted_at__isnull=True)
+
     def has_add_permission(self, request):
         """Запрещаем ручное создание - только через шаблон"""
         return False
@@ -361,3 +442,44 @@ class EstimateItemResourceAdmin(admin.ModelAdmin):
             obj.quantity, obj.resource.unit
         )
     quantity_display.short_description = "Количество"
+
+
+@admin.register(EstimateSnapshot)
+class EstimateSnapshotAdmin(admin.ModelAdmin):
+    """Версии ВОР (создаются и восстанавливаются через API)"""
+    list_display = ['id', 'estimate', 'version', 'comment', 'created_at', 'is_delta', 'size', 'rows_count']
+    list_select_related = ['estimate']
+    list_filter = ['created_at']
+    search_fields = ['estimate__name', 'comment']
+    exclude = ['data']
+    readonly_fields = ['estimate', 'version', 'created_at', 'base', 'size', 'rows_count']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(estimate__deleted_at__isnull=True).defer('data')
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(boolean=True, description="Дельта")
+    def is_delta(self, obj):
+        return obj.base_id is not None
+
+
+@admin.register(EstimateColdStorage)
+class EstimateColdStorageAdmin(admin.ModelAdmin):
+    """Архивные ВОР в холодном хранении (переносятся командой archive_estimates)"""
+    list_display = ['estimate', 'archived_at', 'size', 'rows_count']
+    list_select_related = ['estimate']
+    search_fields = ['estimate__name', 'estimate__object_name']
+    exclude = ['data']
+    readonly_fields = ['estimate', 'archived_at', 'size', 'rows_count']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(estimate__deleted_at__isnull=True).defer('data')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        """Строк ВОР в таблицах нет - удаление документа потеряло бы содержимое ВОР"""
+        return False
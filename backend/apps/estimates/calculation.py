@@ -0,0 +1,332 @@
+"""
+Расчет ВОР в памяти, без записи в базу
+
+preview - «что будет, если»: предлагаемые изменения площадей разделов, процентов,
+добавление и удаление типов работ. Пересчет повторяет логику моделей
+(EstimateSection.save / EstimateSectionWorkType.save):
+- у измененного типа работ пересчитываются существующие работы и ресурсы по шаблону,
+  работы и ресурсы, которых больше нет в шаблоне, удаляются;
+- новый тип работ создает работы и ресурсы по шаблону целиком.
+Затрагиваются только измененные типы работ, итоги по ресурсам - текущие итоги ВОР
+минус старый вклад плюс новый.
+
+sweep - перебор вариантов для набора типов работ: площади x наборы процентов.
+Итог по ресурсу линеен по площади и процентам, поэтому шаблоны сводятся к матрице
+норм «тип работ x ресурс» (сумма объем на ед. * расход на ед. по работам), а все
+варианты считаются одним broadcast NumPy.
+"""
+import math
+from collections import defaultdict
+
+import numpy as np
+from django.db.models import Sum
+
+from apps.reference.models import WorkType, Work, Resource, WorkTypeWork, WorkResource
+from .models import EstimateSection, EstimateSectionWorkType, EstimateItem, EstimateItemResource
+
+
+EPSILON = 1e-9
+
+
+class CalculationError(ValueError):
+    """Некорректные входные данные расчета"""
+
+
+def _number(value, name, minimum=0.0, maximum=None):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise CalculationError(f'{name}: ожидается число')
+    if not math.isfinite(number):
+        raise CalculationError(f'{name}: ожидается конечное число')
+    if number < minimum or (maximum is not None and number > maximum):
+        raise CalculationError(f'{name}: значение вне диапазона')
+    return number
+
+
+def _id(value, name):
+    # bool - подкласс int, но id не является
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise CalculationError(f'{name}: ожидается id')
+    return value
+
+
+def _list(value, name):
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise CalculationError(f'{name}: ожидается список')
+    for entry in value:
+        if not isinstance(entry, dict):
+            raise CalculationError(f'{name}: ожидается список объектов')
+    return value
+
+
+def load_templates(work_type_ids):
+    """
+    Шаблоны типов работ: ({work_type_id: [(work_id, volume_per_unit), ...]},
+    {(work_type_id, work_id): [(resource_id, quantity_per_unit), ...]})
+    """
+    works = defaultdict(list)
+    for work_type_id, work_id, volume_per_unit in (
+        WorkTypeWork.objects.filter(work_type_id__in=work_type_ids)
+        .order_by('work_type_id', 'order_index', 'pk')
+        .values_list('work_type_id', 'work_id', 'work_volume_per_unit')
+    ):
+        works[work_type_id].append((work_id, volume_per_unit))
+    norms = defaultdict(list)
+    for work_type_id, work_id, resource_id, quantity_per_unit in (
+        WorkResource.objects.filter(work_type_id__in=work_type_ids)
+        .order_by('pk')
+        .values_list('work_type_id', 'work_id', 'resource_id', 'quantity_per_unit')
+    ):
+        norms[(work_type_id, work_id)].append((resource_id, quantity_per_unit))
+    return works, norms
+
+
+def preview(estimate, changes):
+    """
+    changes = {
+        "sections": [{"id": 5, "total_area": 120}],
+        "work_types": [
+            {"id": 12, "percentage": 40},                        # изменить процент
+            {"id": 14, "delete": true},                          # удалить тип работ
+            {"section": 5, "work_type": 33, "percentage": 20}    # добавить тип работ
+        ]
+    }
+    Возвращает измененные работы, изменения итогов по ресурсам и суммы процентов по разделам.
+    """
+    if not isinstance(changes, dict):
+        raise CalculationError('Ожидается объект с sections и work_types')
+    section_changes = _list(changes.get('sections'), 'sections')
+    work_type_changes = _list(changes.get('work_types'), 'work_types')
+    areas = dict(EstimateSection.objects.filter(estimate=estimate).order_by().values_list('pk', 'total_area'))
+    work_types = {
+        pk: {'section': section_id, 'work_type': work_type_id, 'percentage': percentage}
+        for pk, section_id, work_type_id, percentage in EstimateSectionWorkType.objects.filter(
+            section__estimate=estimate
+        ).order_by().values_list('pk', 'section_id', 'work_type_id', 'percentage')
+    }
+
+    new_areas = dict(areas)
+    for change in section_changes:
+        section_id = _id(change.get('id'), 'sections.id')
+        if section_id not in areas:
+            raise CalculationError(f'Раздел {section_id} не найден в ВОР')
+        new_areas[section_id] = _number(change.get('total_area'), 'total_area')
+
+    new_work_types = {pk: dict(state) for pk, state in work_types.items()}
+    deleted = set()
+    added = []
+    pairs = {(state['section'], state['work_type']) for state in work_types.values()}
+    for change in work_type_changes:
+        if 'id' in change:
+            pk = _id(change['id'], 'work_types.id')
+            if pk not in work_types:
+                raise CalculationError(f'Тип работ {pk} не найден в ВОР')
+            if change.get('delete'):
+                deleted.add(pk)
+            else:
+                new_work_types[pk]['percentage'] = _number(change.get('percentage'), 'percentage', maximum=100)
+            continue
+        section_id = _id(change.get('section'), 'work_types.section')
+        if section_id not in areas:
+            raise CalculationError(f'Раздел {section_id} не найден в ВОР')
+        work_type_id = _id(change.get('work_type'), 'work_types.work_type')
+        if (section_id, work_type_id) in pairs:
+            raise CalculationError(f'Тип работ {work_type_id} уже есть в разделе {section_id}')
+        pairs.add((section_id, work_type_id))
+        added.append({
+            'section': section_id,
+            'work_type': work_type_id,
+            'percentage': _number(change.get('percentage'), 'percentage', maximum=100),
+        })
+    added_work_types = set(
+        WorkType.objects.filter(pk__in=[state['work_type'] for state in added]).order_by().values_list('pk', flat=True)
+    )
+    for state in added:
+        if state['work_type'] not in added_work_types:
+            raise CalculationError(f"Тип работ {state['work_type']} не найден в справочнике")
+
+    # Типы работ, объемы которых меняются
+    affected = {
+        pk for pk, state in new_work_types.items()
+        if pk in deleted
+        or state['percentage'] != work_types[pk]['percentage']
+        or new_areas[state['section']] != areas[state['section']]
+    }
+
+    items = defaultdict(list)
+    for item_id, section_work_type_id, work_id, volume in EstimateItem.objects.filter(
+        section_work_type_id__in=affected
+    ).order_by('pk').values_list('pk', 'section_work_type_id', 'work_id', 'volume'):
+        items[section_work_type_id].append((item_id, work_id, volume))
+    item_resources = defaultdict(list)
+    for item_id, resource_id, quantity in EstimateItemResource.objects.filter(
+        estimate_item__section_work_type_id__in=affected
+    ).order_by('pk').values_list('estimate_item_id', 'resource_id', 'quantity'):
+        item_resources[item_id].append((resource_id, quantity))
+
+    template_works, norms = load_templates(
+        {new_work_types[pk]['work_type'] for pk in affected} | {state['work_type'] for state in added}
+    )
+    volumes_per_unit = {
+        (work_type_id, work_id): volume_per_unit
+        for work_type_id, works in template_works.items()
+        for work_id, volume_per_unit in works
+    }
+    norms_per_unit = {
+        (work_type_id, work_id, resource_id): quantity_per_unit
+        for (work_type_id, work_id), resources in norms.items()
+        for resource_id, quantity_per_unit in resources
+    }
+
+    item_changes = []
+    resource_deltas = defaultdict(float)
+
+    # Существующие типы работ: пересчет по шаблону (как _recalculate_items) или удаление
+    for pk in sorted(affected):
+        state = new_work_types[pk]
+        type_area = new_areas[state['section']] * (state['percentage'] / 100)
+        for item_id, work_id, old_volume in items[pk]:
+            volume_per_unit = None if pk in deleted else volumes_per_unit.get((state['work_type'], work_id))
+            new_volume = None if volume_per_unit is None else type_area * volume_per_unit
+            item_changes.append({
+                'section_work_type': pk, 'work_type': state['work_type'], 'work': work_id,
+                'old_volume': old_volume, 'new_volume': new_volume,
+            })
+            for resource_id, old_quantity in item_resources[item_id]:
+                resource_deltas[resource_id] -= old_quantity
+                quantity_per_unit = norms_per_unit.get((state['work_type'], work_id, resource_id))
+                if new_volume is not None and quantity_per_unit is not None:
+                    resource_deltas[resource_id] += new_volume * quantity_per_unit
+
+    # Новые типы работ: работы и ресурсы по шаблону (как _create_items_from_template)
+    for state in added:
+        type_area = new_areas[state['section']] * (state['percentage'] / 100)
+        for work_id, volume_per_unit in template_works[state['work_type']]:
+            volume = type_area * volume_per_unit
+            item_changes.append({
+                'section_work_type': None, 'work_type': state['work_type'], 'work': work_id,
+                'old_volume': None, 'new_volume': volume,
+            })
+            for resource_id, quantity_per_unit in norms[(state['work_type'], work_id)]:
+                resource_deltas[resource_id] += volume * quantity_per_unit
+
+    changed_resources = [resource_id for resource_id, delta in resource_deltas.items() if abs(delta) > EPSILON]
+    totals = dict(
+        EstimateItemResource.objects.filter(
+            estimate=estimate, resource_id__in=changed_resources
+        ).order_by().values('resource_id').annotate(total=Sum('quantity')).values_list('resource_id', 'total')
+    )
+    resources = {
+        pk: (name, unit)
+        for pk, name, unit in Resource.objects.filter(pk__in=changed_resources).order_by().values_list('pk', 'name', 'unit')
+    }
+    works = {
+        pk: (name, unit)
+        for pk, name, unit in Work.objects.filter(
+            pk__in={change['work'] for change in item_changes}
+        ).order_by().values_list('pk', 'name', 'unit')
+    }
+
+    for change in item_changes:
+        change['work_name'], change['unit'] = works[change['work']]
+        old, new = change['old_volume'], change['new_volume']
+        change['delta'] = (new or 0) - (old or 0)
+
+    percentage_totals = defaultdict(float)
+    for pk, state in new_work_types.items():
+        if pk not in deleted:
+            percentage_totals[state['section']] += state['percentage']
+    for state in added:
+        percentage_totals[state['section']] += state['percentage']
+
+    return {
+        'sections': [
+            {'id': pk, 'total_area': new_areas[pk], 'percentage_total': round(percentage_totals[pk], 6)}
+            for pk in sorted(areas)
+        ],
+        'items': [change for change in item_changes if abs(change['delta']) > EPSILON or
+                  change['old_volume'] is None or change['new_volume'] is None],
+        'resources': sorted(
+            (
+                {
+                    'resource': pk, 'name': resources[pk][0], 'unit': resources[pk][1],
+                    'old_quantity': totals.get(pk, 0.0),
+                    'new_quantity': totals.get(pk, 0.0) + resource_deltas[pk],
+                    'delta': resource_deltas[pk],
+                }
+                for pk in changed_resources
+            ),
+            key=lambda row: row['name']
+        ),
+    }
+
+
+MAX_SWEEP_SCENARIOS = 100_000
+# Площади x наборы x ресурсы: результат float64 и его JSON (~8 МБ массива)
+MAX_SWEEP_VALUES = 1_000_000
+
+
+def norm_matrix(work_type_ids):
+    """
+    Матрица норм (типы работ x ресурсы): расход ресурса на единицу площади типа работ
+    при 100%; учитываются только работы из шаблона, как при создании позиций ВОР
+    """
+    template_works, norms = load_templates(work_type_ids)
+    rows, resource_ids, values = [], [], []
+    for row, work_type_id in enumerate(work_type_ids):
+        for work_id, volume_per_unit in template_works[work_type_id]:
+            for resource_id, quantity_per_unit in norms[(work_type_id, work_id)]:
+                rows.append(row)
+                resource_ids.append(resource_id)
+                values.append(volume_per_unit * quantity_per_unit)
+    resources, columns = np.unique(np.array(resource_ids, dtype=np.int64), return_inverse=True)
+    matrix = np.zeros((len(work_type_ids), len(resources)))
+    np.add.at(matrix, (np.array(rows, dtype=np.intp), columns), np.array(values, dtype=float))
+    return resources.tolist(), matrix
+
+
+def sweep(work_type_ids, areas, mixes):
+    """
+    Итоги по ресурсам для всех сочетаний площадь x набор процентов
+    work_type_ids - T типов работ; areas - S площадей; mixes - M наборов по T процентов.
+    Возвращает (id ресурсов K, массив S x M x K).
+    """
+    if not isinstance(work_type_ids, list):
+        raise CalculationError('work_types: ожидается список id')
+    work_type_ids = [_id(pk, 'work_types') for pk in work_type_ids]
+    if not work_type_ids:
+        raise CalculationError('work_types: пустой список')
+    if len(set(work_type_ids)) != len(work_type_ids):
+        raise CalculationError('work_types: типы работ повторяются')
+    found = set(WorkType.objects.filter(pk__in=work_type_ids).order_by().values_list('pk', flat=True))
+    missing = [pk for pk in work_type_ids if pk not in found]
+    if missing:
+        raise CalculationError(f'Типы работ не найдены в справочнике: {missing}')
+    try:
+        areas = np.asarray(areas, dtype=float)
+        mixes = np.asarray(mixes, dtype=float)
+    except (TypeError, ValueError):
+        raise CalculationError('areas, mixes: ожидаются числа')
+    if areas.ndim != 1 or not areas.size:
+        raise CalculationError('areas: ожидается непустой список чисел')
+    if mixes.ndim != 2 or mixes.shape[1] != len(work_type_ids):
+        raise CalculationError(f'mixes: ожидаются списки по {len(work_type_ids)} процентов')
+    if areas.size * mixes.shape[0] > MAX_SWEEP_SCENARIOS:
+        raise CalculationError(f'Слишком много вариантов (больше {MAX_SWEEP_SCENARIOS})')
+    if not np.isfinite(areas).all() or (areas < 0).any():
+        raise CalculationError('areas: значение вне диапазона')
+    if not np.isfinite(mixes).all() or (mixes < 0).any() or (mixes > 100).any():
+        raise CalculationError('mixes: значение вне диапазона')
+
+    resource_ids, matrix = norm_matrix(work_type_ids)
+    if areas.size * mixes.shape[0] * len(resource_ids) > MAX_SWEEP_VALUES:
+        raise CalculationError(
+            f'Слишком большой результат: {areas.size} x {mixes.shape[0]} вариантов x '
+            f'{len(resource_ids)} ресурсов (больше {MAX_SWEEP_VALUES} значений)'
+        )
+    # (M x T) @ (T x K) -> расход на единицу площади раздела по наборам, затем x площади
+    per_area = (mixes / 100) @ matrix
+    return resource_ids, areas[:, None, None] * per_area[None, :, :]
@@ -0,0 +1,213 @@
+"""
+Холодное хранение ВОР со статусом «Архив»
+
+archive_estimate переносит дерево ВОР (разделы, типы работ, работы, ресурсы) в одну строку
+EstimateColdStorage - сжатый документ в формате версий ВОР (snapshots.encode, без дельты) -
+и удаляет строки ВОР из таблиц: индексы рабочих таблиц не растут за счет архива.
+ВОР по-прежнему открывается детальным запросом API (tree раскрывает документ), снимки
+и сравнение версий читают документ (snapshots.capture). При смене статуса с «Архив»
+(Estimate.save) rehydrate возвращает строки в таблицы bulk_create (snapshots.materialize).
+Записи справочника из документа защищены от удаления строками EstimateColdStorageReference
+(PROTECT), замена ресурса (substitution) переписывает и документы.
+Списки строк, выгрузки и «где используется» архивных ВОР из холодного хранения не видят,
+сравнение ВОР их не принимает.
+"""
+from array import array
+
+from django.db import transaction
+
+from apps.reference.models import WorkCategory, WorkType, Work, Resource
+from . import snapshots
+from .models import (
+    Estimate, EstimateSection, EstimateSectionWorkType,
+    EstimateItem, EstimateItemResource, EstimateColdStorage, EstimateColdStorageReference
+)
+
+
+# таблица -> путь к ВОР; удаление от листьев к корню
+TREE = [
+    (EstimateItemResource, 'estimate'),
+    (EstimateItem, 'section_work_type__section__estimate'),
+    (EstimateSectionWorkType, 'section__estimate'),
+    (EstimateSection, 'estimate'),
+]
+
+
+class ColdStorageError(ValueError):
+    """ВОР нельзя перенести в холодное хранение"""
+
+
+def _save_references(cold, document):
+    """Ссылки документа на справочник (заменяют прежние)"""
+    EstimateColdStorageReference.objects.filter(cold_storage=cold).delete()
+    EstimateColdStorageReference.objects.bulk_create([
+        # столбец документа совпадает с полем ссылки: work_category, work_type, work, resource
+        EstimateColdStorageReference(cold_storage=cold, **{f'{key[1]}_id': pk})
+        for key in snapshots.REFERENCES
+        for pk in sorted(set(document[key]))
+    ])
+
+
+def missing_references(document):
+    """{модель справочника: [id]} - записи документа, которых нет в справочнике"""
+    missing = {}
+    for model, ids in snapshots.references(document).items():
+        found = set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        if ids - found:
+            missing[model] = sorted(ids - found)
+    return missing
+
+
+def archivable():
+    """ВОР со статусом «Архив», еще не перенесенные в холодное хранение"""
+    return Estimate.objects.filter(status='archived', cold_storage__isnull=True)
+
+
+@transaction.atomic
+def archive_estimate(estimate):
+    """Переносит строки ВОР в документ; возвращает EstimateColdStorage"""
+    estimate = Estimate.objects.select_for_update().get(pk=estimate.pk)
+    if estimate.status != 'archived':
+        raise ColdStorageError(f'ВОР {estimate.pk}: в холодное хранение переносятся только ВОР со статусом «Архив»')
+    if EstimateColdStorage.objects.filter(estimate=estimate).exists():
+        raise ColdStorageError(f'ВОР {estimate.pk} уже в холодном хранении')
+    document = snapshots.capture(estimate)
+    data = snapshots.encode(document)
+    cold = EstimateColdStorage.objects.create(
+        estimate=estimate, data=data, size=len(data), rows_count=snapshots.rows_count(document)
+    )
+    _save_references(cold, document)
+    # Без сборщика удаления: у строк ВОР нет сигналов, дочерние строки удаляются раньше
+    for model, path in TREE:
+        queryset = model.objects.filter(**{f'{path}_id': estimate.pk})
+        queryset._raw_delete(queryset.db)
+    return cold
+
+
+@transaction.atomic
+def rehydrate(estimate):
+    """Возвращает строки ВОР из холодного хранения в таблицы; False - ВОР не в архиве"""
+    cold = EstimateColdStorage.objects.select_for_update().filter(estimate=estimate).first()
+    if cold is None:
+        return False
+    document = snapshots.decode(cold.data)
+    # Документы, перенесенные до появления ссылок, могли пережить удаление записей справочника
+    missing = missing_references(document)
+    if missing:
+        raise ColdStorageError(f'ВОР {estimate.pk}: в справочнике нет записей документа: ' + '; '.join(
+            f"{model._meta.verbose_name_plural} {', '.join(map(str, ids))}" for model, ids in missing.items()
+        ))
+    snapshots.materialize(estimate, document)
+    cold.delete()
+    return True
+
+
+@transaction.atomic
+def substitute_resource(source_id, target_id, coefficient, estimate_ids=None):
+    """
+    Замена ресурса в документах (как substitution._substitute для строк ВОР):
+    количество x coefficient, если в работе уже есть target - сложение. Возвращает id ВОР.
+    """
+    queryset = EstimateColdStorage.objects.select_for_update().filter(references__resource_id=source_id)
+    if estimate_ids is not None:
+        queryset = queryset.filter(estimate_id__in=estimate_ids)
+    changed = []
+    for cold in queryset.order_by('pk'):
+        document = snapshots.decode(cold.data)
+        items = document[('resources', 'estimate_item')]
+        resources = array('q', document[('resources', 'resource')])
+        quantities = array('d', document[('resources', 'quantity')])
+        targets = {item: i for i, (item, resource) in enumerate(zip(items, resources)) if resource == target_id}
+        keep = []
+        for i, (item, resource) in enumerate(zip(items, resources)):
+            if resource == source_id:
+                if item in targets:
+                    quantities[targets[item]] += quantities[i] * coefficient
+                    continue
+                resources[i] = target_id
+                quantities[i] *= coefficient
+            keep.append(i)
+        document[('resources', 'estimate_item')] = array('q', (items[i] for i in keep))
+        document[('resources', 'resource')] = array('q', (resources[i] for i in keep))
+        document[('resources', 'quantity')] = array('d', (quantities[i] for i in keep))
+        cold.data = snapshots.encode(document)
+        cold.size = len(cold.data)
+        cold.rows_count = snapshots.rows_count(document)
+        cold.save(update_fields=['data', 'size', 'rows_count'])
+        _save_references(cold, document)
+        changed.append(cold.estimate_id)
+    return changed
+
+
+def _in_bulk(model, ids):
+    """{id: запись}; удаленная запись (документ старше ссылок EstimateColdStorageReference) - заглушка"""
+    ids = set(ids)
+    found = model.objects.in_bulk(ids)
+    for pk in ids - found.keys():
+        found[pk] = model(pk=pk, name=f'{model._meta.verbose_name} {pk} (удален)')
+    return found
+
+
+def tree(estimate, cold):
+    """
+    Разделы ВОР из документа в виде ответа детального API (EstimateDetailSerializer);
+    строк в таблицах нет, поэтому id строк ВОР - null
+    """
+    document = snapshots.decode(cold.data)
+    categories = _in_bulk(WorkCategory, document[('sections', 'work_category')])
+    work_types = _in_bulk(WorkType, document[('work_types', 'work_type')])
+    works = _in_bulk(Work, document[('items', 'work')])
+    resources = _in_bulk(Resource, document[('resources', 'resource')])
+
+    sections = []
+    for category_id, total_area in zip(document[('sections', 'work_category')], document[('sections', 'total_area')]):
+        section = EstimateSection(estimate=estimate, work_category=categories[category_id], total_area=total_area)
+        sections.append((section, {
+            'id': None, 'estimate': estimate.pk, 'estimate_name': estimate.name,
+            'work_category': category_id, 'work_category_name': section.work_category.name,
+            'total_area': total_area, 'work_types_count': 0, 'work_types': [],
+        }))
+    section_work_types = []
+    for index, work_type_id, percentage in zip(
+        document[('work_types', 'section')], document[('work_types', 'work_type')],
+        document[('work_types', 'percentage')]
+    ):
+        section, parent = sections[index]
+        section_work_type = EstimateSectionWorkType(
+            section=section, work_type=work_types[work_type_id], percentage=percentage
+        )
+        row = {
+            'id': None, 'section': None, 'section_info': str(section),
+            'work_type': work_type_id, 'work_type_name': section_work_type.work_type.name,
+            'percentage': percentage, 'items_count': 0, 'items': [],
+        }
+        parent['work_types'].append(row)
+        parent['work_types_count'] += 1
+        section_work_types.append((section_work_type, row))
+    items = []
+    for index, work_id, volume in zip(
+        document[('items', 'section_work_type')], document[('items', 'work')], document[('items', 'volume')]
+    ):
+        section_work_type, parent = section_work_types[index]
+        item = EstimateItem(section_work_type=section_work_type, work=works[work_id], volume=volume)
+        row = {
+            'id': None, 'section_work_type': None, 'section_work_type_info': str(section_work_type),
+            'work': work_id, 'work_name': item.work.name, 'work_unit': item.work.unit,
+            'volume': volume, 'resources_count': 0, 'resources': [],
+        }
+        parent['items'].append(row)
+        parent['items_count'] += 1
+        items.append((item, row))
+    for index, resource_id, quantity in zip(
+        document[('resources', 'estimate_item')], document[('resources', 'resource')],
+        document[('resources', 'quantity')]
+    ):
+        item, parent = items[index]
+        resource = resources[resource_id]
+        parent['resources'].append({
+            'id': None, 'estimate_item': None, 'estimate_item_info': str(item),
+            'resource': resource_id, 'resource_name': resource.name, 'resource_unit': resource.unit,
+            'quantity': quantity,
+        })
+        parent['resources_count'] += 1
+    return [row for _, row in sections]
@@ -0,0 +1,124 @@
+"""
+Сравнение двух ВОР на стороне базы
+
+По каждому уровню (разделы, типы работ, работы, итоги по ресурсам) строки ВОР a и b
+сопоставляются по ключу из справочника (вид работ, тип работ, работа, ресурс) одним
+запросом FULL OUTER JOIN; возвращаются только отличающиеся строки. Результат читается
+курсором порциями (на PostgreSQL - серверный курсор) и отдается потоком JSON.
+FULL OUTER JOIN в SQLite - с версии 3.39.
+Строк ВОР в холодном хранении в таблицах нет - такие ВОР не сравниваются (API отвечает 400).
+"""
+import json
+
+from django.db import connection
+
+from apps.reference.models import WorkCategory, WorkType, Work, Resource
+from .models import EstimateSection, EstimateSectionWorkType, EstimateItem, EstimateItemResource
+
+
+FETCH_SIZE = 2000
+DEFAULT_TOLERANCE = 1e-9
+
+_section = EstimateSection._meta.db_table
+_work_type = EstimateSectionWorkType._meta.db_table
+_item = EstimateItem._meta.db_table
+_resource = EstimateItemResource._meta.db_table
+
+# уровень -> (ключевые столбцы, SELECT строк одной ВОР со столбцами ключа и value)
+LEVELS = {
+    'sections': (
+        ['work_category'],
+        f'SELECT s.work_category_id AS work_category, s.total_area AS value '
+        f'FROM {_section} s WHERE s.estimate_id = %s',
+    ),
+    'work_types': (
+        ['work_category', 'work_type'],
+        f'SELECT s.work_category_id AS work_category, t.work_type_id AS work_type, t.percentage AS value '
+        f'FROM {_work_type} t JOIN {_section} s ON s.id = t.section_id WHERE s.estimate_id = %s',
+    ),
+    'items': (
+        ['work_category', 'work_type', 'work'],
+        f'SELECT s.work_category_id AS work_category, t.work_type_id AS work_type, i.work_id AS work, '
+        f'i.volume AS value '
+        f'FROM {_item} i JOIN {_work_type} t ON t.id = i.section_work_type_id '
+        f'JOIN {_section} s ON s.id = t.section_id WHERE s.estimate_id = %s',
+    ),
+    'resources': (
+        ['resource'],
+        f'SELECT r.resource_id AS resource, SUM(r.quantity) AS value '
+        f'FROM {_resource} r WHERE r.estimate_id = %s GROUP BY r.resource_id',
+    ),
+}
+
+# ключ -> (таблица справочника, выводимые столбцы)
+NAMES = {
+    'work_category': (WorkCategory._meta.db_table, ['name']),
+    'work_type': (WorkType._meta.db_table, ['name']),
+    'work': (Work._meta.db_table, ['name', 'unit']),
+    'resource': (Resource._meta.db_table, ['name', 'unit']),
+}
+
+
+def level_sql(level):
+    keys, source = LEVELS[level]
+    columns = [f'COALESCE(a.{key}, b.{key}) AS {key}' for key in keys]
+    joins = []
+    for key in keys:
+        table, fields = NAMES[key]
+        columns.extend(f'n_{key}.{field} AS {key}_{field}' for field in fields)
+        joins.append(f'LEFT JOIN {table} n_{key} ON n_{key}.id = COALESCE(a.{key}, b.{key})')
+    on = ' AND '.join(f'a.{key} = b.{key}' for key in keys)
+    order = ', '.join(str(i + 1) for i in range(len(keys)))
+    return (
+        f'WITH a AS ({source}), b AS ({source}) '
+        f"SELECT {', '.join(columns)}, a.value AS a, b.value AS b "
+        f'FROM a FULL OUTER JOIN b ON {on} '
+        f"{' '.join(joins)} "
+        f'WHERE a.value IS NULL OR b.value IS NULL OR ABS(a.value - b.value) > %s '
+        f'ORDER BY {order}'
+    )
+
+
+def _row(names, values):
+    row = dict(zip(names, values))
+    a, b = row['a'], row['b']
+    if a is None:
+        row['status'] = 'added'
+    elif b is None:
+        row['status'] = 'removed'
+    else:
+        row['status'] = 'changed'
+    row['delta'] = (b or 0) - (a or 0)
+    row['relative'] = row['delta'] / a if a else None
+    return row
+
+
+def iter_level(level, estimate_a, estimate_b, tolerance=DEFAULT_TOLERANCE):
+    """Отличающиеся строки уровня (словари) порциями из курсора"""
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(level_sql(level), [estimate_a, estimate_b, tolerance])
+        names = None
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            if names is None:
+                # У серверного курсора PostgreSQL description есть только после первого чтения
+                names = [column[0] for column in cursor.description]
+            for values in rows:
+                yield _row(names, values)
+
+
+def stream_json(estimate_a, estimate_b, tolerance=DEFAULT_TOLERANCE):
+    """JSON сравнения частями: {"a", "b", <уровень>: [...], ..., "summary": {...}}"""
+    yield json.dumps({'a': estimate_a, 'b': estimate_b})[:-1]
+    summary = {}
+    for level in LEVELS:
+        yield f', "{level}": ['
+        count = 0
+        for row in iter_level(level, estimate_a, estimate_b, tolerance):
+            yield (', ' if count else '') + json.dumps(row, ensure_ascii=False)
+            count += 1
+        yield ']'
+        summary[level] = count
+    yield f', "summary": {json.dumps(summary)}}}'
@@ -0,0 +1,194 @@
+"""
+Потоковые выгрузки строк ВОР
+
+- NDJSON для интеграций: строки работ и ресурсов ВОР;
+- таблица фактов для аналитики (Parquet, если установлен pyarrow, или CSV): строка на ресурс
+  работы со всеми измерениями - ВОР, объект, статус, вид работ, тип работ, работа, ресурс,
+  площадь, процент, объем, количество.
+Строки читаются итератором порциями по CHUNK_SIZE (на PostgreSQL - серверный курсор),
+в каждую строку подставляются названия, поэтому память не зависит от размера таблицы
+и выгрузка идет одним запросом.
+"""
+import csv
+import io
+import json
+from itertools import islice
+
+from .models import EstimateItem, EstimateItemResource
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+
+CHUNK_SIZE = 2000
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# выгрузка -> (модель, путь к ВОР, [(ключ в строке, путь в запросе), ...])
+EXPORTS = {
+    'estimate-items': (EstimateItem, 'section_work_type__section__estimate', [
+        ('id', 'pk'),
+        ('estimate', 'section_work_type__section__estimate_id'),
+        ('estimate_name', 'section_work_type__section__estimate__name'),
+        ('object_name', 'section_work_type__section__estimate__object_name'),
+        ('status', 'section_work_type__section__estimate__status'),
+        ('section', 'section_work_type__section_id'),
+        ('work_category', 'section_work_type__section__work_category__name'),
+        ('section_work_type', 'section_work_type_id'),
+        ('work_type', 'section_work_type__work_type__name'),
+        ('work', 'work_id'),
+        ('work_name', 'work__name'),
+        ('unit', 'work__unit'),
+        ('volume', 'volume'),
+    ]),
+    'estimate-item-resources': (EstimateItemResource, 'estimate', [
+        ('id', 'pk'),
+        ('estimate', 'estimate_id'),
+        ('estimate_name', 'estimate__name'),
+        ('object_name', 'estimate__object_name'),
+        ('status', 'estimate__status'),
+        ('work_category', 'estimate_item__section_work_type__section__work_category__name'),
+        ('work_type', 'estimate_item__section_work_type__work_type__name'),
+        ('estimate_item', 'estimate_item_id'),
+        ('work', 'estimate_item__work_id'),
+        ('work_name', 'estimate_item__work__name'),
+        ('resource', 'resource_id'),
+        ('resource_name', 'resource__name'),
+        ('unit', 'resource__unit'),
+        ('quantity', 'quantity'),
+    ]),
+}
+
+
+def _dumps(row):
+    if orjson is not None:
+        return orjson.dumps(row) + b'\n'
+    return (json.dumps(row, ensure_ascii=False) + '\n').encode()
+
+
+def _values(kind, estimate_ids, status, chunk_size):
+    model, estimate_path, columns = EXPORTS[kind]
+    queryset = model.objects.filter(**{f'{estimate_path}__deleted_at__isnull': True})
+    if estimate_ids:
+        queryset = queryset.filter(**{f'{estimate_path}__in': estimate_ids})
+    if status:
+        queryset = queryset.filter(**{f'{estimate_path}__status': status})
+    return queryset.order_by('pk').values_list(*[path for _, path in columns]).iterator(chunk_size)
+
+
+def export_rows(kind, estimate_ids=None, status=None, chunk_size=CHUNK_SIZE):
+    """Строки выгрузки (словари) в порядке id"""
+    keys = [key for key, _ in EXPORTS[kind][2]]
+    for values in _values(kind, estimate_ids, status, chunk_size):
+        yield dict(zip(keys, values))
+
+
+def iter_ndjson(kind, estimate_ids=None, status=None, chunk_size=CHUNK_SIZE):
+    """Выгрузка в NDJSON: по строке JSON на запись"""
+    for row in export_rows(kind, estimate_ids, status, chunk_size):
+        yield _dumps(row)
+
+
+# ---------- таблица фактов ----------
+
+_fact = 'estimate_item__section_work_type__section'
+EXPORTS['facts'] = (EstimateItemResource, 'estimate', [
+    ('estimate_id', 'estimate_id'),
+    ('estimate', 'estimate__name'),
+    ('object', 'estimate__object_name'),
+    ('status', 'estimate__status'),
+    ('category', f'{_fact}__work_category__name'),
+    ('work_type', 'estimate_item__section_work_type__work_type__name'),
+    ('work', 'estimate_item__work__name'),
+    ('work_unit', 'estimate_item__work__unit'),
+    ('resource', 'resource__name'),
+    ('resource_unit', 'resource__unit'),
+    ('area', f'{_fact}__total_area'),
+    ('percentage', 'estimate_item__section_work_type__percentage'),
+    ('volume', 'estimate_item__volume'),
+    ('quantity', 'quantity'),
+])
+FACT_COLUMNS = [key for key, _ in EXPORTS['facts'][2]]
+ROW_GROUP_SIZE = 100_000
+
+
+def fact_schema():
+    """Схема Parquet: строковые столбцы со словарным кодированием"""
+    string = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    types = {'estimate_id': pyarrow.int64(), 'area': pyarrow.float64(), 'percentage': pyarrow.float64(),
+             'volume': pyarrow.float64(), 'quantity': pyarrow.float64()}
+    return pyarrow.schema([(name, types.get(name, string)) for name in FACT_COLUMNS])
+
+
+def fact_batches(estimate_ids=None, status=None, batch_size=ROW_GROUP_SIZE):
+    """Таблица фактов порциями по batch_size строк (списки кортежей)"""
+    rows = _values('facts', estimate_ids, status, CHUNK_SIZE)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файл для ParquetWriter, из которого записанное забирается частями"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def iter_parquet(estimate_ids=None, status=None, row_group_size=ROW_GROUP_SIZE):
+    """Parquet (zstd) частями: по группе строк на порцию, файл целиком в память не собирается"""
+    if pyarrow is None:
+        raise RuntimeError('Для выгрузки в Parquet нужен пакет pyarrow')
+    schema = fact_schema()
+    sink = _ChunkSink()
+    with pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for batch in fact_batches(estimate_ids, status, row_group_size):
+            columns = list(zip(*batch))
+            arrays = [
+                pyarrow.array(values, type=field.type.value_type).dictionary_encode()
+                if pyarrow.types.is_dictionary(field.type) else pyarrow.array(values, type=field.type)
+                for field, values in zip(schema, columns)
+            ]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema), row_group_size=row_group_size)
+            yield sink.take()
+    yield sink.take()
+
+
+def iter_csv(estimate_ids=None, status=None, chunk_size=CHUNK_SIZE):
+    """CSV (UTF-8, с заголовком) частями по chunk_size строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FACT_COLUMNS)
+    for batch in fact_batches(estimate_ids, status, chunk_size):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.estimates import cold_storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит ВОР со статусом «Архив» в холодное хранение: строки ВОР сжимаются в один '
+        'документ и удаляются из таблиц (запускается по расписанию)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--estimate', type=int, action='append', dest='estimates',
+                            help='Только указанные ВОР (можно несколько раз)')
+        parser.add_argument('--limit', type=int, default=None, help='Не больше указанного числа ВОР за запуск')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        queryset = cold_storage.archivable().order_by('created_at')
+        if options['estimates']:
+            queryset = queryset.filter(pk__in=options['estimates'])
+        if options['limit']:
+            queryset = queryset[:options['limit']]
+        rows = size = 0
+        estimates = list(queryset)
+        for estimate in estimates:
+            cold = cold_storage.archive_estimate(estimate)
+            rows += cold.rows_count
+            size += cold.size
+            self.stdout.write(f'ВОР {estimate.pk}: {cold.rows_count} строк -> {cold.size / 1024:.1f} КБ')
+        self.stdout.write(self.style.SUCCESS(
+            f'В холодное хранение перенесено ВОР: {len(estimates)}, строк: {rows}, '
+            f'{size / 1024 / 1024:.1f} МБ ({time.perf_counter() - started:.1f} с)'
+        ))
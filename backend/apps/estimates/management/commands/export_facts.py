@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.estimates import export
+from apps.estimates.models import Estimate
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает таблицу фактов ВОР (строка на ресурс работы) для аналитики: '
+        'Parquet (нужен pyarrow) или CSV'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', required=True, help='Файл (.parquet или .csv)')
+        parser.add_argument('--format', choices=['parquet', 'csv'], default=None,
+                            help='Формат (по умолчанию - по расширению файла)')
+        parser.add_argument('--estimate', type=int, action='append', dest='estimates',
+                            help='Только указанные ВОР (можно несколько раз)')
+        parser.add_argument('--status', choices=[value for value, _ in Estimate.STATUS_CHOICES],
+                            help='Только ВОР с указанным статусом')
+        parser.add_argument('--row-group-size', type=int, default=export.ROW_GROUP_SIZE,
+                            help='Строк в группе Parquet / порции CSV')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['format'] or ('csv' if output.endswith('.csv') else 'parquet')
+        if file_format == 'parquet' and export.pyarrow is None:
+            raise CommandError('Для выгрузки в Parquet нужен пакет pyarrow (или --format csv)')
+
+        started = time.perf_counter()
+        if file_format == 'parquet':
+            chunks = export.iter_parquet(options['estimates'], options['status'], options['row_group_size'])
+        else:
+            chunks = export.iter_csv(options['estimates'], options['status'], options['row_group_size'])
+        size = 0
+        with open(output, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        self.stdout.write(self.style.SUCCESS(
+            f'Таблица фактов записана в {output} ({file_format}, {size / 1024 / 1024:.1f} МБ, '
+            f'{time.perf_counter() - started:.1f} с)'
+        ))
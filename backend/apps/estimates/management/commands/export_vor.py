@@ -0,0 +1,61 @@
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.estimates.models import Estimate
+from apps.estimates.transfer import CHUNK_BYTES, export_archive, export_querysets
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает справочник и ВОР в архив (tar с частями CSV.gz в порядке зависимостей); '
+        'PostgreSQL - через COPY TO STDOUT'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None,
+                            help='Файл архива (по умолчанию vor-<дата>.tar)')
+        parser.add_argument('--estimate', type=int, action='append', dest='estimates',
+                            help='Выгрузить только ВОР с этим id (можно несколько раз) '
+                                 'вместе с используемой частью справочника')
+        parser.add_argument('--category', type=int, action='append', dest='categories',
+                            help='Выгрузить только справочник по виду работ (можно несколько раз)')
+        parser.add_argument('--catalog', action='store_true',
+                            help='Выгрузить только справочник')
+        parser.add_argument('--chunk-mb', type=int, default=CHUNK_BYTES // (1024 * 1024),
+                            help='Размер части таблицы до сжатия, МБ')
+
+    def handle(self, *args, **options):
+        if sum(map(bool, (options['estimates'], options['categories'], options['catalog']))) > 1:
+            raise CommandError('Укажите что-то одно: --estimate, --category или --catalog')
+        if options['estimates']:
+            missing = set(options['estimates']) - set(
+                Estimate.objects.filter(pk__in=options['estimates']).values_list('pk', flat=True)
+            )
+            if missing:
+                raise CommandError(f"ВОР не найдены: {', '.join(map(str, sorted(missing)))}")
+
+        path = Path(options['output'] or f'vor-{datetime.now():%Y%m%d-%H%M%S}.tar')
+        scope = {
+            'estimates': options['estimates'] or [],
+            'categories': options['categories'] or [],
+            'catalog_only': options['catalog'],
+        }
+        querysets = export_querysets(
+            estimate_ids=options['estimates'],
+            category_ids=options['categories'],
+            catalog_only=options['catalog'],
+        )
+        started = time.perf_counter()
+        with open(path, 'wb') as fileobj:
+            manifest = export_archive(
+                fileobj, querysets, scope=scope, chunk_bytes=options['chunk_mb'] * 1024 * 1024
+            )
+        elapsed = time.perf_counter() - started
+        for entry in manifest['tables']:
+            self.stdout.write(f"{entry['table']}: {entry['rows']}")
+        self.stdout.write(self.style.SUCCESS(
+            f'Архив {path} ({path.stat().st_size / 1024 / 1024:.1f} МБ) за {elapsed:.1f} с'
+        ))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.estimates.synthetic import SyntheticConfig, generate_synthetic_data
+
+
+class Command(BaseCommand):
+    help = 'Генерирует синтетический справочник и N ВОР для нагрузочных тестов и бенчмарков'
+
+    def add_arguments(self, parser):
+        defaults = SyntheticConfig()
+        parser.add_argument('--estimates', type=int, default=defaults.estimates,
+                            help='Количество ВОР')
+        parser.add_argument('--categories', type=int, default=defaults.categories,
+                            help='Количество видов работ (разделов в каждой ВОР)')
+        parser.add_argument('--work-types-per-category', type=int, default=defaults.work_types_per_category,
+                            help='Типов работ в справочнике на вид работ')
+        parser.add_argument('--work-types-per-section', type=int, default=defaults.work_types_per_section,
+                            help='Типов работ в каждом разделе ВОР')
+        parser.add_argument('--works-per-type', type=int, default=defaults.works_per_type,
+                            help='Работ в шаблоне типа работ')
+        parser.add_argument('--resources-per-work', type=int, default=defaults.resources_per_work,
+                            help='Ресурсов на работу в шаблоне')
+        parser.add_argument('--works-pool', type=int, default=defaults.works_pool,
+                            help='Размер справочника работ')
+        parser.add_argument('--resources-pool', type=int, default=defaults.resources_pool,
+                            help='Размер справочника ресурсов')
+        parser.add_argument('--name-prefix', default=defaults.name_prefix,
+                            help='Префикс названий синтетических записей')
+        parser.add_argument('--seed', type=int, default=defaults.seed,
+                            help='Seed генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        config = SyntheticConfig(
+            estimates=options['estimates'],
+            categories=options['categories'],
+            work_types_per_category=options['work_types_per_category'],
+            work_types_per_section=options['work_types_per_section'],
+            works_per_type=options['works_per_type'],
+            resources_per_work=options['resources_per_work'],
+            works_pool=options['works_pool'],
+            resources_pool=options['resources_pool'],
+            name_prefix=options['name_prefix'],
+            seed=options['seed'],
+        )
+        started = time.perf_counter()
+        stats = generate_synthetic_data(config)
+        elapsed = time.perf_counter() - started
+        for name, count in stats.items():
+            self.stdout.write(f'{name}: {count}')
+        self.stdout.write(self.style.SUCCESS(f'Готово за {elapsed:.1f} с'))
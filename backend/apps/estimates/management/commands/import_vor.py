@@ -0,0 +1,35 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from apps.estimates.transfer import import_archive
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает архив export_vor; PostgreSQL - через COPY FROM STDIN. '
+        'merge - добавление к данным базы, replace - замена таблиц архива'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archive', help='Файл архива')
+        parser.add_argument('--mode', choices=['merge', 'replace'], default='merge',
+                            help='merge (по умолчанию): справочник сопоставляется по названиям, ВОР '
+                                 'получают новые id; replace: таблицы архива очищаются, id сохраняются')
+
+    def handle(self, *args, **options):
+        path = Path(options['archive'])
+        if not path.exists():
+            raise CommandError(f'Файл архива не найден: {path}')
+        started = time.perf_counter()
+        try:
+            with open(path, 'rb') as fileobj:
+                stats = import_archive(fileobj, mode=options['mode'])
+        except (ValueError, KeyError, DatabaseError) as e:
+            raise CommandError(f'Архив не загружен: {e}')
+        elapsed = time.perf_counter() - started
+        for table, counts in stats.items():
+            self.stdout.write(f"{table}: добавлено {counts['inserted']}, сопоставлено {counts['matched']}")
+        self.stdout.write(self.style.SUCCESS(f'Готово за {elapsed:.1f} с'))
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from apps.estimates import partitioning
+from apps.estimates.models import Estimate
+
+
+class Command(BaseCommand):
+    help = (
+        'PostgreSQL: переводит ресурсы работ ВОР (EstimateItemResource) в таблицу, секционированную '
+        'по ВОР, без остановки записи; --benchmark - время запросов по ВОР до и после'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--method', choices=partitioning.METHODS, default='hash',
+                            help='hash - по остатку от id ВОР, range - по диапазонам id ВОР')
+        parser.add_argument('--partitions', type=int, default=partitioning.PARTITIONS,
+                            help='Число секций для hash')
+        parser.add_argument('--range-size', type=int, default=None,
+                            help='ВОР в одной секции для range')
+        parser.add_argument('--batch-size', type=int, default=partitioning.BATCH_SIZE,
+                            help='Строк в одной транзакции копирования')
+        parser.add_argument('--pause', type=float, default=0.0, help='Пауза между порциями, секунд')
+        parser.add_argument('--benchmark', type=int, default=0, metavar='N',
+                            help='Замерить запросы по N самым большим ВОР до и после перевода')
+        parser.add_argument('--extend', type=int, default=0, metavar='N',
+                            help='Только добавить N секций range выше последней (нужен --range-size)')
+        parser.add_argument('--drop-unpartitioned', action='store_true',
+                            help='Только удалить старую таблицу, оставшуюся после перевода')
+        parser.add_argument('--unpartition', action='store_true',
+                            help='Откат: вернуть старую таблицу и удалить секционированную')
+
+    def handle(self, *args, **options):
+        try:
+            if options['drop_unpartitioned']:
+                partitioning.drop_unpartitioned()
+                self.stdout.write(self.style.SUCCESS(f'{partitioning.UNPARTITIONED} удалена'))
+                return
+            if options['unpartition']:
+                partitioning.unpartition(log=self.stdout.write)
+                self.stdout.write(self.style.SUCCESS(f'{partitioning.TABLE} не секционирована'))
+                return
+            if options['extend']:
+                if not options['range_size']:
+                    raise CommandError('Для --extend нужен --range-size')
+                partitioning.extend_range_partitions(options['range_size'], options['extend'])
+                self.stdout.write(self.style.SUCCESS(f"Добавлено секций: {options['extend']}"))
+                return
+
+            estimate_ids = self.largest_estimates(options['benchmark'])
+            before = partitioning.benchmark(estimate_ids) if estimate_ids else None
+            partitioning.partition(
+                method=options['method'], partitions=options['partitions'], range_size=options['range_size'],
+                batch_size=options['batch_size'], pause=options['pause'], log=self.stdout.write,
+            )
+        except partitioning.PartitioningError as e:
+            raise CommandError(str(e))
+        if before:
+            after = partitioning.benchmark(estimate_ids)
+            self.stdout.write('Запрос по ВОР: до -> после, мс (медиана)')
+            for name in before:
+                self.stdout.write(f'  {name}: {before[name]:.2f} -> {after[name]:.2f}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    def largest_estimates(self, count):
+        if not count:
+            return []
+        return list(
+            Estimate.objects.annotate(rows=Count('item_resources')).order_by('-rows')
+            .values_list('pk', flat=True)[:count]
+        )
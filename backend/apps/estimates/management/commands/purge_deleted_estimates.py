@@ -0,0 +1,41 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.estimates import purge, sync
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет строки мягко удаленных ВОР порциями в коротких транзакциях '
+        '(запускается по расписанию, например раз в час из cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=0,
+                            help='Только ВОР, удаленные больше указанного числа часов назад')
+        parser.add_argument('--batch-size', type=int, default=purge.BATCH_SIZE,
+                            help='Строк в одной транзакции DELETE')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Пауза между порциями, секунд (снижает нагрузку на базу)')
+        parser.add_argument('--tombstone-days', type=float, default=sync.TOMBSTONE_RETENTION.days,
+                            help='Сколько дней хранить записи об удалении для синхронизации (/api/sync/)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля')
+        if options['tombstone_days'] < 0:
+            raise CommandError('--tombstone-days не может быть отрицательным')
+        started = time.perf_counter()
+        estimate_ids = purge.deleted_estimates(timedelta(hours=options['older_than']))
+        rows = 0
+        for estimate_id in estimate_ids:
+            stats = purge.purge_estimate(estimate_id, batch_size=options['batch_size'], pause=options['pause'])
+            rows += sum(stats.values())
+            self.stdout.write(f'ВОР {estimate_id}: ' + ', '.join(f'{name} {count}' for name, count in stats.items()))
+        tombstones = sync.prune_tombstones(timedelta(days=options['tombstone_days']), options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Очищено ВОР: {len(estimate_ids)}, строк: {rows}, записей об удалении: {tombstones} '
+            f'({time.perf_counter() - started:.1f} с)'
+        ))
@@ -0,0 +1,87 @@
+import os
+import subprocess
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.estimates.synthetic import scale_estimates
+
+
+# Строки дампа, которые не нужны при восстановлении в другую базу:
+# владелец объектов (роль может отсутствовать) и метакоманды новых версий psql
+SKIPPED_PREFIXES = ('\\restrict', '\\unrestrict')
+SKIPPED_FRAGMENTS = (' OWNER TO ',)
+
+
+class Command(BaseCommand):
+    help = (
+        'Восстанавливает дамп PostgreSQL (backup.sql) в текущую базу и при необходимости '
+        'масштабирует набор ВОР копированием (для нагрузочных тестов)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file', default=str(Path(settings.BASE_DIR).parent / 'backup.sql'),
+            help='Путь к дампу (по умолчанию backup.sql в корне репозитория)'
+        )
+        parser.add_argument('--scale', type=int, default=1,
+                            help='Во сколько раз увеличить количество ВОР после восстановления')
+        parser.add_argument('--drop', action='store_true',
+                            help='Удалить схему public со всеми данными перед восстановлением')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Не запрашивать подтверждение удаления схемы')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Восстановление дампа поддерживается только для PostgreSQL (DATABASE_URL)')
+        dump_path = Path(options['file'])
+        if not dump_path.exists():
+            raise CommandError(f'Файл дампа не найден: {dump_path}')
+
+        if options['drop']:
+            if options['interactive']:
+                answer = input(
+                    f"Все данные базы {connection.settings_dict['NAME']} будут удалены (DROP SCHEMA public CASCADE).\n"
+                    "Введите 'yes' для продолжения: "
+                )
+                if answer != 'yes':
+                    raise CommandError('Восстановление отменено')
+            self.stdout.write('Очистка схемы public...')
+            with connection.cursor() as cursor:
+                cursor.execute('DROP SCHEMA public CASCADE')
+                cursor.execute('CREATE SCHEMA public')
+            connection.close()
+
+        self.stdout.write(f'Восстановление {dump_path}...')
+        self._run_psql(dump_path)
+
+        # Дамп содержит состояние миграций на момент выгрузки - догоняем текущее
+        call_command('migrate', verbosity=0)
+
+        if options['scale'] > 1:
+            created = scale_estimates(options['scale'])
+            self.stdout.write(f'Создано копий ВОР: {created}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    def _run_psql(self, dump_path):
+        db = settings.DATABASES['default']
+        env = {**os.environ, 'PGPASSWORD': db.get('PASSWORD') or ''}
+        command = [
+            'psql', '-v', 'ON_ERROR_STOP=1', '-q',
+            '-h', db.get('HOST') or 'localhost',
+            '-p', str(db.get('PORT') or 5432),
+            '-U', db.get('USER') or '',
+            '-d', db['NAME'],
+        ]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, env=env, text=True, encoding='utf-8')
+        with open(dump_path, encoding='utf-8') as dump:
+            for line in dump:
+                if line.startswith(SKIPPED_PREFIXES) or any(f in line for f in SKIPPED_FRAGMENTS):
+                    continue
+                process.stdin.write(line)
+        process.stdin.close()
+        if process.wait() != 0:
+            raise CommandError('psql завершился с ошибкой')
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimates', '0002_alter_estimateitem_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstimateSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(verbose_name='Версия')),
+                ('comment', models.CharField(blank=True, max_length=255, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('data', models.BinaryField(verbose_name='Данные')),
+                ('size', models.PositiveIntegerField(verbose_name='Размер (байт)')),
+                ('rows_count', models.PositiveIntegerField(verbose_name='Строк ВОР')),
+                ('base', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='deltas', to='estimates.estimatesnapshot', verbose_name='Базовая версия')),
+                ('estimate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='estimates.estimate', verbose_name='ВОР')),
+            ],
+            options={
+                'verbose_name': 'Версия ВОР',
+                'verbose_name_plural': 'Версии ВОР',
+                'ordering': ['estimate', '-version'],
+                'unique_together': {('estimate', 'version')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimates', '0003_estimate_snapshot'),
+        ('reference', '0002_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='estimateitem',
+            index=models.Index(fields=['work', 'section_work_type', 'volume'], name='estimateitem_work_usage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='estimateitemresource',
+            index=models.Index(fields=['resource', 'estimate_item', 'quantity'], name='estimateitemres_usage_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimates', '0004_usage_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estimate',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Удалена'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimates', '0005_estimate_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstimateColdStorage',
+            fields=[
+                ('estimate', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cold_storage', serialize=False, to='estimates.estimate', verbose_name='ВОР')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Перенесена в архив')),
+                ('data', models.BinaryField(verbose_name='Данные')),
+                ('size', models.PositiveIntegerField(verbose_name='Размер (байт)')),
+                ('rows_count', models.PositiveIntegerField(verbose_name='Строк ВОР')),
+            ],
+            options={
+                'verbose_name': 'ВОР в холодном хранении',
+                'verbose_name_plural': 'ВОР в холодном хранении',
+            },
+        ),
+    ]
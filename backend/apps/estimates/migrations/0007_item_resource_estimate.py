@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimates', '0006_estimate_cold_storage'),
+        ('reference', '0002_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estimateitemresource',
+            name='estimate',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='item_resources', to='estimates.estimate', verbose_name='ВОР'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, transaction
+from django.db.models import OuterRef, Subquery
+
+
+BATCH_SIZE = 10000
+
+
+def backfill(apps, schema_editor):
+    """estimate_id ресурсов работ порциями: каждая порция - отдельная короткая транзакция"""
+    EstimateItem = apps.get_model('estimates', 'EstimateItem')
+    EstimateItemResource = apps.get_model('estimates', 'EstimateItemResource')
+    estimate_id = Subquery(
+        EstimateItem.objects.filter(pk=OuterRef('estimate_item_id'))
+        .values('section_work_type__section__estimate_id')[:1]
+    )
+    last_id = 0
+    while True:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            ids = list(
+                EstimateItemResource.objects.filter(pk__gt=last_id, estimate__isnull=True)
+                .order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE]
+            )
+            if not ids:
+                return
+            EstimateItemResource.objects.filter(pk__in=ids).update(estimate_id=estimate_id)
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('estimates', '0007_item_resource_estimate'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
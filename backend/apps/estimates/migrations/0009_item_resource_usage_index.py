@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimates', '0008_backfill_item_resource_estimate'),
+        ('reference', '0002_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='estimateitemresource',
+            name='estimateitemres_usage_idx',
+        ),
+        migrations.AddIndex(
+            model_name='estimateitemresource',
+            index=models.Index(fields=['resource', 'estimate', 'quantity'], name='estimateitemres_usage_idx'),
+        ),
+    ]
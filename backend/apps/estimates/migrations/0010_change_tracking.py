@@ -0,0 +1,165 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:24
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+# Таблицы ВОР -> имя в API синхронизации (apps/estimates/sync.py)
+TABLES = {
+    'estimates_estimate': 'estimates',
+    'estimates_estimatesection': 'estimate-sections',
+    'estimates_estimatesectionworktype': 'estimate-section-work-types',
+    'estimates_estimateitem': 'estimate-items',
+    'estimates_estimateitemresource': 'estimate-item-resources',
+}
+# Общий счетчик изменений: последовательность PostgreSQL или таблица из одной строки в SQLite
+SEQUENCE = 'estimates_change_seq'
+TOMBSTONES = 'estimates_estimatetombstone'
+SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def create_triggers(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(f'CREATE SEQUENCE IF NOT EXISTS {SEQUENCE}')
+        schema_editor.execute(f'''
+            CREATE OR REPLACE FUNCTION {SEQUENCE}_touch() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                NEW.change_seq := nextval('{SEQUENCE}');
+                NEW.updated_at := now();
+                RETURN NEW;
+            END $$
+        ''')
+        schema_editor.execute(f'''
+            CREATE OR REPLACE FUNCTION {SEQUENCE}_tombstone() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                INSERT INTO {TOMBSTONES} (kind, row_id, change_seq, deleted_at)
+                VALUES (TG_ARGV[0], OLD.id, nextval('{SEQUENCE}'), now());
+                RETURN OLD;
+            END $$
+        ''')
+        for table, kind in TABLES.items():
+            schema_editor.execute(
+                f'CREATE TRIGGER {table}_change BEFORE INSERT OR UPDATE ON {table} '
+                f'FOR EACH ROW EXECUTE FUNCTION {SEQUENCE}_touch()'
+            )
+            schema_editor.execute(
+                f'CREATE TRIGGER {table}_tombstone AFTER DELETE ON {table} '
+                f"FOR EACH ROW EXECUTE FUNCTION {SEQUENCE}_tombstone('{kind}')"
+            )
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute(f'CREATE TABLE IF NOT EXISTS {SEQUENCE} (value integer NOT NULL)')
+        schema_editor.execute(f'INSERT INTO {SEQUENCE} (value) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM {SEQUENCE})')
+        next_value = f'UPDATE {SEQUENCE} SET value = value + 1;'
+        for table, kind in TABLES.items():
+            touch = (
+                f'UPDATE {table} SET change_seq = (SELECT value FROM {SEQUENCE}), updated_at = {SQLITE_NOW} '
+                f'WHERE id = NEW.id;'
+            )
+            schema_editor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {table}_change_ai AFTER INSERT ON {table} '
+                f'BEGIN {next_value} {touch} END'
+            )
+            # Номер, поставленный самим триггером, всегда больше прежнего - повторно не срабатывает;
+            # Django при save() пишет прочитанный (не больший) номер
+            schema_editor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {table}_change_au AFTER UPDATE ON {table} '
+                f'WHEN NEW.change_seq <= OLD.change_seq BEGIN {next_value} {touch} END'
+            )
+            schema_editor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {table}_tombstone AFTER DELETE ON {table} BEGIN {next_value} '
+                f'INSERT INTO {TOMBSTONES} (kind, row_id, change_seq, deleted_at) '
+                f"VALUES ('{kind}', OLD.id, (SELECT value FROM {SEQUENCE}), {SQLITE_NOW}); END"
+            )
+
+
+def drop_triggers(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        for table in TABLES:
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_change ON {table}')
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_tombstone ON {table}')
+        schema_editor.execute(f'DROP FUNCTION IF EXISTS {SEQUENCE}_touch()')
+        schema_editor.execute(f'DROP FUNCTION IF EXISTS {SEQUENCE}_tombstone()')
+        schema_editor.execute(f'DROP SEQUENCE IF EXISTS {SEQUENCE}')
+    elif connection.vendor == 'sqlite':
+        for table in TABLES:
+            for suffix in ('change_ai', 'change_au', 'tombstone'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEQUENCE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimates', '0009_item_resource_usage_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstimateTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50, verbose_name='Таблица')),
+                ('row_id', models.BigIntegerField(verbose_name='id строки')),
+                ('change_seq', models.BigIntegerField(unique=True, verbose_name='Номер изменения')),
+                ('deleted_at', models.DateTimeField(db_default=django.db.models.functions.datetime.Now(), verbose_name='Удалена')),
+            ],
+            options={
+                'verbose_name': 'Удаленная строка ВОР',
+                'verbose_name_plural': 'Удаленные строки ВОР',
+                'ordering': ['change_seq'],
+            },
+        ),
+        migrations.AddField(
+            model_name='estimate',
+            name='change_seq',
+            field=models.BigIntegerField(db_default=0, db_index=True, default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.AddField(
+            model_name='estimate',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_default=django.db.models.functions.datetime.Now(), verbose_name='Изменена'),
+        ),
+        migrations.AddField(
+            model_name='estimateitem',
+            name='change_seq',
+            field=models.BigIntegerField(db_default=0, db_index=True, default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.AddField(
+            model_name='estimateitem',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_default=django.db.models.functions.datetime.Now(), verbose_name='Изменена'),
+        ),
+        migrations.AddField(
+            model_name='estimateitemresource',
+            name='change_seq',
+            field=models.BigIntegerField(db_default=0, db_index=True, default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.AddField(
+            model_name='estimateitemresource',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_default=django.db.models.functions.datetime.Now(), verbose_name='Изменена'),
+        ),
+        migrations.AddField(
+            model_name='estimatesection',
+            name='change_seq',
+            field=models.BigIntegerField(db_default=0, db_index=True, default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.AddField(
+            model_name='estimatesection',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_default=django.db.models.functions.datetime.Now(), verbose_name='Изменена'),
+        ),
+        migrations.AddField(
+            model_name='estimatesectionworktype',
+            name='change_seq',
+            field=models.BigIntegerField(db_default=0, db_index=True, default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.AddField(
+            model_name='estimatesectionworktype',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_default=django.db.models.functions.datetime.Now(), verbose_name='Изменена'),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, transaction
+from django.db.models import F
+
+
+BATCH_SIZE = 10000
+# Родительские таблицы раньше дочерних: при первой синхронизации строки приходят в порядке дерева
+MODELS = ['Estimate', 'EstimateSection', 'EstimateSectionWorkType', 'EstimateItem', 'EstimateItemResource']
+
+
+def backfill(apps, schema_editor):
+    """
+    Номера изменений существующих строк порциями: UPDATE без изменения данных
+    срабатывает триггером изменения (миграция 0010), каждая порция - отдельная транзакция
+    """
+    for name in MODELS:
+        model = apps.get_model('estimates', name)
+        last_id = 0
+        while True:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                ids = list(
+                    model._base_manager.filter(pk__gt=last_id, change_seq=0)
+                    .order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE]
+                )
+                if not ids:
+                    break
+                model._base_manager.filter(pk__in=ids).update(id=F('id'))
+            last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('estimates', '0010_change_tracking'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimates', '0011_backfill_change_seq'),
+        ('reference', '0002_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstimateColdStorageReference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cold_storage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='references', to='estimates.estimatecoldstorage', verbose_name='ВОР в холодном хранении')),
+                ('resource', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='reference.resource', verbose_name='Ресурс')),
+                ('work', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='reference.work', verbose_name='Работа')),
+                ('work_category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='reference.workcategory', verbose_name='Вид работ')),
+                ('work_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='reference.worktype', verbose_name='Тип работ')),
+            ],
+            options={
+                'verbose_name': 'Ссылка ВОР в холодном хранении',
+                'verbose_name_plural': 'Ссылки ВОР в холодном хранении',
+            },
+        ),
+    ]
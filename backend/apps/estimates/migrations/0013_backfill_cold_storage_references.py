@@ -0,0 +1,46 @@
+from django.db import migrations, transaction
+
+from apps.estimates.snapshots import decode
+
+
+# столбец документа -> модель справочника (поле ссылки называется как столбец)
+COLUMNS = {
+    ('sections', 'work_category'): 'WorkCategory',
+    ('work_types', 'work_type'): 'WorkType',
+    ('items', 'work'): 'Work',
+    ('resources', 'resource'): 'Resource',
+}
+
+
+def backfill(apps, schema_editor):
+    """
+    Ссылки документов, перенесенных в холодное хранение раньше, - по ВОР в отдельной транзакции;
+    записи справочника, удаленные за это время, пропускаются
+    """
+    EstimateColdStorage = apps.get_model('estimates', 'EstimateColdStorage')
+    Reference = apps.get_model('estimates', 'EstimateColdStorageReference')
+    ids = list(EstimateColdStorage.objects.order_by('pk').values_list('pk', flat=True))
+    for pk in ids:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            cold = EstimateColdStorage.objects.get(pk=pk)
+            document = decode(cold.data)
+            references = []
+            for key, model_name in COLUMNS.items():
+                model = apps.get_model('reference', model_name)
+                existing = model.objects.filter(pk__in=set(document[key])).values_list('pk', flat=True)
+                references.extend(
+                    Reference(cold_storage_id=pk, **{f'{key[1]}_id': value}) for value in sorted(existing)
+                )
+            Reference.objects.bulk_create(references)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('estimates', '0012_cold_storage_references'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
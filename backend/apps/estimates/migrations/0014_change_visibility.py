@@ -0,0 +1,147 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:02
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+
+# Функции триггеров миграции 0010: номер изменения и удаления дополняются транзакцией записи
+SEQUENCE = 'estimates_change_seq'
+TOMBSTONES = 'estimates_estimatetombstone'
+XID = 'pg_current_xact_id()::text::bigint'
+
+
+def _functions(schema_editor, xid):
+    touch = f'NEW.change_xid := {XID};' if xid else ''
+    schema_editor.execute(f'''
+        CREATE OR REPLACE FUNCTION {SEQUENCE}_touch() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.change_seq := nextval('{SEQUENCE}');
+            {touch}
+            NEW.updated_at := now();
+            RETURN NEW;
+        END $$
+    ''')
+    columns, values = ('change_xid, ', f'{XID}, ') if xid else ('', '')
+    schema_editor.execute(f'''
+        CREATE OR REPLACE FUNCTION {SEQUENCE}_tombstone() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO {TOMBSTONES} (kind, row_id, change_seq, {columns}deleted_at)
+            VALUES (TG_ARGV[0], OLD.id, nextval('{SEQUENCE}'), {values}now());
+            RETURN OLD;
+        END $$
+    ''')
+
+
+def sqlite_triggers(apps, schema_editor):
+    """SQLite пересоздает таблицы при изменении полей - триггеры миграции 0010 создаются заново"""
+    if schema_editor.connection.vendor == 'sqlite':
+        import_module('apps.estimates.migrations.0010_change_tracking').create_triggers(apps, schema_editor)
+
+
+def add_xid(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        _functions(schema_editor, xid=True)
+    sqlite_triggers(apps, schema_editor)
+
+
+def remove_xid(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        _functions(schema_editor, xid=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimates', '0013_backfill_cold_storage_references'),
+        ('reference', '0002_search_indexes'),
+    ]
+
+    operations = [
+        # при откате - после удаления полей
+        migrations.RunPython(migrations.RunPython.noop, sqlite_triggers),
+        migrations.AlterModelOptions(
+            name='estimatetombstone',
+            options={'ordering': ['change_xid', 'change_seq'], 'verbose_name': 'Удаленная строка ВОР', 'verbose_name_plural': 'Удаленные строки ВОР'},
+        ),
+        migrations.AddField(
+            model_name='estimate',
+            name='change_xid',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Транзакция изменения'),
+        ),
+        migrations.AddField(
+            model_name='estimateitem',
+            name='change_xid',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Транзакция изменения'),
+        ),
+        migrations.AddField(
+            model_name='estimateitemresource',
+            name='change_xid',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Транзакция изменения'),
+        ),
+        migrations.AddField(
+            model_name='estimatesection',
+            name='change_xid',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Транзакция изменения'),
+        ),
+        migrations.AddField(
+            model_name='estimatesectionworktype',
+            name='change_xid',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Транзакция изменения'),
+        ),
+        migrations.AddField(
+            model_name='estimatetombstone',
+            name='change_xid',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Транзакция изменения'),
+        ),
+        migrations.AlterField(
+            model_name='estimate',
+            name='change_seq',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.AlterField(
+            model_name='estimateitem',
+            name='change_seq',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.AlterField(
+            model_name='estimateitemresource',
+            name='change_seq',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.AlterField(
+            model_name='estimatesection',
+            name='change_seq',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.AlterField(
+            model_name='estimatesectionworktype',
+            name='change_seq',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Номер изменения'),
+        ),
+        migrations.AddIndex(
+            model_name='estimate',
+            index=models.Index(fields=['change_xid', 'change_seq'], name='estimate_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='estimateitem',
+            index=models.Index(fields=['change_xid', 'change_seq'], name='estimateitem_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='estimateitemresource',
+            index=models.Index(fields=['change_xid', 'change_seq'], name='estimateitemres_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='estimatesection',
+            index=models.Index(fields=['change_xid', 'change_seq'], name='estimatesection_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='estimatesectionworktype',
+            index=models.Index(fields=['change_xid', 'change_seq'], name='estimateswt_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='estimatetombstone',
+            index=models.Index(fields=['change_xid', 'change_seq'], name='estimatetombstone_change_idx'),
+        ),
+        migrations.RunPython(add_xid, remove_xid),
+    ]
@@ -0,0 +1,54 @@
+from importlib import import_module
+
+from django.db import migrations
+
+
+# Триггеры SQLite миграции 0010 сбрасывают change_xid: строки, загруженные из архива
+# PostgreSQL (import_vor), иначе сохранили бы номер транзакции источника и курсор синхронизации
+# ушел бы вперед всех последующих записей SQLite (change_xid = 0)
+TABLES = import_module('apps.estimates.migrations.0010_change_tracking').TABLES
+SEQUENCE = 'estimates_change_seq'
+SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def _drop(schema_editor):
+    for table in TABLES:
+        for suffix in ('change_ai', 'change_au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_{suffix}')
+
+
+def reset_xid(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    _drop(schema_editor)
+    next_value = f'UPDATE {SEQUENCE} SET value = value + 1;'
+    for table in TABLES:
+        touch = (
+            f'UPDATE {table} SET change_seq = (SELECT value FROM {SEQUENCE}), change_xid = 0, '
+            f'updated_at = {SQLITE_NOW} WHERE id = NEW.id;'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {table}_change_ai AFTER INSERT ON {table} BEGIN {next_value} {touch} END'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {table}_change_au AFTER UPDATE ON {table} '
+            f'WHEN NEW.change_seq <= OLD.change_seq OR NEW.change_xid <> 0 BEGIN {next_value} {touch} END'
+        )
+
+
+def keep_xid(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    _drop(schema_editor)
+    import_module('apps.estimates.migrations.0010_change_tracking').create_triggers(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimates', '0014_change_visibility'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_xid, keep_xid),
+    ]
@@ -1,9 +1,42 @@
 from django.db import models
 from django.db import transaction
+from django.db.models.functions import Now
+from django.utils import timezone
+from apps import metrics
 from apps.reference.models import WorkCategory, WorkType, Work, Resource, WorkTypeWork, WorkResource
 
 
-class Estimate(models.Model):
+class ChangeTrackedModel(models.Model):
+    """
+    Строки ВОР с номером изменения (см. sync.py)
+    updated_at, change_seq и change_xid заполняют триггеры базы (миграции 0010, 0014) при любой
+    записи, в том числе bulk_create, update() и raw SQL; удаления записываются в EstimateTombstone.
+    Дочерние модели добавляют индекс (change_xid, change_seq) в свой Meta.
+    """
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now(), verbose_name="Изменена")
+    change_seq = models.BigIntegerField(default=0, db_default=0, editable=False, verbose_name="Номер изменения")
+    # Транзакция записи (PostgreSQL); в SQLite запись последовательна - всегда 0
+    change_xid = models.BigIntegerField(default=0, db_default=0, editable=False, verbose_name="Транзакция изменения")
+
+    class Meta:
+        abstract = True
+
+
+class EstimateQuerySet(models.QuerySet):
+    def delete(self):
+        """Мягкое удаление: строки ВОР удаляет позже команда purge_deleted_estimates"""
+        count = self.filter(deleted_at__isnull=True).update(deleted_at=timezone.now())
+        return count, {self.model._meta.label: count}
+
+
+class EstimateManager(models.Manager.from_queryset(EstimateQuerySet)):
+    """ВОР без удаленных"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class Estimate(ChangeTrackedModel):
     """
     ВОР - Ведомость Объёмов Работ
     Конкретная ведомость для конкретного объекта
@@ -25,17 +58,66 @@ class Estimate(models.Model):
         default='draft',
         verbose_name="Статус"
     )
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name="Удалена")
+
+    objects = EstimateManager()
+    # Вместе с удаленными (восстановление, очистка, полная выгрузка)
+    all_objects = models.Manager.from_queryset(EstimateQuerySet)()
 
     class Meta:
         verbose_name = "ВОР"
         verbose_name_plural = "ВОР"
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['change_xid', 'change_seq'], name='estimate_change_idx')]
 
     def __str__(self):
         return f"{self.name} ({self.object_name})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Статус в базе: смена с «Архив» возвращает строки из холодного хранения (save)
+        instance._stored_status = instance.__dict__.get('status')
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if fields is None or 'status' in fields:
+            self._stored_status = self.status
+
+    def save(self, *args, **kwargs):
+        """ВОР из холодного хранения возвращается в таблицы при смене статуса с «Архив»"""
+        update_fields = kwargs.get('update_fields')
+        # Статус не читался (only/defer, объект создан вручную) - проверяет rehydrate
+        stored_status = getattr(self, '_stored_status', None)
+        leaves_archive = (
+            not self._state.adding and self.status != 'archived' and stored_status in ('archived', None)
+            and (update_fields is None or 'status' in update_fields)
+        )
+        if not leaves_archive:
+            super().save(*args, **kwargs)
+        else:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                from .cold_storage import rehydrate
+                rehydrate(self)
+        if update_fields is None or 'status' in update_fields:
+            self._stored_status = self.status
+
+    def delete(self, using=None, keep_parents=False):
+        """Мягкое удаление: без обхода разделов, работ и ресурсов сборщиком удаления"""
+        if self.deleted_at is None:
+            self.deleted_at = timezone.now()
+            self.save(update_fields=['deleted_at'])
+        return 1, {self._meta.label: 1}
+
+    def restore(self):
+        """Отмена удаления (до очистки)"""
+        self.deleted_at = None
+        self.save(update_fields=['deleted_at'])
+
 
-class EstimateSection(models.Model):
+class EstimateSection(ChangeTrackedModel):
     """
     РАЗДЕЛ_ВОР - Раздел ВОР по виду работ
     Например: Полы, Кровля, Стены
@@ -63,6 +145,7 @@ class EstimateSection(models.Model):
         verbose_name_plural = "Виды работ в ВОР"
         ordering = ['estimate', 'work_category']
         unique_together = [['estimate', 'work_category']]
+        indexes = [models.Index(fields=['change_xid', 'change_seq'], name='estimatesection_change_idx')]
 
     def __str__(self):
         return f"{self.estimate.name} - {self.work_category.name} ({self.total_area} м²)"
@@ -80,11 +163,12 @@ class EstimateSection(models.Model):
     
     def _recalculate_volumes(self):
         """Пересчет объемов работ и количества ресурсов при изменении площади"""
-        for work_type in self.work_types.all():
-            work_type._recalculate_items()
+        with metrics.recalculation_duration.time(scope='section'):
+            for work_type in self.work_types.all():
+                work_type._recalculate_items()
 
 
-class EstimateSectionWorkType(models.Model):
+class EstimateSectionWorkType(ChangeTrackedModel):
     """
     РАЗДЕЛ_ВОР_ТИП_РАБОТ - Тип работ в разделе ВОР
     ⚠️ Пользователь вписывает процент для каждого типа работ в разделе
@@ -111,6 +195,7 @@ class EstimateSectionWorkType(models.Model):
         verbose_name_plural = "Типы работ в разделах ВОР"
         ordering = ['section', '-percentage']
         unique_together = [['section', 'work_type']]
+        indexes = [models.Index(fields=['change_xid', 'change_seq'], name='estimateswt_change_idx')]
 
     def __str__(self):
         return f"{self.section.work_category.name} - {self.work_type.name} ({self.percentage}%)"
@@ -134,6 +219,15 @@ class EstimateSectionWorkType(models.Model):
     
     def _create_items_from_template(self):
         """Создание работ и ресурсов из шаблона типа работ"""
+        with metrics.template_instantiation_duration.time():
+            items_written, resources_written = self._write_items_from_template()
+        metrics.template_instantiations.inc()
+        metrics.template_items_written.observe(items_written)
+        metrics.template_resources_written.observe(resources_written)
+
+    def _write_items_from_template(self):
+        """Записывает работы и ресурсы шаблона; возвращает их количество"""
+        items_written = resources_written = 0
         # Площадь для этого типа работ
         type_area = self.section.total_area * (self.percentage / 100)
         
@@ -155,6 +249,7 @@ class EstimateSectionWorkType(models.Model):
                 # Обновляем объем существующей работы
                 estimate_item.volume = volume
                 estimate_item.save()
+            items_written += 1
             
             # Получаем ресурсы для этой работы из шаблона
             work_resources = WorkResource.objects.filter(
@@ -170,16 +265,22 @@ class EstimateSectionWorkType(models.Model):
                 estimate_item_resource, created = EstimateItemResource.objects.get_or_create(
                     estimate_item=estimate_item,
                     resource=work_resource.resource,
-                    defaults={'quantity': quantity}
+                    defaults={'quantity': quantity, 'estimate_id': self.section.estimate_id}
                 )
                 
                 if not created:
                     # Обновляем количество существующего ресурса
                     estimate_item_resource.quantity = quantity
                     estimate_item_resource.save()
+                resources_written += 1
+        return items_written, resources_written
     
     def _recalculate_items(self):
         """Пересчет объемов работ и количества ресурсов"""
+        with metrics.recalculation_duration.time(scope='section_work_type'):
+            self._recalculate_items_volumes()
+
+    def _recalculate_items_volumes(self):
         # Площадь для этого типа работ
         type_area = self.section.total_area * (self.percentage / 100)
         
@@ -216,7 +317,7 @@ class EstimateSectionWorkType(models.Model):
                 estimate_item.delete()
 
 
-class EstimateItem(models.Model):
+class EstimateItem(ChangeTrackedModel):
     """
     ВОР_РАБОТЫ - Работы в конкретной ВОР с объемами
     🤖 Объем рассчитывается автоматически:
@@ -244,16 +345,30 @@ class EstimateItem(models.Model):
         verbose_name_plural = "Работы в ВОР (из шаблона)"
         ordering = ['section_work_type', 'work']
         unique_together = [['section_work_type', 'work']]
+        indexes = [
+            # Где используется работа (usage.py): объемы читаются из индекса
+            models.Index(fields=['work', 'section_work_type', 'volume'], name='estimateitem_work_usage_idx'),
+            models.Index(fields=['change_xid', 'change_seq'], name='estimateitem_change_idx'),
+        ]
 
     def __str__(self):
         return f"{self.section_work_type.section.estimate.name} - {self.work.name} ({self.volume} {self.work.unit})"
 
 
-class EstimateItemResource(models.Model):
+class EstimateItemResource(ChangeTrackedModel):
     """
     ВОР_РАБОТА_РЕСУРСЫ - Ресурсы для работ в ВОР с количеством
     🤖 Количество рассчитывается автоматически: quantity = volume × quantity_per_unit
+    estimate - копия ВОР работы: запросы по одной ВОР идут без соединений, на PostgreSQL
+    по этому полю таблица может быть секционирована (partition_item_resources)
     """
+    estimate = models.ForeignKey(
+        Estimate,
+        on_delete=models.CASCADE,
+        null=True,
+        related_name='item_resources',
+        verbose_name="ВОР"
+    )
     estimate_item = models.ForeignKey(
         EstimateItem,
         on_delete=models.CASCADE,
@@ -276,6 +391,130 @@ class EstimateItemResource(models.Model):
         verbose_name_plural = "Ресурсы работ в ВОР (из шаблона)"
         ordering = ['estimate_item', 'resource']
         unique_together = [['estimate_item', 'resource']]
+        indexes = [
+            # Где используется ресурс (usage.py): ВОР и количества читаются из индекса
+            models.Index(fields=['resource', 'estimate', 'quantity'], name='estimateitemres_usage_idx'),
+            models.Index(fields=['change_xid', 'change_seq'], name='estimateitemres_change_idx'),
+        ]
 
     def __str__(self):
         return f"{self.estimate_item.work.name} - {self.resource.name} ({self.quantity} {self.resource.unit})"
+
+
+class EstimateSnapshot(models.Model):
+    """
+    Версия ВОР (см. snapshots.py)
+    Содержимое ВОР в упакованном виде: массивы id и значений, сжатые zlib.
+    Если задана base - данные хранятся как разность (XOR) с предыдущей версией.
+    """
+    estimate = models.ForeignKey(
+        Estimate,
+        on_delete=models.CASCADE,
+        related_name='snapshots',
+        verbose_name="ВОР"
+    )
+    version = models.PositiveIntegerField(verbose_name="Версия")
+    comment = models.CharField(max_length=255, blank=True, verbose_name="Комментарий")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    base = models.ForeignKey(
+        'self',
+        on_delete=models.RESTRICT,
+        null=True,
+        blank=True,
+        related_name='deltas',
+        verbose_name="Базовая версия"
+    )
+    data = models.BinaryField(verbose_name="Данные")
+    size = models.PositiveIntegerField(verbose_name="Размер (байт)")
+    rows_count = models.PositiveIntegerField(verbose_name="Строк ВОР")
+
+    class Meta:
+        verbose_name = "Версия ВОР"
+        verbose_name_plural = "Версии ВОР"
+        ordering = ['estimate', '-version']
+        unique_together = [['estimate', 'version']]
+
+    def __str__(self):
+        return f"{self.estimate.name} - версия {self.version}"
+
+
+class EstimateColdStorage(models.Model):
+    """
+    Содержимое ВОР в архиве (см. cold_storage.py)
+    Разделы, типы работ, работы и ресурсы - одним сжатым документом в формате версий ВОР;
+    строки ВОР при этом удаляются из таблиц.
+    """
+    estimate = models.OneToOneField(
+        Estimate,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='cold_storage',
+        verbose_name="ВОР"
+    )
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="Перенесена в архив")
+    data = models.BinaryField(verbose_name="Данные")
+    size = models.PositiveIntegerField(verbose_name="Размер (байт)")
+    rows_count = models.PositiveIntegerField(verbose_name="Строк ВОР")
+
+    class Meta:
+        verbose_name = "ВОР в холодном хранении"
+        verbose_name_plural = "ВОР в холодном хранении"
+
+    def __str__(self):
+        return f"{self.estimate.name} ({self.rows_count} строк, {self.size} байт)"
+
+
+class EstimateColdStorageReference(models.Model):
+    """
+    Запись справочника, на которую ссылается документ холодного хранения
+    Строк ВОР в таблицах нет - PROTECT этих ссылок не дает удалить вид работ, тип работ,
+    работу или ресурс архивной ВОР, как FK строк ВОР у обычной. Заполнено одно из полей.
+    """
+    cold_storage = models.ForeignKey(
+        EstimateColdStorage,
+        on_delete=models.CASCADE,
+        related_name='references',
+        verbose_name="ВОР в холодном хранении"
+    )
+    work_category = models.ForeignKey(
+        WorkCategory, on_delete=models.PROTECT, null=True, blank=True, related_name='+', verbose_name="Вид работ"
+    )
+    work_type = models.ForeignKey(
+        WorkType, on_delete=models.PROTECT, null=True, blank=True, related_name='+', verbose_name="Тип работ"
+    )
+    work = models.ForeignKey(
+        Work, on_delete=models.PROTECT, null=True, blank=True, related_name='+', verbose_name="Работа"
+    )
+    resource = models.ForeignKey(
+        Resource, on_delete=models.PROTECT, null=True, blank=True, related_name='+', verbose_name="Ресурс"
+    )
+
+    class Meta:
+        verbose_name = "Ссылка ВОР в холодном хранении"
+        verbose_name_plural = "Ссылки ВОР в холодном хранении"
+
+    def __str__(self):
+        target = self.work_category_id or self.work_type_id or self.work_id or self.resource_id
+        return f"{self.cold_storage_id}: {target}"
+
+
+class EstimateTombstone(models.Model):
+    """
+    Удаленная строка ВОР (см. sync.py)
+    Записи добавляет триггер удаления таблиц ВОР; kind - имя таблицы в API синхронизации
+    или sync.PRUNED - отметка очистки старых записей.
+    """
+    kind = models.CharField(max_length=50, verbose_name="Таблица")
+    row_id = models.BigIntegerField(verbose_name="id строки")
+    change_seq = models.BigIntegerField(unique=True, verbose_name="Номер изменения")
+    change_xid = models.BigIntegerField(default=0, db_default=0, editable=False, verbose_name="Транзакция изменения")
+    deleted_at = models.DateTimeField(db_default=Now(), verbose_name="Удалена")
+
+    class Meta:
+        verbose_name = "Удаленная строка ВОР"
+        verbose_name_plural = "Удаленные строки ВОР"
+        ordering = ['change_xid', 'change_seq']
+        indexes = [models.Index(fields=['change_xid', 'change_seq'], name='estimatetombstone_change_idx')]
+
+    def __str__(self):
+        return f"{self.kind} {self.row_id} ({self.change_seq})"
@@ -0,0 +1,381 @@
+"""
+Секционирование EstimateItemResource по ВОР (PostgreSQL, для очень больших установок)
+
+Ресурсы работ - самая большая таблица. Каждая строка хранит копию ВОР (estimate_id,
+заполняется при создании и миграцией 0008 для старых строк), поэтому таблицу можно
+секционировать по ВОР: запросы по одной ВОР читают одну секцию, VACUUM и перестроение
+индексов идут по секциям.
+
+partition() переводит таблицу без остановки записи:
+1. создается секционированная таблица <таблица>_p (HASH по estimate_id с partitions секциями
+   или RANGE по диапазонам id ВОР размером range_size с секцией DEFAULT);
+   первичный ключ (id, estimate_id), уникальность (estimate_item_id, resource_id, estimate_id) -
+   ключ секционирования обязан входить в уникальные ограничения;
+2. триггер на старой таблице повторяет в новой все INSERT / UPDATE / DELETE;
+3. строки копируются порциями по batch_size id, каждая порция - отдельная транзакция;
+4. в короткой транзакции под блокировкой записи сверяются расхождения, затем таблицы
+   меняются именами. Старая таблица остается как <таблица>_unpartitioned без внешних ключей
+   (удаление ВОР, работ и ресурсов ее не касается), триггер новой таблицы повторяет в ней
+   все изменения до drop_unpartitioned().
+
+unpartition() - откат: в короткой транзакции таблицы меняются именами обратно, старой таблице
+возвращаются внешние ключи (проверяются после фиксации, без блокировки записи), секционированная
+таблица удаляется.
+
+Секционируется только EstimateItemResource. У EstimateItem нет копии ВОР, а ключ секционирования
+обязан входить в первичный ключ - внешний ключ ресурсов работ на работу стал бы составным.
+Перевод - командой partition_item_resources, а не миграцией: миграция шла бы одной транзакцией
+при развертывании, команда копирует порциями без остановки записи.
+
+ORM работает с секционированной таблицей как раньше (поле id уникально). Операции по одной
+строке (WHERE id = ...) проверяют индекс каждой секции, запросы по ВОР (estimate_id) - одну.
+После перевода изменения модели EstimateItemResource в миграциях нужно проверять вручную:
+ограничения таблицы отличаются от тех, что создал бы Django.
+"""
+import statistics
+import time
+
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery, Sum
+
+from .models import Estimate, EstimateSection, EstimateSectionWorkType, EstimateItem, EstimateItemResource
+
+
+BATCH_SIZE = 50000
+PARTITIONS = 16
+METHODS = ['hash', 'range']
+
+TABLE = EstimateItemResource._meta.db_table
+PARTITIONED = f'{TABLE}_p'
+UNPARTITIONED = f'{TABLE}_unpartitioned'
+SYNC_FUNCTION = f'{TABLE}_sync'
+MIRROR_FUNCTION = f'{UNPARTITIONED}_sync'
+# Индексы модели (Meta.indexes): у новой таблицы - с суффиксом _p, у старой после перевода - _unpartitioned
+INDEXES = {
+    index.name: [EstimateItemResource._meta.get_field(name).column for name in index.fields]
+    for index in EstimateItemResource._meta.indexes
+}
+# Функции триггеров номера изменения и удалений (миграция 0010, sync.py)
+CHANGE_SEQUENCE = 'estimates_change_seq'
+TOMBSTONE_KIND = 'estimate-item-resources'
+COLUMNS = [field.column for field in EstimateItemResource._meta.concrete_fields]
+# ВОР строки, если estimate_id не заполнен (строки старого кода во время перевода)
+ESTIMATE_OF_ITEM = (
+    f'(SELECT s.estimate_id FROM {EstimateItem._meta.db_table} i '
+    f'JOIN {EstimateSectionWorkType._meta.db_table} t ON t.id = i.section_work_type_id '
+    f'JOIN {EstimateSection._meta.db_table} s ON s.id = t.section_id WHERE i.id = {{row}}.estimate_item_id)'
+)
+
+
+class PartitioningError(RuntimeError):
+    """Перевод невозможен в текущей базе"""
+
+
+def backfill_estimate_ids(batch_size=BATCH_SIZE):
+    """Заполняет пустые estimate_id ресурсов работ порциями; возвращает число строк"""
+    estimate_id = Subquery(
+        EstimateItem.objects.filter(pk=OuterRef('estimate_item_id'))
+        .values('section_work_type__section__estimate_id')[:1]
+    )
+    last_id = updated = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                EstimateItemResource.objects.filter(pk__gt=last_id, estimate__isnull=True)
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return updated
+            updated += EstimateItemResource.objects.filter(pk__in=ids).update(estimate_id=estimate_id)
+        last_id = ids[-1]
+
+
+def _relkind(cursor, table):
+    cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [table])
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        return _relkind(cursor, TABLE) == 'p'
+
+
+def _partition_sql(method, partitions, range_size, max_estimate_id):
+    if method == 'hash':
+        return [
+            f'CREATE TABLE {TABLE}_p{i:02d} PARTITION OF {PARTITIONED} '
+            f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})'
+            for i in range(partitions)
+        ]
+    bounds = range(0, max_estimate_id + range_size + 1, range_size)
+    return [
+        f'CREATE TABLE {TABLE}_r{start // range_size:04d} PARTITION OF {PARTITIONED} '
+        f'FOR VALUES FROM ({start}) TO ({start + range_size})'
+        for start in bounds
+    ] + [f'CREATE TABLE {TABLE}_default PARTITION OF {PARTITIONED} DEFAULT']
+
+
+def _foreign_keys(table, not_valid=False):
+    """[(имя, ALTER TABLE ... ADD CONSTRAINT)] внешних ключей ресурсов работ, как у Django"""
+    result = []
+    for field in ('estimate', 'estimate_item', 'resource'):
+        field = EstimateItemResource._meta.get_field(field)
+        name = f'{table}_{field.column}_fk'
+        result.append((name, (
+            f'ALTER TABLE {table} ADD CONSTRAINT {name} '
+            f'FOREIGN KEY ({field.column}) REFERENCES {field.related_model._meta.db_table} (id) '
+            f'DEFERRABLE INITIALLY DEFERRED' + (' NOT VALID' if not_valid else '')
+        )))
+    return result
+
+
+def _create_partitioned(cursor, method, partitions, range_size):
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {Estimate._meta.db_table}')
+    max_estimate_id = cursor.fetchone()[0]
+    key = 'HASH' if method == 'hash' else 'RANGE'
+    statements = [
+        f'CREATE TABLE {PARTITIONED} (LIKE {TABLE} INCLUDING DEFAULTS) PARTITION BY {key} (estimate_id)',
+        f'ALTER TABLE {PARTITIONED} ALTER COLUMN estimate_id SET NOT NULL',
+        f'ALTER TABLE {PARTITIONED} ADD CONSTRAINT {PARTITIONED}_pkey PRIMARY KEY (id, estimate_id)',
+        f'ALTER TABLE {PARTITIONED} ADD CONSTRAINT {PARTITIONED}_item_resource_uniq '
+        f'UNIQUE (estimate_item_id, resource_id, estimate_id)',
+        f'CREATE INDEX {PARTITIONED}_estimate_idx ON {PARTITIONED} (estimate_id)',
+        f'CREATE INDEX {PARTITIONED}_resource_idx ON {PARTITIONED} (resource_id)',
+    ]
+    statements += [
+        f"CREATE INDEX {name}_p ON {PARTITIONED} ({', '.join(columns)})" for name, columns in INDEXES.items()
+    ]
+    statements += [sql for _, sql in _foreign_keys(PARTITIONED)]
+    statements += _partition_sql(method, partitions, range_size, max_estimate_id)
+    for sql in statements:
+        cursor.execute(sql)
+
+
+def _create_sync_trigger(cursor, source=TABLE, target=PARTITIONED, function=SYNC_FUNCTION):
+    """Триггер source повторяет в target все INSERT / UPDATE / DELETE"""
+    columns = ', '.join(COLUMNS)
+    if target == PARTITIONED:
+        # ключ секционирования обязателен, пустой estimate_id берется из работы
+        values = ', '.join(
+            f'COALESCE(NEW.estimate_id, {ESTIMATE_OF_ITEM.format(row="NEW")})' if column == 'estimate_id'
+            else f'NEW.{column}'
+            for column in COLUMNS
+        )
+        key, fixed = '(id, estimate_id)', ('id', 'estimate_id')
+    else:
+        values = ', '.join(f'NEW.{column}' for column in COLUMNS)
+        key, fixed = '(id)', ('id',)
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in COLUMNS if column not in fixed)
+    cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM {target} WHERE id = OLD.id;
+                RETURN OLD;
+            END IF;
+            INSERT INTO {target} ({columns}) VALUES ({values})
+            ON CONFLICT {key} DO UPDATE SET {updates};
+            RETURN NEW;
+        END $$
+    ''')
+    cursor.execute(
+        f'CREATE TRIGGER {function} AFTER INSERT OR UPDATE OR DELETE ON {source} '
+        f'FOR EACH ROW EXECUTE FUNCTION {function}()'
+    )
+
+
+def _move_change_triggers(cursor, source, target):
+    """Триггеры номера изменения и удалений (sync.py) переходят с source на target"""
+    cursor.execute(f'DROP TRIGGER IF EXISTS {TABLE}_change ON {source}')
+    cursor.execute(f'DROP TRIGGER IF EXISTS {TABLE}_tombstone ON {source}')
+    cursor.execute(
+        f'CREATE TRIGGER {TABLE}_change BEFORE INSERT OR UPDATE ON {target} '
+        f'FOR EACH ROW EXECUTE FUNCTION {CHANGE_SEQUENCE}_touch()'
+    )
+    cursor.execute(
+        f'CREATE TRIGGER {TABLE}_tombstone AFTER DELETE ON {target} '
+        f"FOR EACH ROW EXECUTE FUNCTION {CHANGE_SEQUENCE}_tombstone('{TOMBSTONE_KIND}')"
+    )
+
+
+def _copy_sql(source_alias='o'):
+    select = ', '.join(
+        f'COALESCE({source_alias}.estimate_id, {ESTIMATE_OF_ITEM.format(row=source_alias)})'
+        if column == 'estimate_id' else f'{source_alias}.{column}'
+        for column in COLUMNS
+    )
+    return f"INSERT INTO {PARTITIONED} ({', '.join(COLUMNS)}) SELECT {select} FROM {TABLE} {source_alias}"
+
+
+def _swap(cursor):
+    """Сверка и замена таблиц; вызывается в транзакции"""
+    # Отложенные проверки внешних ключей скопированных строк - сейчас: ALTER TABLE
+    # не выполняется, пока у таблицы есть отложенные события триггеров
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    # Запись в старую таблицу блокируется, чтение продолжается до переименования
+    cursor.execute(f'LOCK TABLE {TABLE} IN EXCLUSIVE MODE')
+    cursor.execute(
+        f'DELETE FROM {PARTITIONED} n WHERE NOT EXISTS (SELECT 1 FROM {TABLE} o WHERE o.id = n.id)'
+    )
+    cursor.execute(
+        _copy_sql() + f' WHERE NOT EXISTS (SELECT 1 FROM {PARTITIONED} n WHERE n.id = o.id) ON CONFLICT DO NOTHING'
+    )
+    cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+    cursor.execute(f'DROP TRIGGER {SYNC_FUNCTION} ON {TABLE}')
+    cursor.execute(f'DROP FUNCTION {SYNC_FUNCTION}()')
+    # при копировании триггеров номера изменения не было - номера скопированы как есть
+    _move_change_triggers(cursor, TABLE, PARTITIONED)
+    # Последовательность id - своя у новой таблицы (удаляется вместе с ней)
+    cursor.execute(f'CREATE SEQUENCE {TABLE}_p_id_seq OWNED BY {PARTITIONED}.id')
+    cursor.execute(f"SELECT setval('{TABLE}_p_id_seq', COALESCE((SELECT MAX(id) FROM {TABLE}), 0) + 1, false)")
+    cursor.execute(f"ALTER TABLE {PARTITIONED} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_p_id_seq')")
+    # Внешние ключи старой таблицы не дали бы удалить ВОР, работы и ресурсы, строки которых
+    # удалены из новой; при откате они создаются заново
+    cursor.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'", [TABLE]
+    )
+    for name, in cursor.fetchall():
+        cursor.execute(f'ALTER TABLE {TABLE} DROP CONSTRAINT {name}')
+    _rename(cursor, TABLE, UNPARTITIONED, '', '_unpartitioned')
+    _rename(cursor, PARTITIONED, TABLE, '_p', '')
+    # Старая таблица повторяет изменения новой - для отката (unpartition)
+    _create_sync_trigger(cursor, TABLE, UNPARTITIONED, MIRROR_FUNCTION)
+
+
+def _rename(cursor, table, name, index_suffix, index_name_suffix):
+    """Таблица table -> name, индексы модели <индекс><index_suffix> -> <индекс><index_name_suffix>"""
+    cursor.execute(f'ALTER TABLE {table} RENAME TO {name}')
+    cursor.execute(f'ALTER TABLE {name} RENAME CONSTRAINT {table}_pkey TO {name}_pkey')
+    for index in INDEXES:
+        cursor.execute(f'ALTER INDEX IF EXISTS {index}{index_suffix} RENAME TO {index}{index_name_suffix}')
+
+
+def partition(method='hash', partitions=PARTITIONS, range_size=None, batch_size=BATCH_SIZE, pause=0.0, log=None):
+    """Переводит EstimateItemResource в секционированную таблицу; возвращает число скопированных строк"""
+    log = log or (lambda message: None)
+    if connection.vendor != 'postgresql':
+        raise PartitioningError('Секционирование поддерживается только в PostgreSQL')
+    if method not in METHODS:
+        raise PartitioningError(f'Неизвестный способ секционирования: {method}')
+    if method == 'range' and not range_size:
+        raise PartitioningError('Для RANGE нужен размер диапазона id ВОР (range_size)')
+    with connection.cursor() as cursor:
+        if _relkind(cursor, TABLE) == 'p':
+            raise PartitioningError(f'{TABLE} уже секционирована')
+        if _relkind(cursor, PARTITIONED) is not None or _relkind(cursor, UNPARTITIONED) is not None:
+            raise PartitioningError(f'Есть {PARTITIONED} или {UNPARTITIONED} от прошлого запуска - удалите вручную')
+
+    log(f'Заполнено estimate_id: {backfill_estimate_ids(batch_size)}')
+    with transaction.atomic(), connection.cursor() as cursor:
+        _create_partitioned(cursor, method, partitions, range_size)
+        _create_sync_trigger(cursor)
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {TABLE}')
+        max_id = cursor.fetchone()[0]
+    log(f'Создана {PARTITIONED} ({method}), копирование строк до id {max_id}')
+
+    copied = 0
+    for start in range(0, max_id, batch_size):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(_copy_sql() + ' WHERE o.id > %s AND o.id <= %s ON CONFLICT DO NOTHING',
+                           [start, start + batch_size])
+            copied += cursor.rowcount
+        if pause:
+            time.sleep(pause)
+    log(f'Скопировано строк: {copied}')
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        _swap(cursor)
+        cursor.execute(f'ANALYZE {TABLE}')
+    log(f'{TABLE} секционирована, старая таблица для отката - {UNPARTITIONED}')
+    return copied
+
+
+def extend_range_partitions(range_size, count):
+    """Добавляет count RANGE-секций выше последней (до того, как id ВОР попадут в DEFAULT)"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT max((regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''?(\\d+)'))[1]::bigint) "
+            'FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)',
+            [TABLE]
+        )
+        upper = cursor.fetchone()[0]
+        if upper is None:
+            raise PartitioningError(f'{TABLE} не секционирована по диапазонам')
+        for start in range(upper, upper + range_size * count, range_size):
+            cursor.execute(
+                f'CREATE TABLE {TABLE}_r{start // range_size:04d} PARTITION OF {TABLE} '
+                f'FOR VALUES FROM ({start}) TO ({start + range_size})'
+            )
+
+
+def unpartition(log=None):
+    """Откат partition(): возвращает старую таблицу, которую до сих пор вел триггер"""
+    log = log or (lambda message: None)
+    if connection.vendor != 'postgresql':
+        raise PartitioningError('Секционирование поддерживается только в PostgreSQL')
+    with connection.cursor() as cursor:
+        if _relkind(cursor, TABLE) != 'p':
+            raise PartitioningError(f'{TABLE} не секционирована')
+        if _relkind(cursor, UNPARTITIONED) != 'r':
+            raise PartitioningError(f'{UNPARTITIONED} удалена - откат невозможен')
+
+    foreign_keys = _foreign_keys(TABLE, not_valid=True)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'DROP FUNCTION {MIRROR_FUNCTION}() CASCADE')
+        _move_change_triggers(cursor, TABLE, UNPARTITIONED)
+        _rename(cursor, TABLE, PARTITIONED, '', '_p')
+        _rename(cursor, UNPARTITIONED, TABLE, '_unpartitioned', '')
+        # id строк, добавленных после перевода, выданы последовательностью новой таблицы
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {TABLE}",
+            [TABLE]
+        )
+        # NOT VALID - без проверки существующих строк под блокировкой
+        for _, sql in foreign_keys:
+            cursor.execute(sql)
+        cursor.execute(f'DROP TABLE {PARTITIONED}')
+    log(f'{TABLE} возвращена, секционированная таблица удалена; проверка внешних ключей')
+
+    with connection.cursor() as cursor:
+        for name, _ in foreign_keys:
+            cursor.execute(f'ALTER TABLE {TABLE} VALIDATE CONSTRAINT {name}')
+
+
+def drop_unpartitioned():
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DROP FUNCTION IF EXISTS {MIRROR_FUNCTION}() CASCADE')
+        cursor.execute(f'DROP TABLE IF EXISTS {UNPARTITIONED}')
+
+
+# ---------- замеры ----------
+
+# запрос по одной ВОР -> функция estimate_id -> результат
+BENCHMARK_QUERIES = {
+    'rows': lambda estimate_id: list(
+        EstimateItemResource.objects.filter(estimate_id=estimate_id).values_list('pk', 'resource_id', 'quantity')
+    ),
+    'resource_totals': lambda estimate_id: list(
+        EstimateItemResource.objects.filter(estimate_id=estimate_id).order_by()
+        .values('resource_id').annotate(total=Sum('quantity'))
+    ),
+    'count': lambda estimate_id: EstimateItemResource.objects.filter(estimate_id=estimate_id).count(),
+}
+
+
+def benchmark(estimate_ids, repeat=5):
+    """Медиана времени запросов по ВОР, мс: {запрос: мс}"""
+    result = {}
+    for name, query in BENCHMARK_QUERIES.items():
+        timings = []
+        for _ in range(repeat):
+            for estimate_id in estimate_ids:
+                started = time.perf_counter()
+                query(estimate_id)
+                timings.append((time.perf_counter() - started) * 1000)
+        result[name] = statistics.median(timings)
+    return result
@@ -0,0 +1,75 @@
+"""
+Очистка мягко удаленных ВОР
+
+Удаление ВОР только ставит deleted_at (Estimate.delete, EstimateQuerySet.delete):
+запрос мгновенный, ВОР пропадает из API и админки. Строки удаляются потом, командой
+purge_deleted_estimates (по расписанию): по таблицам от листьев к корню, порциями
+по batch_size id, каждая порция - короткая отдельная транзакция с DELETE ... WHERE id IN (...)
+без сборщика удаления (у строк ВОР нет сигналов, зависимые строки уже удалены).
+Блокировки держатся недолго, журнал транзакций растет равномерно.
+"""
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    Estimate, EstimateSection, EstimateSectionWorkType,
+    EstimateItem, EstimateItemResource, EstimateSnapshot, EstimateColdStorage, EstimateColdStorageReference
+)
+
+
+BATCH_SIZE = 5000
+
+# таблица -> (путь к id ВОР, порядок удаления)
+# Версии - от новых к старым: дельта ссылается только на более раннюю версию
+PURGE_ORDER = [
+    (EstimateItemResource, 'estimate_id', 'pk'),
+    (EstimateItem, 'section_work_type__section__estimate_id', 'pk'),
+    (EstimateSectionWorkType, 'section__estimate_id', 'pk'),
+    (EstimateSection, 'estimate_id', 'pk'),
+    (EstimateSnapshot, 'estimate_id', '-version'),
+    (EstimateColdStorageReference, 'cold_storage_id', 'pk'),
+    (EstimateColdStorage, 'estimate_id', 'pk'),
+]
+
+
+def deleted_estimates(older_than=None):
+    """id удаленных ВОР; older_than - timedelta с момента удаления"""
+    queryset = Estimate.all_objects.filter(deleted_at__isnull=False)
+    if older_than is not None:
+        queryset = queryset.filter(deleted_at__lte=timezone.now() - older_than)
+    return list(queryset.order_by('deleted_at').values_list('pk', flat=True))
+
+
+def _delete_batch(queryset, ordering, batch_size):
+    """Одна порция: id первых batch_size строк и DELETE по ним"""
+    with transaction.atomic():
+        ids = list(queryset.order_by(ordering).values_list('pk', flat=True)[:batch_size])
+        if ids:
+            batch = queryset.model._base_manager.filter(pk__in=ids)
+            batch._raw_delete(batch.db)
+    return len(ids)
+
+
+def purge_estimate(estimate_id, batch_size=BATCH_SIZE, pause=0.0):
+    """
+    Удаляет строки удаленной ВОР порциями; возвращает {модель: удалено строк}.
+    ВОР, удаление которой отменили, не трогается.
+    """
+    stats = {}
+    if not Estimate.all_objects.filter(pk=estimate_id, deleted_at__isnull=False).exists():
+        return stats
+    for model, path, ordering in PURGE_ORDER:
+        stats[model.__name__] = 0
+        while True:
+            deleted = _delete_batch(model._base_manager.filter(**{path: estimate_id}), ordering, batch_size)
+            stats[model.__name__] += deleted
+            if deleted < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    stats[Estimate.__name__] = _delete_batch(
+        Estimate.all_objects.filter(pk=estimate_id, deleted_at__isnull=False), 'pk', 1
+    )
+    return stats
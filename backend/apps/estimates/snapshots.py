@@ -0,0 +1,345 @@
+"""
+Версии ВОР: компактные снимки с дельта-кодированием и восстановление
+
+Снимок - столбцы (array) дерева ВОР:
+  разделы: вид работ, площадь;
+  типы работ: индекс раздела, тип работ, процент;
+  работы: индекс типа работ, работа, объем;
+  ресурсы: индекс работы, ресурс, количество.
+Ссылки на родителя хранятся индексами строк снимка, а не id - снимок не зависит от id строк ВОР.
+Столбец, совпадающий по длине со столбцом предыдущей версии, хранится как XOR с ним
+(после правки нескольких процентов почти все байты нулевые); байты float64 перед
+сжатием группируются по позициям (shuffle), что заметно улучшает сжатие zlib.
+Каждая KEYFRAME_INTERVAL-я версия хранится полностью, чтобы цепочка дельт была короткой.
+"""
+import json
+import sys
+import zlib
+from array import array
+
+from django.db import transaction
+
+from apps.reference.models import WorkCategory, WorkType, Work, Resource
+from .models import (
+    EstimateSection, EstimateSectionWorkType, EstimateItem, EstimateItemResource,
+    EstimateSnapshot, EstimateColdStorage
+)
+from .synthetic import BATCH_SIZE
+
+
+SNAPSHOT_FORMAT = 1
+KEYFRAME_INTERVAL = 10
+
+# (таблица, столбец, typecode array)
+COLUMNS = [
+    ('sections', 'work_category', 'q'),
+    ('sections', 'total_area', 'd'),
+    ('work_types', 'section', 'q'),
+    ('work_types', 'work_type', 'q'),
+    ('work_types', 'percentage', 'd'),
+    ('items', 'section_work_type', 'q'),
+    ('items', 'work', 'q'),
+    ('items', 'volume', 'd'),
+    ('resources', 'estimate_item', 'q'),
+    ('resources', 'resource', 'q'),
+    ('resources', 'quantity', 'd'),
+]
+TABLES = ['sections', 'work_types', 'items', 'resources']
+# столбцы с id справочника
+REFERENCES = {
+    ('sections', 'work_category'): WorkCategory,
+    ('work_types', 'work_type'): WorkType,
+    ('items', 'work'): Work,
+    ('resources', 'resource'): Resource,
+}
+
+
+# ---------- снимок текущего состояния ----------
+
+def capture(estimate):
+    """Документ снимка {(таблица, столбец): array} для текущего состояния ВОР"""
+    cold = EstimateColdStorage.objects.filter(estimate=estimate).only('data').first()
+    if cold is not None:
+        return decode(cold.data)
+    sections = list(
+        EstimateSection.objects.filter(estimate=estimate)
+        .order_by('pk').values_list('pk', 'work_category_id', 'total_area')
+    )
+    section_index = {pk: i for i, (pk, *_) in enumerate(sections)}
+    work_types = list(
+        EstimateSectionWorkType.objects.filter(section__estimate=estimate)
+        .order_by('pk').values_list('pk', 'section_id', 'work_type_id', 'percentage')
+    )
+    work_type_index = {pk: i for i, (pk, *_) in enumerate(work_types)}
+    items = list(
+        EstimateItem.objects.filter(section_work_type__section__estimate=estimate)
+        .order_by('pk').values_list('pk', 'section_work_type_id', 'work_id', 'volume')
+    )
+    item_index = {pk: i for i, (pk, *_) in enumerate(items)}
+    resources = list(
+        EstimateItemResource.objects.filter(estimate=estimate)
+        .order_by('pk').values_list('estimate_item_id', 'resource_id', 'quantity')
+    )
+    return {
+        ('sections', 'work_category'): array('q', (row[1] for row in sections)),
+        ('sections', 'total_area'): array('d', (row[2] for row in sections)),
+        ('work_types', 'section'): array('q', (section_index[row[1]] for row in work_types)),
+        ('work_types', 'work_type'): array('q', (row[2] for row in work_types)),
+        ('work_types', 'percentage'): array('d', (row[3] for row in work_types)),
+        ('items', 'section_work_type'): array('q', (work_type_index[row[1]] for row in items)),
+        ('items', 'work'): array('q', (row[2] for row in items)),
+        ('items', 'volume'): array('d', (row[3] for row in items)),
+        ('resources', 'estimate_item'): array('q', (item_index[row[0]] for row in resources)),
+        ('resources', 'resource'): array('q', (row[1] for row in resources)),
+        ('resources', 'quantity'): array('d', (row[2] for row in resources)),
+    }
+
+
+def references(document):
+    """{модель справочника: set(id)}, на которые ссылается снимок"""
+    return {model: set(document[key]) for key, model in REFERENCES.items()}
+
+
+def remap(document, id_maps):
+    """Копия документа с id справочника, замененными по {модель: {старый id: новый id}}"""
+    document = dict(document)
+    for key, model in REFERENCES.items():
+        mapping = id_maps.get(model)
+        if mapping is not None:
+            document[key] = array('q', (mapping[value] for value in document[key]))
+    return document
+
+
+def rows_count(document):
+    """Строк ВОР в снимке: разделы + типы работ + работы + ресурсы"""
+    return sum(len(document[(table, column)]) for table, column in (
+        ('sections', 'work_category'), ('work_types', 'work_type'), ('items', 'work'), ('resources', 'resource')
+    ))
+
+
+# ---------- кодирование ----------
+
+def _xor(data, base):
+    size = len(data)
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(base, 'little')).to_bytes(size, 'little')
+
+
+def _shuffle(data, width):
+    return b''.join(data[i::width] for i in range(width))
+
+
+def _unshuffle(data, width):
+    result = bytearray(len(data))
+    part = len(data) // width
+    for i in range(width):
+        result[i::width] = data[i * part:(i + 1) * part]
+    return bytes(result)
+
+
+def encode(document, base=None):
+    """Документ -> байты (zlib); base - документ предыдущей версии для дельты"""
+    header = {
+        'format': SNAPSHOT_FORMAT,
+        'byteorder': sys.byteorder,
+        'lengths': [len(document[(table, column)]) for table, column, _ in COLUMNS],
+        'delta': [],
+    }
+    parts = []
+    for table, column, typecode in COLUMNS:
+        values = document[(table, column)]
+        data = values.tobytes()
+        if base is not None and len(base[(table, column)]) == len(values):
+            data = _xor(data, base[(table, column)].tobytes())
+            header['delta'].append(f'{table}.{column}')
+        parts.append(_shuffle(data, values.itemsize))
+    header_bytes = json.dumps(header).encode()
+    payload = len(header_bytes).to_bytes(4, 'little') + header_bytes + b''.join(parts)
+    return zlib.compress(payload, 9)
+
+
+def decode(data, base=None):
+    """Байты -> документ; для дельты нужен документ base"""
+    payload = zlib.decompress(bytes(data))
+    header_size = int.from_bytes(payload[:4], 'little')
+    header = json.loads(payload[4:4 + header_size])
+    if header['format'] != SNAPSHOT_FORMAT:
+        raise ValueError(f"Неподдерживаемый формат снимка: {header['format']}")
+    delta = set(header['delta'])
+    offset = 4 + header_size
+    document = {}
+    for (table, column, typecode), length in zip(COLUMNS, header['lengths']):
+        values = array(typecode)
+        size = length * values.itemsize
+        raw = _unshuffle(payload[offset:offset + size], values.itemsize)
+        offset += size
+        if f'{table}.{column}' in delta:
+            if base is None:
+                raise ValueError('Для дельты нужна базовая версия')
+            raw = _xor(raw, base[(table, column)].tobytes())
+        values.frombytes(raw)
+        if header['byteorder'] != sys.byteorder:
+            values.byteswap()
+        document[(table, column)] = values
+    return document
+
+
+def load(snapshot):
+    """Документ версии с разворачиванием цепочки дельт"""
+    chain = [snapshot]
+    while chain[-1].base_id is not None:
+        chain.append(EstimateSnapshot.objects.only('data', 'base_id').get(pk=chain[-1].base_id))
+    document = None
+    for item in reversed(chain):
+        document = decode(item.data, document)
+    return document
+
+
+def iter_documents(queryset):
+    """
+    (версия, документ) по возрастанию id; базовая версия создана раньше дельты,
+    поэтому в памяти - только последний документ каждой цепочки
+    """
+    documents = {}
+    for snapshot in queryset.order_by('pk').only('pk', 'base_id', 'data').iterator():
+        base = documents.pop(snapshot.base_id) if snapshot.base_id is not None else None
+        document = documents[snapshot.pk] = decode(snapshot.data, base)
+        yield snapshot, document
+
+
+# ---------- версии ----------
+
+@transaction.atomic
+def create_snapshot(estimate, comment=''):
+    """Новая версия ВОР; дельта от предыдущей, каждая KEYFRAME_INTERVAL-я - полностью"""
+    document = capture(estimate)
+    previous = (
+        EstimateSnapshot.objects.select_for_update()
+        .filter(estimate=estimate).order_by('-version').first()
+    )
+    version = previous.version + 1 if previous else 1
+    base = previous if previous and (version - 1) % KEYFRAME_INTERVAL else None
+    data = encode(document, load(base) if base else None)
+    return EstimateSnapshot.objects.create(
+        estimate=estimate,
+        version=version,
+        comment=comment,
+        base=base,
+        data=data,
+        size=len(data),
+        rows_count=rows_count(document),
+    )
+
+
+@transaction.atomic
+def restore_snapshot(snapshot, backup=True):
+    """
+    Заменяет дерево ВОР содержимым версии (bulk_create, без пересчета по шаблонам)
+    При backup=True текущее состояние сначала сохраняется новой версией.
+    """
+    estimate = snapshot.estimate
+    document = load(snapshot)
+    backup_snapshot = None
+    if backup:
+        backup_snapshot = create_snapshot(estimate, comment=f'Перед восстановлением версии {snapshot.version}')
+
+    EstimateItemResource.objects.filter(estimate=estimate).delete()
+    EstimateItem.objects.filter(section_work_type__section__estimate=estimate).delete()
+    EstimateSectionWorkType.objects.filter(section__estimate=estimate).delete()
+    EstimateSection.objects.filter(estimate=estimate).delete()
+    EstimateColdStorage.objects.filter(estimate=estimate).delete()
+    materialize(estimate, document)
+    return backup_snapshot
+
+
+def materialize(estimate, document):
+    """Строки ВОР из документа снимка (bulk_create, без пересчета по шаблонам)"""
+    sections = EstimateSection.objects.bulk_create([
+        EstimateSection(estimate=estimate, work_category_id=category_id, total_area=area)
+        for category_id, area in zip(document[('sections', 'work_category')], document[('sections', 'total_area')])
+    ], batch_size=BATCH_SIZE)
+    work_types = EstimateSectionWorkType.objects.bulk_create([
+        EstimateSectionWorkType(section_id=sections[index].pk, work_type_id=work_type_id, percentage=percentage)
+        for index, work_type_id, percentage in zip(
+            document[('work_types', 'section')], document[('work_types', 'work_type')],
+            document[('work_types', 'percentage')]
+        )
+    ], batch_size=BATCH_SIZE)
+    items = EstimateItem.objects.bulk_create([
+        EstimateItem(section_work_type_id=work_types[index].pk, work_id=work_id, volume=volume)
+        for index, work_id, volume in zip(
+            document[('items', 'section_work_type')], document[('items', 'work')], document[('items', 'volume')]
+        )
+    ], batch_size=BATCH_SIZE)
+    EstimateItemResource.objects.bulk_create([
+        EstimateItemResource(
+            estimate=estimate, estimate_item_id=items[index].pk, resource_id=resource_id, quantity=quantity
+        )
+        for index, resource_id, quantity in zip(
+            document[('resources', 'estimate_item')], document[('resources', 'resource')],
+            document[('resources', 'quantity')]
+        )
+    ], batch_size=BATCH_SIZE)
+
+
+# ---------- сравнение ----------
+
+def _keyed(document):
+    """{таблица: {естественный ключ: значение}}; ключ - id вида работ, типа работ, работы, ресурса"""
+    section_keys = list(document[('sections', 'work_category')])
+    work_type_keys = [
+        (section_keys[index], work_type_id)
+        for index, work_type_id in zip(document[('work_types', 'section')], document[('work_types', 'work_type')])
+    ]
+    item_keys = [
+        (*work_type_keys[index], work_id)
+        for index, work_id in zip(document[('items', 'section_work_type')], document[('items', 'work')])
+    ]
+    resource_keys = [
+        (*item_keys[index], resource_id)
+        for index, resource_id in zip(document[('resources', 'estimate_item')], document[('resources', 'resource')])
+    ]
+    return {
+        'sections': dict(zip(section_keys, document[('sections', 'total_area')])),
+        'work_types': dict(zip(work_type_keys, document[('work_types', 'percentage')])),
+        'items': dict(zip(item_keys, document[('items', 'volume')])),
+        'resources': dict(zip(resource_keys, document[('resources', 'quantity')])),
+    }
+
+
+KEY_FIELDS = {
+    'sections': ['work_category'],
+    'work_types': ['work_category', 'work_type'],
+    'items': ['work_category', 'work_type', 'work'],
+    'resources': ['work_category', 'work_type', 'work', 'resource'],
+}
+VALUE_FIELDS = {
+    'sections': 'total_area',
+    'work_types': 'percentage',
+    'items': 'volume',
+    'resources': 'quantity',
+}
+
+
+def diff(document_a, document_b):
+    """Изменения от a к b по таблицам: added, removed, changed"""
+    keyed_a, keyed_b = _keyed(document_a), _keyed(document_b)
+    result = {}
+    for table in TABLES:
+        a, b = keyed_a[table], keyed_b[table]
+        key_fields, value_field = KEY_FIELDS[table], VALUE_FIELDS[table]
+
+        def row(key, **values):
+            key = key if isinstance(key, tuple) else (key,)
+            return {**dict(zip(key_fields, key)), **values}
+
+        result[table] = {
+            'added': [row(key, **{value_field: b[key]}) for key in b.keys() - a.keys()],
+            'removed': [row(key, **{value_field: a[key]}) for key in a.keys() - b.keys()],
+            'changed': [
+                row(key, old=a[key], new=b[key])
+                for key in a.keys() & b.keys() if a[key] != b[key]
+            ],
+        }
+        for changes in result[table].values():
+            changes.sort(key=lambda change: [change[field] for field in key_fields])
+    return result
@@ -0,0 +1,85 @@
+"""
+Массовая замена ресурса X на Y в шаблонах (WorkResource) и/или в ВОР (EstimateItemResource)
+
+Для каждой таблицы - три запроса вместо сохранения каждой строки:
+1. строки, где в той же работе уже есть Y (конфликт unique_together), сливаются:
+   к количеству Y прибавляется количество X x коэффициент (UPDATE с подзапросом);
+2. слитые строки X удаляются одним DELETE;
+3. остальные строки X переписываются на Y с умножением количества на коэффициент.
+Коэффициент - перевод единиц: количество Y = количество X x коэффициент. Если заменить
+и шаблоны, и ВОР, количества в ВОР остаются согласованными с нормами (volume x норма).
+ВОР в холодном хранении заменяются в документах (cold_storage.substitute_resource).
+"""
+import math
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Subquery
+
+from apps.reference.catalog import bump_catalog_version
+from apps.reference.models import WorkResource
+from . import cold_storage
+from .models import Estimate, EstimateItemResource
+
+
+class SubstitutionError(ValueError):
+    """Некорректные параметры замены"""
+
+
+def _substitute(queryset, group_fields, value_field, source_id, target_id, coefficient):
+    """Замена в одной таблице; group_fields - поля unique_together кроме ресурса"""
+    model = queryset.model
+    same_group = {field: OuterRef(field) for field in group_fields}
+    source_rows = model.objects.filter(resource_id=source_id, **same_group)
+    target_rows = model.objects.filter(resource_id=target_id, **same_group)
+
+    merged = queryset.filter(resource_id=target_id).filter(Exists(source_rows)).update(**{
+        value_field: F(value_field) + Subquery(source_rows.values(value_field)[:1]) * coefficient
+    })
+    colliding = queryset.filter(resource_id=source_id).filter(Exists(target_rows))
+    # Без сборщика удаления: у этих строк нет зависимых записей, сигналы не нужны
+    colliding._raw_delete(colliding.db)
+    updated = queryset.filter(resource_id=source_id).update(
+        resource_id=target_id, **{value_field: F(value_field) * coefficient}
+    )
+    return {'updated': updated, 'merged': merged}
+
+
+@transaction.atomic
+def substitute_resource(source, target, coefficient=1.0, templates=True, estimates=True, estimate_ids=None):
+    """
+    Заменяет ресурс source на target; estimate_ids - только в указанных ВОР.
+    Возвращает {'work_resources': {...}, 'estimate_item_resources': {...}, 'estimates': [id ВОР]}
+    """
+    if source.pk == target.pk:
+        raise SubstitutionError('Ресурс заменяется сам на себя')
+    try:
+        coefficient = float(coefficient)
+    except (TypeError, ValueError):
+        raise SubstitutionError('Коэффициент должен быть числом')
+    if not math.isfinite(coefficient) or not coefficient > 0:
+        raise SubstitutionError('Коэффициент должен быть конечным числом больше нуля')
+    if not templates and not estimates:
+        raise SubstitutionError('Не выбрано, где заменять: в шаблонах и/или в ВОР')
+
+    result = {'work_resources': None, 'estimate_item_resources': None, 'estimates': []}
+    if templates:
+        result['work_resources'] = _substitute(
+            WorkResource.objects.all(), ['work_type_id', 'work_id'], 'quantity_per_unit',
+            source.pk, target.pk, coefficient
+        )
+        transaction.on_commit(bump_catalog_version)
+    if estimates:
+        queryset = EstimateItemResource.objects.all()
+        if estimate_ids is not None:
+            queryset = queryset.filter(estimate_id__in=estimate_ids)
+        estimates_changed = set(
+            queryset.filter(resource_id=source.pk, estimate__deleted_at=None)
+            .order_by().values_list('estimate_id', flat=True).distinct()
+        )
+        result['estimate_item_resources'] = _substitute(
+            queryset, ['estimate_item_id'], 'quantity', source.pk, target.pk, coefficient
+        )
+        cold = cold_storage.substitute_resource(source.pk, target.pk, coefficient, estimate_ids)
+        estimates_changed.update(Estimate.objects.filter(pk__in=cold).values_list('pk', flat=True))
+        result['estimates'] = sorted(estimates_changed)
+    return result
@@ -0,0 +1,198 @@
+"""
+Инкрементальная синхронизация ВОР: строки, измененные после курсора
+
+Таблицы ВОР хранят updated_at, change_seq - номер из общего счетчика (последовательность
+PostgreSQL / таблица-счетчик в SQLite) и change_xid - транзакцию записи (PostgreSQL), их ставят
+триггеры базы при любой вставке и изменении (миграции 0010, 0014). Удаление строки
+записывается в EstimateTombstone с новым номером.
+
+Курсор - пара (change_xid, change_seq), в API строкой '<xid>:<seq>'. На PostgreSQL номер
+выдается при записи, а видна строка после фиксации транзакции, поэтому по одному номеру
+строка долгой транзакции могла бы появиться позади уже выданного курсора. Номера транзакций
+выдаются по возрастанию, и ответ содержит только строки транзакций младше всех еще
+незавершенных (граница снимка): любая строка, которая станет видна позже, окажется
+после курсора. Долгая пишущая транзакция задерживает выдачу изменений до своего завершения.
+В SQLite запись последовательна: change_xid = 0, порядок - по номеру.
+По индексам (change_xid, change_seq) каждой таблицы читается не больше limit строк после
+курсора; стоимость запроса зависит от числа изменений, а не от размера ВОР.
+
+Клиент начинает с since=0 (все строки) и передает next следующего ответа, пока has_more;
+ответ применяется в порядке deleted, затем changes. Удаление строки, которая сейчас есть
+в таблице (id вернула загрузка архива), не выдается.
+Удаленные ВОР (deleted_at) приходят как измененные строки ВОР; очистка и перенос
+в холодное хранение удаляют строки - они приходят в deleted.
+
+Записи об удалении старше TOMBSTONE_RETENTION удаляет prune_tombstones() (команда
+purge_deleted_estimates); курсор старше очищенных записей устарел - клиент синхронизируется
+заново с since=0. То же после удаления без записей об удалении (TRUNCATE при загрузке архива
+в PostgreSQL): mark_all_expired() ставит отметку на текущий номер.
+"""
+import heapq
+import itertools
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    Estimate, EstimateSection, EstimateSectionWorkType,
+    EstimateItem, EstimateItemResource, EstimateTombstone
+)
+
+
+LIMIT = 1000
+MAX_LIMIT = 10000
+START = (0, 0)
+TOMBSTONE_RETENTION = timedelta(days=30)
+TOMBSTONE_BATCH_SIZE = 5000
+# kind отметки очистки: записи об удалении до ее курсора удалены
+PRUNED = 'pruned'
+# имя в API -> модель; имена совпадают с kind в триггере удаления (миграция 0010)
+KINDS = {
+    'estimates': Estimate,
+    'estimate-sections': EstimateSection,
+    'estimate-section-work-types': EstimateSectionWorkType,
+    'estimate-items': EstimateItem,
+    'estimate-item-resources': EstimateItemResource,
+}
+# Транзакции с меньшим номером завершены; строки своей транзакции тоже не выдаются
+# (запрос синхронизации только читает)
+VISIBLE_XID_SQL = 'SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint'
+
+
+class CursorExpired(RuntimeError):
+    """Записи об удалении после курсора уже очищены"""
+
+
+def parse_cursor(value):
+    """'<xid>:<seq>' или '0' -> (xid, seq); ValueError для неверного курсора"""
+    if str(value) == '0':
+        return START
+    xid, seq = (int(part) for part in str(value).split(':'))
+    if xid < 0 or seq < 0:
+        raise ValueError(value)
+    return xid, seq
+
+
+def format_cursor(cursor):
+    return '0' if cursor == START else f'{cursor[0]}:{cursor[1]}'
+
+
+def _visible_xid():
+    """Граница: строки транзакций с change_xid меньше нее видны и не изменятся задним числом"""
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(VISIBLE_XID_SQL)
+        return cursor.fetchone()[0]
+
+
+def _after(queryset, since, visible_xid):
+    """Строки после курсора по возрастанию (change_xid, change_seq)"""
+    xid, seq = since
+    queryset = queryset.filter(change_xid__gte=xid).filter(Q(change_xid__gt=xid) | Q(change_seq__gt=seq))
+    if visible_xid is not None:
+        queryset = queryset.filter(change_xid__lt=visible_xid)
+    return queryset.order_by('change_xid', 'change_seq')
+
+
+def _changed_rows(kind, model, since, limit, visible_xid):
+    """((change_xid, change_seq), kind, строка); FK - id под именем поля, как в API"""
+    fields = model._meta.concrete_fields
+    names = [field.name for field in fields]
+    xid_index, seq_index = names.index('change_xid'), names.index('change_seq')
+    # _base_manager: строки удаленных ВОР тоже (отметка удаления - изменение ВОР)
+    rows = _after(model._base_manager.all(), since, visible_xid)
+    for row in rows.values_list(*[field.attname for field in fields])[:limit]:
+        yield (row[xid_index], row[seq_index]), kind, dict(zip(names, row))
+
+
+def _horizon():
+    """Курсор отметки очистки или None"""
+    return EstimateTombstone.objects.filter(kind=PRUNED).values_list('change_xid', 'change_seq').first()
+
+
+def changes(since=START, limit=LIMIT):
+    """
+    {'since', 'next', 'has_more', 'changes': {kind: [строки]}, 'deleted': {kind: [id]}}
+    Строки и удаления после курсора since, не больше limit, по возрастанию курсора;
+    CursorExpired, если удаления после since уже очищены
+    """
+    if since != START:
+        horizon = _horizon()
+        if horizon is not None and since < horizon:
+            raise CursorExpired(f'Курсор {format_cursor(since)} устарел, синхронизируйте заново с since=0')
+    visible_xid = _visible_xid()
+    streams = [_changed_rows(kind, model, since, limit + 1, visible_xid) for kind, model in KINDS.items()]
+    tombstones = (
+        _after(EstimateTombstone.objects.exclude(kind=PRUNED), since, visible_xid)
+        .values_list('change_xid', 'change_seq', 'kind', 'row_id')[:limit + 1]
+    )
+    streams.append(((xid, seq), kind, row_id) for xid, seq, kind, row_id in tombstones)
+
+    page = list(itertools.islice(heapq.merge(*streams, key=lambda change: change[0]), limit + 1))
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    result = {
+        'since': format_cursor(since),
+        'next': format_cursor(page[-1][0] if page else since),
+        'has_more': has_more,
+        'changes': {kind: [] for kind in KINDS},
+        'deleted': {kind: [] for kind in KINDS},
+    }
+    for _, kind, row in page:
+        if isinstance(row, dict):
+            result['changes'][kind].append(row)
+        else:
+            result['deleted'][kind].append(row)
+    for kind, ids in result['deleted'].items():
+        if ids:
+            existing = set(KINDS[kind]._base_manager.filter(pk__in=ids).values_list('pk', flat=True))
+            result['deleted'][kind] = [row_id for row_id in ids if row_id not in existing]
+    return result
+
+
+def mark_all_expired():
+    """
+    Отметка очистки на новом номере: все выданные курсоры устарели. Вызывается в транзакции,
+    удалившей строки ВОР без триггеров удаления
+    """
+    table = EstimateTombstone._meta.db_table
+    if connection.vendor == 'postgresql':
+        seq, xid = "nextval('estimates_change_seq')", 'pg_current_xact_id()::text::bigint'
+    else:
+        seq, xid = '(SELECT value FROM estimates_change_seq)', '0'
+    with transaction.atomic(), connection.cursor() as cursor:
+        EstimateTombstone.objects.filter(kind=PRUNED).delete()
+        if connection.vendor != 'postgresql':
+            cursor.execute('UPDATE estimates_change_seq SET value = value + 1')
+        cursor.execute(
+            f'INSERT INTO {table} (kind, row_id, change_seq, change_xid, deleted_at) '
+            f'VALUES (%s, 0, {seq}, {xid}, CURRENT_TIMESTAMP)', [PRUNED]
+        )
+
+
+def prune_tombstones(older_than=TOMBSTONE_RETENTION, batch_size=TOMBSTONE_BATCH_SIZE):
+    """
+    Удаляет записи об удалении старше older_than порциями; возвращает число удаленных.
+    Самая поздняя по курсору очищенная запись остается отметкой PRUNED.
+    """
+    queryset = EstimateTombstone.objects.filter(deleted_at__lt=timezone.now() - older_than).exclude(kind=PRUNED)
+    pruned = 0
+    while True:
+        with transaction.atomic():
+            rows = list(queryset.order_by('change_xid', 'change_seq')
+                        .values_list('change_xid', 'change_seq', 'pk')[:batch_size])
+            if not rows:
+                return pruned
+            marker = (
+                EstimateTombstone.objects.select_for_update().filter(kind=PRUNED)
+                .values_list('change_xid', 'change_seq', 'pk').first()
+            )
+            candidates = rows + ([marker] if marker else [])
+            newest = max(candidates)
+            EstimateTombstone.objects.filter(pk__in=[row[2] for row in candidates if row != newest]).delete()
+            EstimateTombstone.objects.filter(pk=newest[2]).update(kind=PRUNED)
+        pruned += len(rows)
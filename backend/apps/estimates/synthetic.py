@@ -0,0 +1,257 @@
+"""
+Генератор синтетических данных для нагрузочных тестов и бенчмарков
+
+Строит справочник (виды работ → типы работ → работы → ресурсы) и N ВОР.
+Объемы и количества считаются по тем же формулам, что и в моделях:
+volume = total_area × (percentage / 100) × work_volume_per_unit
+quantity = volume × quantity_per_unit
+Все строки создаются через bulk_create, без пересчета в save().
+"""
+import random
+from dataclasses import dataclass
+
+from django.db import transaction
+
+from apps.reference.catalog import bump_catalog_version
+from apps.reference.models import (
+    WorkCategory, WorkType, Work, Resource, WorkTypeWork, WorkResource
+)
+from .models import (
+    Estimate, EstimateSection, EstimateSectionWorkType,
+    EstimateItem, EstimateItemResource
+)
+
+
+BATCH_SIZE = 2000
+
+UNITS = ['м2', 'м3', 'м', 'шт', 'кг', 'т', 'л']
+
+
+@dataclass
+class SyntheticConfig:
+    estimates: int = 10
+    categories: int = 5
+    work_types_per_category: int = 4
+    work_types_per_section: int = 3
+    works_per_type: int = 8
+    resources_per_work: int = 4
+    works_pool: int = 200
+    resources_pool: int = 300
+    min_area: float = 50.0
+    max_area: float = 5000.0
+    name_prefix: str = 'SYN'
+    seed: int = 0
+
+
+def _split_percentages(rng, parts):
+    """Случайное разбиение 100% на parts частей (с точностью до 0.01)"""
+    weights = [rng.random() + 0.1 for _ in range(parts)]
+    total = sum(weights)
+    percentages = [round(100 * w / total, 2) for w in weights]
+    percentages[-1] = round(100 - sum(percentages[:-1]), 2)
+    return percentages
+
+
+def generate_catalog(config, rng):
+    """Справочник: возвращает {category_id: [work_type_id, ...]} и шаблоны"""
+    prefix = config.name_prefix
+    categories = WorkCategory.objects.bulk_create([
+        WorkCategory(name=f'{prefix} Вид работ {i + 1}') for i in range(config.categories)
+    ])
+    work_types = WorkType.objects.bulk_create([
+        WorkType(category=category, name=f'{prefix} Тип работ {category.pk}-{j + 1}')
+        for category in categories
+        for j in range(config.work_types_per_category)
+    ], batch_size=BATCH_SIZE)
+    works = Work.objects.bulk_create([
+        Work(name=f'{prefix} Работа {i + 1}', unit=rng.choice(UNITS))
+        for i in range(max(config.works_pool, config.works_per_type))
+    ], batch_size=BATCH_SIZE)
+    resources = Resource.objects.bulk_create([
+        Resource(name=f'{prefix} Ресурс {i + 1}', unit=rng.choice(UNITS))
+        for i in range(max(config.resources_pool, config.resources_per_work))
+    ], batch_size=BATCH_SIZE)
+
+    # Шаблоны: work_type_id -> [(work_id, volume_per_unit, [(resource_id, quantity_per_unit)])]
+    templates = {}
+    work_type_works = []
+    work_resources = []
+    for work_type in work_types:
+        template = []
+        for order_index, work in enumerate(rng.sample(works, config.works_per_type)):
+            volume_per_unit = round(rng.uniform(0.01, 1.5), 4)
+            work_type_works.append(WorkTypeWork(
+                work_type=work_type, work=work,
+                order_index=order_index, work_volume_per_unit=volume_per_unit
+            ))
+            norms = []
+            for resource in rng.sample(resources, config.resources_per_work):
+                quantity_per_unit = round(rng.uniform(0.001, 50), 4)
+                work_resources.append(WorkResource(
+                    work_type=work_type, work=work, resource=resource,
+                    quantity_per_unit=quantity_per_unit
+                ))
+                norms.append((resource.pk, quantity_per_unit))
+            template.append((work.pk, volume_per_unit, norms))
+        templates[work_type.pk] = template
+    WorkTypeWork.objects.bulk_create(work_type_works, batch_size=BATCH_SIZE)
+    WorkResource.objects.bulk_create(work_resources, batch_size=BATCH_SIZE)
+
+    category_work_types = {}
+    for work_type in work_types:
+        category_work_types.setdefault(work_type.category_id, []).append(work_type.pk)
+    return category_work_types, templates
+
+
+def generate_estimates(config, rng, category_work_types, templates):
+    """ВОР со всеми разделами, типами работ, работами и ресурсами"""
+    prefix = config.name_prefix
+    estimates = Estimate.objects.bulk_create([
+        Estimate(
+            name=f'{prefix} ВОР {i + 1}',
+            object_name=f'{prefix} Объект {i + 1}',
+            status=rng.choice(Estimate.STATUS_CHOICES)[0]
+        )
+        for i in range(config.estimates)
+    ], batch_size=BATCH_SIZE)
+
+    sections = EstimateSection.objects.bulk_create([
+        EstimateSection(
+            estimate=estimate, work_category_id=category_id,
+            total_area=round(rng.uniform(config.min_area, config.max_area), 2)
+        )
+        for estimate in estimates
+        for category_id in category_work_types
+    ], batch_size=BATCH_SIZE)
+
+    section_work_types = []
+    for section in sections:
+        candidates = category_work_types[section.work_category_id]
+        chosen = rng.sample(candidates, min(config.work_types_per_section, len(candidates)))
+        for work_type_id, percentage in zip(chosen, _split_percentages(rng, len(chosen))):
+            section_work_types.append(EstimateSectionWorkType(
+                section=section, work_type_id=work_type_id, percentage=percentage
+            ))
+    section_work_types = EstimateSectionWorkType.objects.bulk_create(
+        section_work_types, batch_size=BATCH_SIZE
+    )
+
+    areas = {section.pk: section.total_area for section in sections}
+    items = []
+    item_norms = []
+    for section_work_type in section_work_types:
+        type_area = areas[section_work_type.section_id] * (section_work_type.percentage / 100)
+        for work_id, volume_per_unit, norms in templates[section_work_type.work_type_id]:
+            volume = type_area * volume_per_unit
+            items.append(EstimateItem(
+                section_work_type=section_work_type, work_id=work_id, volume=volume
+            ))
+            item_norms.append(norms)
+    items = EstimateItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+
+    item_resources = [
+        EstimateItemResource(
+            estimate_id=item.section_work_type.section.estimate_id, estimate_item=item,
+            resource_id=resource_id, quantity=item.volume * quantity_per_unit
+        )
+        for item, norms in zip(items, item_norms)
+        for resource_id, quantity_per_unit in norms
+    ]
+    EstimateItemResource.objects.bulk_create(item_resources, batch_size=BATCH_SIZE)
+
+    return {
+        'estimates': len(estimates),
+        'sections': len(sections),
+        'section_work_types': len(section_work_types),
+        'items': len(items),
+        'item_resources': len(item_resources),
+    }
+
+
+@transaction.atomic
+def generate_synthetic_data(config=None):
+    """Справочник + ВОР по конфигурации; возвращает количество созданных строк"""
+    config = config or SyntheticConfig()
+    rng = random.Random(config.seed)
+    category_work_types, templates = generate_catalog(config, rng)
+    stats = generate_estimates(config, rng, category_work_types, templates)
+    transaction.on_commit(bump_catalog_version)
+    return {
+        'categories': len(category_work_types),
+        'work_types': len(templates),
+        **stats,
+    }
+
+
+def clone_estimate(estimate, copies=1):
+    """
+    Копирует ВОР со всем деревом (разделы, типы работ, работы, ресурсы) copies раз
+    Используется для масштабирования реального набора данных (backup.sql) под нагрузочные тесты.
+    """
+    sections = list(EstimateSection.objects.filter(estimate=estimate).order_by('pk'))
+    section_work_types = list(
+        EstimateSectionWorkType.objects.filter(section__estimate=estimate).order_by('pk')
+    )
+    items = list(
+        EstimateItem.objects.filter(section_work_type__section__estimate=estimate).order_by('pk')
+    )
+    item_resources = list(
+        EstimateItemResource.objects.filter(
+            estimate=estimate
+        ).order_by('pk')
+    )
+
+    created = 0
+    for copy_number in range(1, copies + 1):
+        new_estimate = Estimate.objects.create(
+            name=f'{estimate.name} (копия {copy_number})',
+            object_name=estimate.object_name,
+            status=estimate.status,
+        )
+        new_sections = EstimateSection.objects.bulk_create([
+            EstimateSection(
+                estimate=new_estimate, work_category_id=section.work_category_id,
+                total_area=section.total_area
+            )
+            for section in sections
+        ], batch_size=BATCH_SIZE)
+        section_ids = {old.pk: new.pk for old, new in zip(sections, new_sections)}
+
+        new_section_work_types = EstimateSectionWorkType.objects.bulk_create([
+            EstimateSectionWorkType(
+                section_id=section_ids[swt.section_id], work_type_id=swt.work_type_id,
+                percentage=swt.percentage
+            )
+            for swt in section_work_types
+        ], batch_size=BATCH_SIZE)
+        swt_ids = {old.pk: new.pk for old, new in zip(section_work_types, new_section_work_types)}
+
+        new_items = EstimateItem.objects.bulk_create([
+            EstimateItem(
+                section_work_type_id=swt_ids[item.section_work_type_id], work_id=item.work_id,
+                volume=item.volume
+            )
+            for item in items
+        ], batch_size=BATCH_SIZE)
+        item_ids = {old.pk: new.pk for old, new in zip(items, new_items)}
+
+        EstimateItemResource.objects.bulk_create([
+            EstimateItemResource(
+                estimate=new_estimate, estimate_item_id=item_ids[resource.estimate_item_id],
+                resource_id=resource.resource_id, quantity=resource.quantity
+            )
+            for resource in item_resources
+        ], batch_size=BATCH_SIZE)
+        created += 1
+    return created
+
+
+@transaction.atomic
+def scale_estimates(factor):
+    """Увеличивает набор ВОР в factor раз копированием существующих"""
+    if factor <= 1:
+        return 0
+    return sum(
+        clone_estimate(estimate, copies=factor - 1)
+        for estimate in list(Estimate.objects.order_by('pk'))
+    )
@@ -1,3 +1,582 @@
+import io
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.reference.models import (
+    WorkCategory, WorkType, Work, Resource, WorkTypeWork, WorkResource
+)
+from .models import (
+    Estimate, EstimateSection, EstimateSectionWorkType, EstimateItem, EstimateItemResource, EstimateSnapshot
+)
+from .synthetic import SyntheticConfig, generate_synthetic_data
+from .transfer import export_archive, export_querysets, import_archive
+
+
+class AdminChangelistQueryCountTests(TestCase):
+    """Количество запросов страниц списка в админке не зависит от числа строк"""
+
+    changelists = [
+        'admin:estimates_estimate_changelist',
+        'admin:estimates_estimatesection_changelist',
+        'admin:estimates_estimatesectionworktype_changelist',
+        'admin:estimates_estimateitem_changelist',
+        'admin:estimates_estimateitemresource_changelist',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.category = WorkCategory.objects.create(name='Полы')
+        cls.work_types = [
+            WorkType.objects.create(category=cls.category, name=f'Тип {i}') for i in range(2)
+        ]
+        for work_type in cls.work_types:
+            for i in range(3):
+                work = Work.objects.create(name=f'Работа {work_type.pk}-{i}', unit='м2')
+                WorkTypeWork.objects.create(work_type=work_type, work=work, order_index=i, work_volume_per_unit=0.5)
+                for j in range(2):
+                    resource = Resource.objects.create(name=f'Ресурс {work.pk}-{j}', unit='кг')
+                    WorkResource.objects.create(work_type=work_type, work=work, resource=resource, quantity_per_unit=2)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def create_estimates(self, count):
+        for i in range(count):
+            estimate = Estimate.objects.create(name=f'ВОР {i}', object_name='Объект')
+            section = EstimateSection.objects.create(estimate=estimate, work_category=self.category, total_area=100)
+            for work_type in self.work_types:
+                EstimateSectionWorkType.objects.create(section=section, work_type=work_type, percentage=50)
+
+    def count_queries(self, url_name):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_changelist_queries_are_bounded(self):
+        self.create_estimates(1)
+        few = {url_name: self.count_queries(url_name) for url_name in self.changelists}
+        self.create_estimates(4)
+        for url_name in self.changelists:
+            with self.subTest(url_name):
+                self.assertEqual(self.count_queries(url_name), few[url_name])
+
+    def test_autocomplete_filter_limits_items_to_estimate(self):
+        self.create_estimates(2)
+        estimate = Estimate.objects.first()
+        url = reverse('admin:estimates_estimateitemresource_changelist')
+        response = self.client.get(url, {
+            'estimate_item__section_work_type__section__estimate__id__exact': estimate.pk
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 12)
+        self.assertContains(response, 'data-model-name="estimatesection"')
+        autocomplete = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'estimates', 'model_name': 'estimatesection',
+            'field_name': 'estimate', 'term': estimate.name,
+        })
+        self.assertEqual(autocomplete.status_code, 200)
+        self.assertEqual(autocomplete.json()['results'][0]['id'], str(estimate.pk))
+
+
+class ArchiveTransferTests(TestCase):
+    """export_vor / import_vor: архив переносит ВОР и справочник без потерь"""
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_synthetic_data(SyntheticConfig(
+            estimates=3, categories=2, work_types_per_category=2, work_types_per_section=2,
+            works_per_type=3, resources_per_work=2, works_pool=10, resources_pool=10,
+        ))
+
+    def export(self, **scope):
+        buffer = io.BytesIO()
+        export_archive(buffer, export_querysets(**scope), chunk_bytes=1024)
+        buffer.seek(0)
+        return buffer
+
+    def quantities(self, estimate):
+        return sorted(
+            (row.estimate_item.work.name, row.resource.name, round(row.quantity, 6))
+            for row in EstimateItemResource.objects.filter(
+                estimate_item__section_work_type__section__estimate=estimate
+            ).select_related('estimate_item__work', 'resource')
+        )
+
+    def test_merge_copies_estimate_and_matches_catalog(self):
+        estimate = Estimate.objects.order_by('pk').first()
+        works_before = Work.objects.count()
+        stats = import_archive(self.export(estimate_ids=[estimate.pk]), mode='merge')
+
+        self.assertEqual(stats['estimates_estimate']['inserted'], 1)
+        self.assertEqual(stats['reference_work']['inserted'], 0)
+        self.assertEqual(Work.objects.count(), works_before)
+        copy = Estimate.objects.order_by('-pk').first()
+        self.assertNotEqual(copy.pk, estimate.pk)
+        self.assertEqual(self.quantities(copy), self.quantities(estimate))
+
+    def test_replace_restores_full_archive(self):
+        archive = self.export()
+        counts = {model: model.objects.count() for model in (Estimate, EstimateItemResource, WorkResource)}
+        Estimate.objects.all().delete()
+        import_archive(archive, mode='replace')
+        for model, count in counts.items():
+            self.assertEqual(model.objects.count(), count)
+        # Новые записи получают id после загруженных
+        estimate = Estimate.objects.create(name='Новая', object_name='Объект')
+        self.assertGreater(estimate.pk, Estimate.objects.exclude(pk=estimate.pk).order_by('-pk')[0].pk)
+
+    def test_replace_is_visible_to_sync(self):
+        """SQLite: удаления при замене приходят в deleted; PostgreSQL (TRUNCATE): курсор устаревает"""
+        from . import sync
+
+        since = sync.changes(limit=sync.MAX_LIMIT)
+        archive = self.export(estimate_ids=[Estimate.objects.order_by('pk').first().pk])
+        removed = set(Estimate.objects.order_by('pk').values_list('pk', flat=True)[1:])
+        import_archive(archive, mode='replace')
+        if connection.vendor == 'postgresql':
+            # строки транзакции теста синхронизации не видны - курсор клиента из прошлого
+            with self.assertRaises(sync.CursorExpired):
+                sync.changes((1, 1))
+            return
+        deleted = sync.changes(sync.parse_cursor(since['next']), limit=sync.MAX_LIMIT)['deleted']
+        self.assertEqual(set(deleted['estimates']), removed)
+
+    def test_imported_rows_do_not_keep_source_transaction(self):
+        """SQLite: change_xid из архива PostgreSQL сбрасывается, курсор не уходит вперед"""
+        from . import sync
+
+        if connection.vendor != 'sqlite':
+            self.skipTest('в PostgreSQL change_xid ставит триггер')
+        Estimate.objects.create(name='Из архива', object_name='Объект', change_xid=987654)
+        since = sync.parse_cursor(sync.changes(limit=sync.MAX_LIMIT)['next'])
+        self.assertEqual(since[0], 0)
+        estimate = Estimate.objects.create(name='Новая', object_name='Объект')
+        self.assertEqual([row['id'] for row in sync.changes(since)['changes']['estimates']], [estimate.pk])
+
+    def archive_with_history(self, estimate):
+        """Две версии ВОР (вторая - дельта) и перенос в холодное хранение"""
+        from . import snapshots
+        from .cold_storage import archive_estimate
+        snapshots.create_snapshot(estimate)
+        EstimateSectionWorkType.objects.filter(section__estimate=estimate).update(percentage=10)
+        snapshots.create_snapshot(estimate)
+        Estimate.objects.filter(pk=estimate.pk).update(status='archived')
+        return archive_estimate(estimate)
+
+    def test_replace_keeps_snapshots_and_cold_storage(self):
+        from . import snapshots
+        estimate = Estimate.objects.order_by('pk').first()
+        cold = self.archive_with_history(estimate)
+        versions = [snapshots.load(snapshot) for snapshot in estimate.snapshots.order_by('version')]
+        archive = self.export()
+        Estimate.all_objects.all().delete()
+        EstimateSnapshot.objects.all().delete()
+        import_archive(archive, mode='replace')
+
+        self.assertEqual(bytes(estimate.cold_storage.data), bytes(cold.data))
+        self.assertEqual(
+            [snapshots.load(snapshot) for snapshot in estimate.snapshots.order_by('version')], versions
+        )
+
+    def test_replace_without_snapshots_clears_them(self):
+        from . import snapshots
+        snapshots.create_snapshot(Estimate.objects.order_by('pk').first())
+        querysets = export_querysets()
+        del querysets[EstimateSnapshot]
+        buffer = io.BytesIO()
+        export_archive(buffer, querysets)
+        buffer.seek(0)
+        import_archive(buffer, mode='replace')
+        self.assertFalse(EstimateSnapshot.objects.exists())
+
+    def test_merge_remaps_catalog_ids_in_documents(self):
+        from . import snapshots
+        from .cold_storage import rehydrate
+        estimate = Estimate.objects.order_by('pk').first()
+        quantities = self.quantities(estimate)
+        cold = self.archive_with_history(estimate)
+        archive = self.export(estimate_ids=[estimate.pk])
+        # Ресурс переименован - при загрузке его строка архива добавляется с новым id
+        resource = Resource.objects.get(pk=snapshots.decode(cold.data)[('resources', 'resource')][0])
+        name = resource.name
+        Resource.objects.filter(pk=resource.pk).update(name=f'{name} (старый)')
+        stats = import_archive(archive, mode='merge')
+
+        self.assertEqual(stats['reference_resource']['inserted'], 1)
+        self.assertEqual(stats['estimates_estimatesnapshot']['inserted'], 2)
+        copy = Estimate.objects.order_by('-pk').first()
+        new_resource = Resource.objects.get(name=name)
+        document = snapshots.decode(copy.cold_storage.data)
+        self.assertIn(new_resource.pk, document[('resources', 'resource')])
+        self.assertNotIn(resource.pk, document[('resources', 'resource')])
+        latest = copy.snapshots.order_by('-version').first()
+        self.assertIsNotNone(latest.base_id)
+        self.assertEqual(snapshots.load(latest), document)
+        rehydrate(copy)
+        self.assertEqual(self.quantities(copy), quantities)
+
+
+class ResourceSubstitutionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        category = WorkCategory.objects.create(name='Полы')
+        cls.work_type = WorkType.objects.create(category=category, name='Стяжка')
+        cls.work_a = Work.objects.create(name='Устройство стяжки', unit='м3')
+        cls.work_b = Work.objects.create(name='Устройство пленки', unit='м2')
+        cls.old = Resource.objects.create(name='ПЭ пленка 150 мкм', unit='м2')
+        cls.new = Resource.objects.create(name='ПЭ пленка 200 мкм', unit='м2')
+        WorkTypeWork.objects.create(work_type=cls.work_type, work=cls.work_a, order_index=1, work_volume_per_unit=0.05)
+        WorkTypeWork.objects.create(work_type=cls.work_type, work=cls.work_b, order_index=2, work_volume_per_unit=1.1)
+        WorkResource.objects.create(work_type=cls.work_type, work=cls.work_a, resource=cls.old, quantity_per_unit=2)
+        WorkResource.objects.create(work_type=cls.work_type, work=cls.work_a, resource=cls.new, quantity_per_unit=3)
+        WorkResource.objects.create(work_type=cls.work_type, work=cls.work_b, resource=cls.old, quantity_per_unit=4)
+        cls.estimate = Estimate.objects.create(name='ВОР', object_name='Объект')
+        section = EstimateSection.objects.create(estimate=cls.estimate, work_category=category, total_area=100)
+        cls.section_work_type = EstimateSectionWorkType.objects.create(
+            section=section, work_type=cls.work_type, percentage=50
+        )
+
+    def assert_consistent_with_templates(self):
+        norms = {
+            (work_id, resource_id): quantity_per_unit
+            for work_id, resource_id, quantity_per_unit in WorkResource.objects.values_list(
+                'work_id', 'resource_id', 'quantity_per_unit'
+            )
+        }
+        for item_resource in EstimateItemResource.objects.select_related('estimate_item'):
+            item = item_resource.estimate_item
+            self.assertAlmostEqual(
+                item_resource.quantity, item.volume * norms[(item.work_id, item_resource.resource_id)], places=9
+            )
+
+    def test_substitution_merges_and_converts(self):
+        from .substitution import substitute_resource
+
+        result = substitute_resource(self.old, self.new, coefficient=0.5)
+        self.assertEqual(result['work_resources'], {'updated': 1, 'merged': 1})
+        self.assertEqual(result['estimate_item_resources'], {'updated': 1, 'merged': 1})
+        self.assertEqual(result['estimates'], [self.estimate.pk])
+        self.assertFalse(WorkResource.objects.filter(resource=self.old).exists())
+        self.assertFalse(EstimateItemResource.objects.filter(resource=self.old).exists())
+        self.assertEqual(
+            dict(WorkResource.objects.values_list('work_id', 'quantity_per_unit')),
+            {self.work_a.pk: 3 + 2 * 0.5, self.work_b.pk: 4 * 0.5}
+        )
+        self.assert_consistent_with_templates()
+
+        # пересчет ВОР после замены дает те же нормы
+        self.section_work_type.percentage = 80
+        self.section_work_type.save()
+        self.assert_consistent_with_templates()
+
+    def test_admin_action(self):
+        self.client.force_login(self.user)
+        url = reverse('admin:reference_resource_changelist')
+        data = {'action': 'substitute_resource', '_selected_action': [self.old.pk]}
+        response = self.client.post(url, data)
+        self.assertContains(response, 'Заменить на')
+        response = self.client.post(url, {**data, 'apply': '1', 'target': self.new.pk, 'coefficient': '1',
+                                          'templates': 'on', 'estimates': 'on'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(EstimateItemResource.objects.filter(resource=self.old).exists())
+        self.assertTrue(Resource.objects.filter(pk=self.old.pk).exists())
+        self.assert_consistent_with_templates()
+
+    def test_api_parses_flags_and_rejects_bad_input(self):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('resource-substitute', args=[self.old.pk])
+        self.assertEqual(client.post(url, [self.new.pk], format='json').status_code, 400)
+        for coefficient in ('inf', 'nan', '-1'):
+            response = client.post(url, {'target': self.new.pk, 'coefficient': coefficient})
+            self.assertEqual(response.status_code, 400, coefficient)
+        self.assertTrue(WorkResource.objects.filter(resource=self.old).exists())
+
+        # форма передает флаги строками: 'false' - не заменять
+        response = client.post(url, {'target': self.new.pk, 'templates': 'false', 'estimates': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['work_resources'])
+        self.assertTrue(WorkResource.objects.filter(resource=self.old).exists())
+        self.assertFalse(EstimateItemResource.objects.filter(resource=self.old).exists())
+
+
+class SoftDeleteTests(TestCase):
+    """Удаление ВОР - мягкое; строки удаляет purge_deleted_estimates"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        generate_synthetic_data(SyntheticConfig(
+            estimates=2, categories=2, work_types_per_category=2, work_types_per_section=2,
+            works_per_type=3, resources_per_work=2, works_pool=10, resources_pool=10,
+        ))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.estimate, self.other = Estimate.objects.order_by('pk')
+
+    def rows(self, estimate):
+        return EstimateItemResource.objects.filter(
+            estimate_item__section_work_type__section__estimate=estimate
+        ).count()
+
+    def test_delete_hides_estimate(self):
+        from . import snapshots
+
+        snapshots.create_snapshot(self.estimate)
+        snapshots.create_snapshot(self.estimate)
+        rows = self.rows(self.estimate)
+        with self.assertNumQueries(1):
+            Estimate.objects.filter(pk=self.estimate.pk).delete()
+
+        self.assertEqual(self.client.get(f'/api/estimates/{self.estimate.pk}/').status_code, 404)
+        listed = [row['id'] for row in self.client.get('/api/estimates/').json()['results']]
+        self.assertEqual(listed, [self.other.pk])
+        sections = self.client.get('/api/estimate-sections/', {'estimate': self.other.pk}).json()
+        self.assertEqual(
+            self.client.get('/api/estimate-sections/').json()['count'], sections['count']
+        )
+        # строки остаются до очистки, удаление можно отменить
+        self.assertEqual(self.rows(self.estimate), rows)
+        Estimate.all_objects.get(pk=self.estimate.pk).restore()
+        self.assertEqual(self.client.get(f'/api/estimates/{self.estimate.pk}/').status_code, 200)
+
+    def test_purge_removes_rows_in_batches(self):
+        from django.core.management import call_command
+        from . import snapshots
+
+        snapshots.create_snapshot(self.estimate)
+        snapshots.create_snapshot(self.estimate)
+        other_rows = self.rows(self.other)
+        self.estimate.delete()
+        call_command('purge_deleted_estimates', batch_size=5, stdout=io.StringIO())
+
+        self.assertFalse(Estimate.all_objects.filter(pk=self.estimate.pk).exists())
+        for model, path in [
+            (EstimateSection, 'estimate'),
+            (EstimateItem, 'section_work_type__section__estimate'),
+            (EstimateItemResource, 'estimate_item__section_work_type__section__estimate'),
+            (EstimateSnapshot, 'estimate'),
+        ]:
+            self.assertFalse(model.objects.filter(**{f'{path}_id': self.estimate.pk}).exists())
+        self.assertEqual(self.rows(self.other), other_rows)
+
+    def test_purge_respects_grace_period(self):
+        from django.core.management import call_command
+
+        self.estimate.delete()
+        call_command('purge_deleted_estimates', older_than=24, stdout=io.StringIO())
+        self.assertTrue(Estimate.all_objects.filter(pk=self.estimate.pk).exists())
+
+
+class SyntheticScalingTests(TestCase):
+    """Копирование ВОР для нагрузочных тестов (restore_backup --scale)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_synthetic_data(SyntheticConfig(
+            estimates=2, categories=2, work_types_per_category=2, work_types_per_section=2,
+            works_per_type=3, resources_per_work=2, works_pool=10, resources_pool=10,
+        ))
+
+    def tree(self, estimate):
+        return sorted(
+            EstimateItemResource.objects.filter(estimate=estimate).values_list(
+                'estimate_item__section_work_type__section__work_category_id',
+                'estimate_item__section_work_type__section__total_area',
+                'estimate_item__section_work_type__work_type_id',
+                'estimate_item__section_work_type__percentage',
+                'estimate_item__work_id', 'estimate_item__volume', 'resource_id', 'quantity',
+            )
+        )
+
+    def test_clone_copies_tree(self):
+        from .synthetic import clone_estimate
+
+        estimate = Estimate.objects.order_by('pk').first()
+        self.assertEqual(clone_estimate(estimate, copies=2), 2)
+        copies = Estimate.objects.filter(name__startswith=f'{estimate.name} (копия ')
+        self.assertEqual(copies.count(), 2)
+        for copy in copies:
+            self.assertEqual(copy.status, estimate.status)
+            self.assertEqual(self.tree(copy), self.tree(estimate))
+
+    def test_scale(self):
+        from .synthetic import scale_estimates
+
+        rows = EstimateItemResource.objects.count()
+        self.assertEqual(scale_estimates(1), 0)
+        self.assertEqual(scale_estimates(3), 4)
+        self.assertEqual(Estimate.objects.count(), 6)
+        self.assertEqual(EstimateItemResource.objects.count(), rows * 3)
+
+
+class ItemResourceEstimateTests(TestCase):
+    """EstimateItemResource.estimate - копия ВОР работы во всех способах создания строк"""
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_synthetic_data(SyntheticConfig(
+            estimates=2, categories=2, work_types_per_category=2, work_types_per_section=2,
+            works_per_type=3, resources_per_work=2, works_pool=10, resources_pool=10,
+        ))
+
+    def assert_consistent(self):
+        for estimate_id, item_estimate_id in EstimateItemResource.objects.values_list(
+            'estimate_id', 'estimate_item__section_work_type__section__estimate_id'
+        ):
+            self.assertEqual(estimate_id, item_estimate_id)
+
+    def test_all_writers_set_estimate(self):
+        from . import snapshots
+        from .synthetic import clone_estimate
+
+        estimate = Estimate.objects.order_by('pk').first()
+        section_work_type = EstimateSectionWorkType.objects.filter(section__estimate=estimate).first()
+        section_work_type.delete()
+        EstimateSectionWorkType.objects.create(
+            section=section_work_type.section, work_type=section_work_type.work_type, percentage=30
+        )
+        snapshot = snapshots.create_snapshot(estimate)
+        snapshots.restore_snapshot(snapshot, backup=False)
+        clone_estimate(estimate, copies=1)
+        self.assert_consistent()
+
+    def test_backfill(self):
+        from .partitioning import backfill_estimate_ids
+
+        count = EstimateItemResource.objects.count()
+        EstimateItemResource.objects.update(estimate=None)
+        self.assertEqual(backfill_estimate_ids(batch_size=7), count)
+        self.assert_consistent()
+
+
+@skipUnless(connection.vendor == 'postgresql', 'секционирование таблиц - только PostgreSQL')
+class ItemResourcePartitioningTests(TestCase):
+    """Движок, версии, замена ресурса и очистка работают с секционированной таблицей"""
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_synthetic_data(SyntheticConfig(
+            estimates=4, categories=2, work_types_per_category=2, work_types_per_section=2,
+            works_per_type=3, resources_per_work=2, works_pool=10, resources_pool=10,
+        ))
+
+    def partition(self, **options):
+        from . import partitioning
+
+        before = sorted(EstimateItemResource.objects.values_list('pk', 'estimate_id', 'quantity'))
+        partitioning.partition(batch_size=7, **options)
+        self.assertTrue(partitioning.is_partitioned())
+        self.assertEqual(sorted(EstimateItemResource.objects.values_list('pk', 'estimate_id', 'quantity')), before)
+
+    def test_range_partitions(self):
+        from . import partitioning
+
+        self.partition(method='range', range_size=2)
+        partitioning.extend_range_partitions(2, 3)
+        estimate = Estimate.objects.create(name='Новая', object_name='Объект')
+        work_type = WorkType.objects.filter(work_type_works__isnull=False).first()
+        section = EstimateSection.objects.create(estimate=estimate, work_category=work_type.category, total_area=10)
+        EstimateSectionWorkType.objects.create(section=section, work_type=work_type, percentage=100)
+        self.assertTrue(EstimateItemResource.objects.filter(estimate=estimate).exists())
+
+    def test_orm_compatibility(self):
+        from django.db import IntegrityError, transaction
+        from django.db.models import Sum
+        from . import snapshots
+        from .purge import purge_estimate
+        from .substitution import substitute_resource
+        from .usage import usage
+
+        self.partition(method='hash', partitions=4)
+        estimate, other = Estimate.objects.order_by('pk')[:2]
+        rows = EstimateItemResource.objects.filter(estimate=estimate)
+        total = rows.aggregate(total=Sum('quantity'))['total']
+
+        # пересчет по шаблону: UPDATE строк по id
+        section_work_type = EstimateSectionWorkType.objects.filter(section__estimate=estimate).first()
+        section_work_type.percentage *= 2
+        section_work_type.save()
+        self.assertNotEqual(rows.aggregate(total=Sum('quantity'))['total'], total)
+
+        # версии: удаление и bulk_create с RETURNING id
+        snapshot = snapshots.create_snapshot(estimate)
+        count = rows.count()
+        snapshots.restore_snapshot(snapshot, backup=False)
+        self.assertEqual(rows.count(), count)
+        new = EstimateItemResource.objects.create(
+            estimate=estimate, estimate_item=rows.first().estimate_item,
+            resource=Resource.objects.exclude(estimate_item_resources__estimate_item=rows.first().estimate_item).first(),
+            quantity=1,
+        )
+        self.assertGreater(new.pk, EstimateItemResource.objects.exclude(pk=new.pk).order_by('-pk')[0].pk)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            EstimateItemResource.objects.create(
+                estimate=estimate, estimate_item=new.estimate_item, resource=new.resource, quantity=2
+            )
+
+        item_resource = EstimateItemResource.objects.filter(estimate=other).first()
+        self.assertEqual(usage('resource', item_resource.resource_id)['count'], EstimateItemResource.objects.filter(
+            resource=item_resource.resource
+        ).values('estimate').distinct().count())
+        substitute_resource(item_resource.resource, Resource.objects.exclude(pk=item_resource.resource_id).first())
+        self.assertFalse(EstimateItemResource.objects.filter(resource=item_resource.resource).exists())
+
+        estimate.delete()
+        purge_estimate(estimate.pk, batch_size=5)
+        self.assertFalse(EstimateItemResource.objects.filter(estimate_id=estimate.pk).exists())
+        self.assertTrue(EstimateItemResource.objects.filter(estimate=other).exists())
+        # отложенные внешние ключи: старая таблица не мешает удалению ВОР
+        connection.check_constraints()
+
+    def test_unpartition(self):
+        from django.db import IntegrityError, transaction
+        from . import partitioning
+        from .models import EstimateTombstone
+
+        self.partition(method='hash', partitions=4)
+        estimate = Estimate.objects.order_by('pk').first()
+        row = EstimateItemResource.objects.filter(estimate=estimate).first()
+        row.quantity = 123
+        row.save()
+        EstimateItemResource.objects.filter(estimate=estimate).exclude(pk=row.pk).first().delete()
+        new = EstimateItemResource.objects.create(
+            estimate=estimate, estimate_item=row.estimate_item,
+            resource=Resource.objects.exclude(estimate_item_resources__estimate_item=row.estimate_item).first(),
+            quantity=1,
+        )
+        rows = sorted(EstimateItemResource.objects.values_list('pk', 'estimate_id', 'resource_id', 'quantity'))
 
-# Create your tests here.
+        partitioning.unpartition()
+        self.assertFalse(partitioning.is_partitioned())
+        self.assertEqual(sorted(EstimateItemResource.objects.values_list(
+            'pk', 'estimate_id', 'resource_id', 'quantity'
+        )), rows)
+        self.assertGreater(EstimateItemResource.objects.create(
+            estimate=estimate, estimate_item=new.estimate_item,
+            resource=Resource.objects.exclude(estimate_item_resources__estimate_item=new.estimate_item).first(),
+            quantity=1,
+        ).pk, new.pk)
+        # номер изменения и удаления снова пишутся триггерами старой таблицы
+        seq = EstimateItemResource.objects.get(pk=new.pk).change_seq
+        new.save()
+        self.assertGreater(EstimateItemResource.objects.get(pk=new.pk).change_seq, seq)
+        new_id = new.pk
+        new.delete()
+        self.assertTrue(EstimateTombstone.objects.filter(kind='estimate-item-resources', row_id=new_id).exists())
+        # внешние ключи возвращены
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            EstimateItemResource.objects.filter(pk=row.pk).update(resource_id=-1)
+            connection.check_constraints()
@@ -0,0 +1,576 @@
+"""
+Архив ВОР: потоковая выгрузка и загрузка справочника и ВОР
+
+Формат - tar: по каждой таблице (в порядке зависимостей) части CSV, сжатые gzip,
+и manifest.json со списком таблиц, колонок, количеством строк и частей.
+- PostgreSQL: COPY (SELECT ...) TO STDOUT / COPY ... FROM STDIN (psycopg2);
+- SQLite: курсор + csv, executemany.
+CSV одинаковый для обеих СУБД - архив из SQLite загружается в PostgreSQL и наоборот.
+
+Режимы загрузки:
+- replace - таблицы архива очищаются, строки загружаются с исходными id
+  (развертывание нового окружения из полной выгрузки). SQLite удаляет строки DELETE -
+  удаления приходят клиентам синхронизации (sync.py); PostgreSQL - TRUNCATE без триггеров
+  удаления, поэтому все курсоры синхронизации устаревают (410, синхронизация с since=0);
+- merge - справочник сопоставляется по естественным ключам (название, единица измерения),
+  недостающие записи добавляются; ВОР получают новые id (перенос ВОР между установками).
+Версии ВОР и холодное хранение переносятся вместе с ВОР: документы (snapshots.py) ссылаются
+на id справочника, в режиме merge они перекодируются на id базы. Двоичные данные в CSV -
+hex с префиксом \\x, как bytea в COPY PostgreSQL.
+"""
+import csv
+import gzip
+import io
+import itertools
+import json
+import tarfile
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.db.models import Q
+
+from apps.reference.catalog import bump_catalog_version
+from apps.reference.models import (
+    WorkCategory, WorkType, Work, Resource, WorkTypeWork, WorkResource
+)
+from . import snapshots, sync
+from .models import (
+    Estimate, EstimateSection, EstimateSectionWorkType,
+    EstimateItem, EstimateItemResource, EstimateSnapshot, EstimateColdStorage, EstimateColdStorageReference
+)
+from .partitioning import backfill_estimate_ids
+
+
+ARCHIVE_FORMAT = 1
+MANIFEST_NAME = 'manifest.json'
+CHUNK_BYTES = 64 * 1024 * 1024
+BATCH_SIZE = 10000
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    model: type
+    # Естественный ключ для сопоставления справочника в режиме merge
+    natural_key: tuple = ()
+
+    @property
+    def label(self):
+        return self.model._meta.label
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    @property
+    def fields(self):
+        return self.model._meta.concrete_fields
+
+
+CATALOG_TABLES = [
+    TableSpec(WorkCategory, ('name',)),
+    TableSpec(WorkType, ('category_id', 'name')),
+    TableSpec(Work, ('name', 'unit')),
+    TableSpec(Resource, ('name', 'unit')),
+    TableSpec(WorkTypeWork, ('work_type_id', 'work_id')),
+    TableSpec(WorkResource, ('work_type_id', 'work_id', 'resource_id')),
+]
+ESTIMATE_TABLES = [
+    TableSpec(Estimate),
+    TableSpec(EstimateSection),
+    TableSpec(EstimateSectionWorkType),
+    TableSpec(EstimateItem),
+    TableSpec(EstimateItemResource),
+    # base ссылается на версию с меньшим id - строки выгружаются по возрастанию id
+    TableSpec(EstimateSnapshot),
+    TableSpec(EstimateColdStorage),
+    TableSpec(EstimateColdStorageReference),
+]
+# Таблицы с документами снимков (столбец data)
+DOCUMENT_MODELS = (EstimateSnapshot, EstimateColdStorage)
+TABLES = CATALOG_TABLES + ESTIMATE_TABLES
+SPECS = {spec.label: spec for spec in TABLES}
+
+
+# ---------- выборка ----------
+
+def _catalog_querysets(work_types, categories=(), works=(), resources=()):
+    """Типы работ с шаблонами и всем, на что они ссылаются (+ дополнительные наборы id)"""
+    templates = WorkTypeWork.objects.filter(work_type__in=work_types)
+    norms = WorkResource.objects.filter(work_type__in=work_types)
+    category_q = Q(pk__in=work_types.values('category'))
+    work_q = Q(pk__in=templates.values('work')) | Q(pk__in=norms.values('work'))
+    resource_q = Q(pk__in=norms.values('resource'))
+    for ids in categories:
+        category_q |= Q(pk__in=ids)
+    for ids in works:
+        work_q |= Q(pk__in=ids)
+    for ids in resources:
+        resource_q |= Q(pk__in=ids)
+    return {
+        WorkCategory: WorkCategory.objects.filter(category_q),
+        WorkType: work_types,
+        Work: Work.objects.filter(work_q),
+        Resource: Resource.objects.filter(resource_q),
+        WorkTypeWork: templates,
+        WorkResource: norms,
+    }
+
+
+def _document_references(snapshot_queryset, cold_queryset):
+    """{модель справочника: set(id)} из версий и холодного хранения ВОР"""
+    result = {model: set() for model in snapshots.REFERENCES.values()}
+    documents = itertools.chain(
+        (document for _, document in snapshots.iter_documents(snapshot_queryset)),
+        (snapshots.decode(data) for data in cold_queryset.values_list('data', flat=True).iterator()),
+    )
+    for document in documents:
+        for model, ids in snapshots.references(document).items():
+            result[model] |= ids
+    return result
+
+
+def export_querysets(estimate_ids=None, category_ids=None, catalog_only=False):
+    """
+    {model: queryset} выгружаемых строк
+    estimate_ids - ВОР со всем деревом и используемой частью справочника;
+    category_ids - часть справочника по видам работ; catalog_only - весь справочник.
+    """
+    if estimate_ids:
+        estimates = Estimate.objects.filter(pk__in=estimate_ids)
+        sections = EstimateSection.objects.filter(estimate__in=estimates)
+        section_work_types = EstimateSectionWorkType.objects.filter(section__in=sections)
+        items = EstimateItem.objects.filter(section_work_type__in=section_work_types)
+        item_resources = EstimateItemResource.objects.filter(estimate_item__in=items)
+        snapshot_queryset = EstimateSnapshot.objects.filter(estimate__in=estimates)
+        cold_queryset = EstimateColdStorage.objects.filter(estimate__in=estimates)
+        # Строк архивных ВОР в таблицах нет - справочник документов выбирается отдельно
+        references = _document_references(snapshot_queryset, cold_queryset)
+        querysets = _catalog_querysets(
+            WorkType.objects.filter(
+                Q(pk__in=section_work_types.values('work_type')) | Q(pk__in=references[WorkType])
+            ),
+            categories=[sections.values('work_category'), references[WorkCategory]],
+            works=[items.values('work'), references[Work]],
+            resources=[item_resources.values('resource'), references[Resource]],
+        )
+        querysets.update({
+            Estimate: estimates,
+            EstimateSection: sections,
+            EstimateSectionWorkType: section_work_types,
+            EstimateItem: items,
+            EstimateItemResource: item_resources,
+            EstimateSnapshot: snapshot_queryset,
+            EstimateColdStorage: cold_queryset,
+            EstimateColdStorageReference: EstimateColdStorageReference.objects.filter(cold_storage__in=cold_queryset),
+        })
+        return querysets
+    if category_ids:
+        return _catalog_querysets(
+            WorkType.objects.filter(category__in=category_ids),
+            categories=[WorkCategory.objects.filter(pk__in=category_ids).values('pk')],
+        )
+    specs = CATALOG_TABLES if catalog_only else TABLES
+    return {spec.model: spec.model._base_manager.all() for spec in specs}
+
+
+# ---------- выгрузка ----------
+
+class ChunkedWriter:
+    """Поток CSV одной таблицы -> части gzip в tar (по chunk_bytes несжатых данных)"""
+
+    def __init__(self, tar, prefix, chunk_bytes=CHUNK_BYTES):
+        self.tar = tar
+        self.prefix = prefix
+        self.chunk_bytes = chunk_bytes
+        self.chunks = []
+        self._spool = None
+
+    def _open(self):
+        self._spool = tempfile.TemporaryFile()
+        self._gzip = gzip.GzipFile(fileobj=self._spool, mode='wb', compresslevel=6)
+        self._size = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self._spool is None:
+            self._open()
+        self._gzip.write(data)
+        self._size += len(data)
+        if self._size >= self.chunk_bytes:
+            self._flush()
+        return len(data)
+
+    def _flush(self):
+        self._gzip.close()
+        name = f'{self.prefix}/{len(self.chunks):04d}.csv.gz'
+        info = tarfile.TarInfo(name)
+        info.size = self._spool.tell()
+        info.mtime = int(datetime.now().timestamp())
+        self._spool.seek(0)
+        self.tar.addfile(info, self._spool)
+        self._spool.close()
+        self._spool = None
+        self.chunks.append(name)
+
+    def close(self):
+        if self._spool is not None:
+            self._flush()
+
+
+def _copy_out(cursor, spec, queryset, writer):
+    """Строки queryset в writer как CSV с заголовком; возвращает количество строк"""
+    attnames = [field.attname for field in spec.fields]
+    sql, params = queryset.order_by('pk').values_list(*attnames).query.sql_with_params()
+    if connection.vendor == 'postgresql':
+        query = cursor.mogrify(sql, params).decode()
+        cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)', writer)
+        return cursor.rowcount
+
+    csv_writer = csv.writer(writer, lineterminator='\n')
+    csv_writer.writerow(field.column for field in spec.fields)
+    binary = _binary_indexes(spec, [field.column for field in spec.fields])
+    cursor.execute(sql, params)
+    rows = 0
+    while True:
+        batch = cursor.fetchmany(BATCH_SIZE)
+        if not batch:
+            return rows
+        if binary:
+            batch = [_binary_to_text(list(row), binary) for row in batch]
+        csv_writer.writerows(batch)
+        rows += len(batch)
+
+
+def export_archive(fileobj, querysets, scope=None, chunk_bytes=CHUNK_BYTES):
+    """Пишет архив в fileobj; возвращает manifest"""
+    manifest = {
+        'format': ARCHIVE_FORMAT,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'vendor': connection.vendor,
+        'scope': scope or {},
+        'tables': [],
+    }
+    # Уровень изоляции задается только первой командой транзакции; внутри
+    # внешней транзакции снимок определяет она
+    snapshot = connection.vendor == 'postgresql' and not connection.in_atomic_block
+    with tarfile.open(fileobj=fileobj, mode='w') as tar, transaction.atomic():
+        with connection.cursor() as cursor:
+            if snapshot:
+                # Все COPY читают один снимок базы
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+            for index, spec in enumerate(TABLES):
+                queryset = querysets.get(spec.model)
+                if queryset is None:
+                    continue
+                writer = ChunkedWriter(tar, f'{index:02d}-{spec.table}', chunk_bytes)
+                rows = _copy_out(cursor, spec, queryset, writer)
+                writer.close()
+                manifest['tables'].append({
+                    'model': spec.label,
+                    'table': spec.table,
+                    'columns': [field.column for field in spec.fields],
+                    'rows': rows,
+                    'chunks': writer.chunks,
+                })
+        data = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(data)
+        info.mtime = int(datetime.now().timestamp())
+        tar.addfile(info, io.BytesIO(data))
+    return manifest
+
+
+# ---------- загрузка ----------
+
+class ChunkReader(io.RawIOBase):
+    """Части таблицы из tar как один несжатый поток"""
+
+    def __init__(self, tar, names):
+        self._tar = tar
+        self._names = iter(names)
+        self._current = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            if self._current is None:
+                name = next(self._names, None)
+                if name is None:
+                    return 0
+                self._current = gzip.GzipFile(fileobj=self._tar.extractfile(name))
+            count = self._current.readinto(buffer)
+            if count:
+                return count
+            self._current.close()
+            self._current = None
+
+
+def _open_table(tar, entry):
+    return io.BufferedReader(ChunkReader(tar, entry['chunks']))
+
+
+def _read_rows(tar, entry):
+    """Строки CSV таблицы (без заголовка) в виде списков строк"""
+    reader = csv.reader(io.TextIOWrapper(_open_table(tar, entry), encoding='utf-8', newline=''))
+    next(reader, None)
+    return reader
+
+
+def _nullable_columns(spec):
+    return {field.column for field in spec.fields if field.null}
+
+
+def _binary_indexes(spec, columns):
+    binary = {field.column for field in spec.fields if isinstance(field, models.BinaryField)}
+    return [i for i, column in enumerate(columns) if column in binary]
+
+
+def _binary_to_text(row, indexes):
+    for index in indexes:
+        if row[index] is not None:
+            row[index] = '\\x' + bytes(row[index]).hex()
+    return row
+
+
+def _text_to_binary(row, indexes):
+    for index in indexes:
+        if row[index] is not None:
+            row[index] = bytes.fromhex(row[index][2:])
+    return row
+
+
+def _text_not_null_columns(spec):
+    return [
+        field.column for field in spec.fields
+        if not field.null and isinstance(field, (models.CharField, models.TextField))
+    ]
+
+
+def _insert_rows(cursor, spec, columns, rows):
+    """Пакетная вставка строк (списки значений в порядке columns)"""
+    column_list = ', '.join(connection.ops.quote_name(column) for column in columns)
+    if connection.vendor == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(_copy_in_sql(spec, columns, header=False), buffer)
+        return
+    binary = _binary_indexes(spec, columns)
+    if binary:
+        rows = [_text_to_binary(list(row), binary) for row in rows]
+    placeholders = ', '.join(['%s'] * len(columns))
+    cursor.executemany(
+        f'INSERT INTO {connection.ops.quote_name(spec.table)} ({column_list}) VALUES ({placeholders})', rows
+    )
+
+
+def _copy_in_sql(spec, columns, header):
+    column_list = ', '.join(connection.ops.quote_name(column) for column in columns)
+    options = ['FORMAT csv']
+    if header:
+        options.append('HEADER')
+    force_not_null = [column for column in _text_not_null_columns(spec) if column in columns]
+    if force_not_null:
+        # Пустое значение без кавычек (так пишет csv из SQLite) - пустая строка, а не NULL
+        options.append(f"FORCE_NOT_NULL ({', '.join(connection.ops.quote_name(c) for c in force_not_null)})")
+    return f"COPY {connection.ops.quote_name(spec.table)} ({column_list}) FROM STDIN WITH ({', '.join(options)})"
+
+
+def _prepare_row(row, nullable_indexes):
+    for index in nullable_indexes:
+        if row[index] == '':
+            row[index] = None
+    return row
+
+
+def _replace_tables(entries):
+    """
+    Таблицы архива и таблицы ВОР, которых нет в архиве, но которые ссылаются на очищаемые
+    (архив без версий ВОР): их строки ссылались бы на удаленные ВОР
+    """
+    tables = [SPECS[entry['model']] for entry in entries]
+    # Только ссылки на таблицы ВОР: замена одного справочника не очищает ВОР
+    cleared = {spec.model for spec in tables} & {spec.model for spec in ESTIMATE_TABLES}
+    for spec in ESTIMATE_TABLES:
+        if spec not in tables and any(
+            field.is_relation and field.related_model in cleared for field in spec.fields
+        ):
+            tables.append(spec)
+            cleared.add(spec.model)
+    return tables
+
+
+def _load_replace(cursor, tar, entries):
+    """Очистка таблиц архива (и зависимых таблиц ВОР) и загрузка с исходными id"""
+    tables = _replace_tables(entries)
+    if connection.vendor == 'postgresql':
+        # Отложенные проверки FK внешней транзакции блокируют TRUNCATE - выполняются сейчас
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute('TRUNCATE ' + ', '.join(connection.ops.quote_name(spec.table) for spec in tables))
+        # TRUNCATE не вызывает триггеры удаления: клиенты синхронизации начинают заново
+        if any(spec.model in sync.KINDS.values() for spec in tables):
+            sync.mark_all_expired()
+    else:
+        for spec in reversed(tables):
+            cursor.execute(f'DELETE FROM {connection.ops.quote_name(spec.table)}')
+
+    stats = {}
+    for entry in entries:
+        spec = SPECS[entry['model']]
+        columns = entry['columns']
+        if connection.vendor == 'postgresql':
+            cursor.copy_expert(_copy_in_sql(spec, columns, header=True), _open_table(tar, entry))
+            rows = cursor.rowcount
+        else:
+            nullable = [i for i, column in enumerate(columns) if column in _nullable_columns(spec)]
+            rows = 0
+            batch = []
+            for row in _read_rows(tar, entry):
+                batch.append(_prepare_row(row, nullable))
+                if len(batch) >= BATCH_SIZE:
+                    _insert_rows(cursor, spec, columns, batch)
+                    rows += len(batch)
+                    batch = []
+            if batch:
+                _insert_rows(cursor, spec, columns, batch)
+                rows += len(batch)
+        stats[spec.table] = {'inserted': rows, 'matched': 0}
+    return stats
+
+
+class _DocumentRemapper:
+    """Документы снимков строк архива -> id справочника базы (режим merge)"""
+
+    def __init__(self, spec, columns, id_maps):
+        self.data_index = columns.index('data')
+        self.pk_index = columns.index(spec.model._meta.pk.column)
+        self.base_index = columns.index('base_id') if 'base_id' in columns else None
+        # Ключи и значения id_maps справочника - строки CSV, в документе - числа
+        self.id_maps = {
+            model: {int(old): int(new) for old, new in id_maps[model].items()}
+            for model in snapshots.REFERENCES.values() if model in id_maps
+        }
+        # id версии архива -> (исходный, перекодированный документ) для дельты следующей версии
+        self.documents = {}
+
+    def remap(self, row):
+        old_base = row[self.base_index] if self.base_index is not None else None
+        base, remapped_base = self.documents.pop(old_base) if old_base is not None else (None, None)
+        document = snapshots.decode(bytes.fromhex(row[self.data_index][2:]), base)
+        remapped = snapshots.remap(document, self.id_maps)
+        row[self.data_index] = '\\x' + snapshots.encode(remapped, remapped_base).hex()
+        if self.base_index is not None:
+            self.documents[row[self.pk_index]] = document, remapped
+
+
+def _load_merge(cursor, tar, entries):
+    """
+    Справочник - сопоставление по естественному ключу, недостающее добавляется;
+    ВОР - всегда новые строки с новыми id. Внешние ключи переводятся на id базы.
+    """
+    id_maps = {}
+    stats = {}
+    for entry in entries:
+        spec = SPECS[entry['model']]
+        columns = entry['columns']
+        pk_index = columns.index(spec.model._meta.pk.column)
+        nullable = [i for i, column in enumerate(columns) if column in _nullable_columns(spec)]
+        # id_map заполняется по ходу загрузки - по нему переводится и ссылка на себя (base)
+        id_map = id_maps[spec.model] = {}
+        foreign_keys = [
+            (columns.index(field.column), id_maps.get(field.related_model))
+            for field in spec.fields
+            if field.is_relation and field.column in columns
+        ]
+        key_indexes = [columns.index(column) for column in spec.natural_key]
+        documents = _DocumentRemapper(spec, columns, id_maps) if spec.model in DOCUMENT_MODELS else None
+
+        existing = {}
+        if spec.natural_key:
+            for row in spec.model._base_manager.order_by('-pk').values_list('pk', *spec.natural_key).iterator():
+                existing[tuple(str(value) for value in row[1:])] = row[0]
+        next_id = (spec.model._base_manager.aggregate(max_id=models.Max('pk'))['max_id'] or 0) + 1
+
+        inserted = matched = 0
+        batch = []
+        for row in _read_rows(tar, entry):
+            row = _prepare_row(row, nullable)
+            old_pk = row[pk_index]
+            if documents is not None:
+                documents.remap(row)
+            for index, mapping in foreign_keys:
+                if mapping is not None and row[index] is not None:
+                    row[index] = mapping[row[index]]
+            key = tuple(str(row[index]) for index in key_indexes)
+            if spec.natural_key and key in existing:
+                id_map[old_pk] = existing[key]
+                matched += 1
+                continue
+            if spec.model._meta.pk.is_relation:
+                # Холодное хранение: первичный ключ - id ВОР, уже переведенный
+                id_map[old_pk] = row[pk_index]
+            else:
+                id_map[old_pk] = row[pk_index] = next_id
+                next_id += 1
+            if spec.natural_key:
+                existing[key] = row[pk_index]
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                _insert_rows(cursor, spec, columns, batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            _insert_rows(cursor, spec, columns, batch)
+            inserted += len(batch)
+        # Ключи id_map - строки из CSV; внешние ключи дочерних таблиц тоже строки
+        id_maps[spec.model] = {old: str(new) for old, new in id_map.items()}
+        stats[spec.table] = {'inserted': inserted, 'matched': matched}
+    return stats
+
+
+def read_manifest(tar):
+    manifest = json.load(tar.extractfile(MANIFEST_NAME))
+    if manifest.get('format') != ARCHIVE_FORMAT:
+        raise ValueError(f"Неподдерживаемый формат архива: {manifest.get('format')}")
+    for entry in manifest['tables']:
+        spec = SPECS.get(entry['model'])
+        if spec is None:
+            raise ValueError(f"Неизвестная таблица в архиве: {entry['model']}")
+        unknown = set(entry['columns']) - {field.column for field in spec.fields}
+        if unknown:
+            raise ValueError(f"{entry['table']}: колонок нет в текущей схеме: {', '.join(sorted(unknown))}")
+    return manifest
+
+
+def import_archive(fileobj, mode='merge'):
+    """Загружает архив; возвращает {таблица: {'inserted': n, 'matched': m}}"""
+    if mode not in ('merge', 'replace'):
+        raise ValueError(f'Неизвестный режим загрузки: {mode}')
+    with tarfile.open(fileobj=fileobj, mode='r:') as tar:
+        manifest = read_manifest(tar)
+        entries = sorted(manifest['tables'], key=lambda entry: TABLES.index(SPECS[entry['model']]))
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('LOCK TABLE ' + ', '.join(
+                    connection.ops.quote_name(SPECS[entry['model']].table) for entry in entries
+                ) + ' IN SHARE ROW EXCLUSIVE MODE')
+            if mode == 'replace':
+                stats = _load_replace(cursor, tar, entries)
+            else:
+                stats = _load_merge(cursor, tar, entries)
+            models_loaded = [SPECS[entry['model']].model for entry in entries]
+            if any(SPECS[entry['model']].model is EstimateItemResource and 'estimate_id' not in entry['columns']
+                   for entry in entries):
+                # Архив до появления EstimateItemResource.estimate
+                backfill_estimate_ids()
+            for sql in connection.ops.sequence_reset_sql(no_style(), models_loaded):
+                cursor.execute(sql)
+            if any(spec.model in models_loaded for spec in CATALOG_TABLES):
+                transaction.on_commit(bump_catalog_version)
+    return stats
@@ -0,0 +1,81 @@
+"""
+Где используется работа или ресурс: ВОР и разделы с объемами / количествами
+
+Итоги считаются в базе: сначала страница ВОР с суммами (GROUP BY ВОР, сортировка и LIMIT
+в запросе), затем разделы только для ВОР этой страницы. Запросы начинаются с составных
+индексов (work, section_work_type, volume) и (resource, estimate, quantity):
+строки работы / ресурса и их объемы читаются из индекса без обращения к таблице.
+"""
+from django.db.models import Count, F, Sum
+
+from .models import Estimate, EstimateItem, EstimateItemResource
+
+
+# kind -> (модель, поле работы / ресурса, суммируемое поле, путь к ВОР, путь к разделу)
+KINDS = {
+    'work': (EstimateItem, 'work_id', 'volume', 'section_work_type__section__estimate', 'section_work_type__section'),
+    'resource': (EstimateItemResource, 'resource_id', 'quantity', 'estimate',
+                 'estimate_item__section_work_type__section'),
+}
+ORDERINGS = {
+    'quantity': ('total', 'estimate_key'),
+    '-quantity': ('-total', 'estimate_key'),
+    'estimate': ('estimate_key',),
+    '-estimate': ('-estimate_key',),
+}
+
+
+def usage(kind, pk, status=None, ordering='-quantity', limit=100, offset=0):
+    """
+    {'count': ВОР всего, 'results': [{estimate, name, object_name, status, total, rows,
+    sections: [{section, work_category, work_category_name, total, rows}]}]}
+    total - объем работы или количество ресурса, rows - строк ВОР
+    """
+    model, field, value, estimate, section_path = KINDS[kind]
+    estimate_path = f'{estimate}_id'
+    queryset = model.objects.filter(**{field: pk, f'{estimate}__deleted_at__isnull': True})
+    if status:
+        queryset = queryset.filter(**{f'{estimate}__status': status})
+
+    page = list(
+        queryset.values(estimate_key=F(estimate_path))
+        .annotate(total=Sum(value), rows=Count('pk'))
+        .order_by(*ORDERINGS[ordering])[offset:offset + limit]
+        .values_list('estimate_key', 'total', 'rows')
+    )
+    count = queryset.order_by().values(estimate_path).distinct().count() if page or offset else 0
+    estimate_ids = [estimate_id for estimate_id, _, _ in page]
+
+    sections = {}
+    for estimate_id, section_id, category_id, category_name, total, rows in (
+        queryset.filter(**{f'{estimate_path}__in': estimate_ids}).order_by()
+        .values(estimate_path, f'{section_path}_id', f'{section_path}__work_category_id',
+                f'{section_path}__work_category__name')
+        .annotate(total=Sum(value), rows=Count('pk'))
+        .values_list(estimate_path, f'{section_path}_id', f'{section_path}__work_category_id',
+                     f'{section_path}__work_category__name', 'total', 'rows')
+    ):
+        sections.setdefault(estimate_id, []).append({
+            'section': section_id, 'work_category': category_id, 'work_category_name': category_name,
+            'total': total, 'rows': rows,
+        })
+    names = {
+        pk: (name, object_name, estimate_status)
+        for pk, name, object_name, estimate_status in Estimate.objects.filter(pk__in=estimate_ids)
+        .values_list('pk', 'name', 'object_name', 'status')
+    }
+    return {
+        'count': count,
+        'results': [
+            {
+                'estimate': estimate_id,
+                'name': names[estimate_id][0],
+                'object_name': names[estimate_id][1],
+                'status': names[estimate_id][2],
+                'total': total,
+                'rows': rows,
+                'sections': sorted(sections.get(estimate_id, []), key=lambda section: -section['total']),
+            }
+            for estimate_id, total, rows in page
+        ],
+    }
@@ -0,0 +1,192 @@
+"""
+Метрики приложения в текстовом формате Prometheus
+
+Минимальный реестр без внешних зависимостей: счетчики и гистограммы с метками,
+хранятся в памяти процесса и отдаются эндпоинтом /metrics.
+При запуске нескольких процессов (gunicorn workers) каждый процесс
+отдает свои значения - Prometheus нужно опрашивать их по отдельности.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def expose(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type_name}',
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._samples(items))
+        return lines
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self, items):
+        for key, value in items:
+            yield f'{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счетчики по корзинам (не накопительные), сумма, количество]
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Наблюдает длительность блока with в секундах"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self, items):
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'Метрика {metric.name} уже зарегистрирована')
+        self._metrics[metric.name] = metric
+
+    def clear(self):
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def expose(self):
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+# ---------- HTTP ----------
+
+http_request_duration = Histogram(
+    'vor_http_request_duration_seconds',
+    'Время обработки HTTP-запроса по представлению (ViewSet.action)',
+    ['view', 'method', 'status'],
+)
+
+# ---------- Движок ВОР ----------
+
+template_instantiations = Counter(
+    'vor_estimate_template_instantiations',
+    'Создания работ и ресурсов по шаблону типа работ',
+)
+template_items_written = Histogram(
+    'vor_estimate_template_items_written',
+    'Работ записано за одно создание по шаблону',
+    buckets=COUNT_BUCKETS,
+)
+template_resources_written = Histogram(
+    'vor_estimate_template_resources_written',
+    'Ресурсов записано за одно создание по шаблону',
+    buckets=COUNT_BUCKETS,
+)
+template_instantiation_duration = Histogram(
+    'vor_estimate_template_instantiation_duration_seconds',
+    'Время создания работ и ресурсов по шаблону',
+)
+recalculation_duration = Histogram(
+    'vor_estimate_recalculation_duration_seconds',
+    'Время пересчета объемов и количеств по разделу или типу работ в разделе',
+    ['scope'],
+)
+
+# ---------- Кэши ----------
+
+cache_requests = Counter(
+    'vor_cache_requests',
+    'Обращения к кэшам приложения (result = hit | miss)',
+    ['cache', 'result'],
+)
@@ -1,10 +1,18 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db.models import Count, OuterRef, Prefetch
+from django.template.response import TemplateResponse
 from django.utils.html import format_html
 from django.urls import reverse
 from .models import (
     WorkCategory, WorkType, Work, Resource,
     WorkTypeWork, WorkResource
 )
+from .expressions import SubqueryCount
+from .admin_utils import WorkTypeListFilter, AutocompleteListFilter, AutocompleteFilterMixin
+from .search import RankedSearchAdminMixin
 
 
 # ==================== INLINE КЛАССЫ ====================
@@ -29,11 +37,22 @@ class WorkTypeWorkInline(admin.StackedInline):
     verbose_name_plural = "Работы в типе работ"
     autocomplete_fields = ['work']
     
+    def get_queryset(self, request):
+        """Количество ресурсов - подзапросом, без запроса на каждую строку"""
+        qs = super().get_queryset(request)
+        return qs.select_related('work_type', 'work').annotate(
+            _resources_count=SubqueryCount(
+                WorkResource.objects.filter(
+                    work_type=OuterRef('work_type'), work=OuterRef('work')
+                ).order_by().values('pk')
+            )
+        )
+    
     def view_resources_link(self, obj):
         """Ссылка на ресурсы для этой работы"""
         if obj.pk:
             url = reverse('admin:reference_workresource_changelist')
-            count = WorkResource.objects.filter(work_type=obj.work_type, work=obj.work).count()
+            count = obj._resources_count
             if count > 0:
                 return format_html(
                     '<a href="{}?work_type__id__exact={}&work__id__exact={}" '
@@ -65,19 +84,23 @@ class WorkCategoryAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        """Количество типов работ - агрегатом в запросе списка"""
+        qs = super().get_queryset(request)
+        return qs.annotate(_work_types_count=Count('work_types'))
+    
     def work_types_count(self, obj):
         """Количество типов работ в этом виде"""
-        count = obj.work_types.count()
         return format_html(
             '<span style="font-weight: bold; color: #0066cc;">{}</span>',
-            count
+            obj._work_types_count
         )
     work_types_count.short_description = "Типов работ"
+    work_types_count.admin_order_field = '_work_types_count'
     
     def view_work_types_link(self, obj):
         """Ссылка на типы работ этого вида"""
-        count = obj.work_types.count()
-        if count > 0:
+        if obj._work_types_count > 0:
             url = reverse('admin:reference_worktype_changelist')
             return format_html(
                 '<a href="{}?category__id__exact={}" style="color: #0066cc;">Просмотреть типы работ</a>',
@@ -90,7 +113,7 @@ class WorkCategoryAdmin(admin.ModelAdmin):
 # ==================== АДМИН-ПАНЕЛЬ ДЛЯ ТИПОВ РАБОТ ====================
 
 @admin.register(WorkType)
-class WorkTypeAdmin(admin.ModelAdmin):
+class WorkTypeAdmin(RankedSearchAdminMixin, admin.ModelAdmin):
     """Админ-панель для типов работ с inline-редактированием работ и ресурсов"""
     list_display = ['id', 'category', 'name', 'works_count', 'resources_count', 'full_path']
     list_filter = ['category']
@@ -107,24 +130,39 @@ class WorkTypeAdmin(admin.ModelAdmin):
     )
     
     inlines = [WorkTypeWorkInline]
+    list_select_related = ['category']
+    
+    def get_queryset(self, request):
+        """Счетчики работ и ресурсов - подзапросами в запросе списка"""
+        qs = super().get_queryset(request)
+        return qs.annotate(
+            _works_count=SubqueryCount(
+                WorkTypeWork.objects.filter(work_type=OuterRef('pk')).order_by().values('pk')
+            ),
+            _resources_count=SubqueryCount(
+                WorkResource.objects.filter(
+                    work_type=OuterRef('pk')
+                ).order_by().values('resource').distinct()
+            ),
+        )
     
     def works_count(self, obj):
         """Количество работ в типе работ"""
-        count = obj.work_type_works.count()
         return format_html(
             '<span style="font-weight: bold; color: #28a745;">{}</span>',
-            count
+            obj._works_count
         )
     works_count.short_description = "Работ"
+    works_count.admin_order_field = '_works_count'
     
     def resources_count(self, obj):
         """Количество уникальных ресурсов в типе работ"""
-        count = obj.work_resources.values('resource').distinct().count()
         return format_html(
             '<span style="font-weight: bold; color: #ffc107;">{}</span>',
-            count
+            obj._resources_count
         )
     resources_count.short_description = "Ресурсов"
+    resources_count.admin_order_field = '_resources_count'
     
     def full_path(self, obj):
         """Полный путь: Вид работ → Тип работ"""
@@ -138,7 +176,7 @@ class WorkTypeAdmin(admin.ModelAdmin):
 # ==================== АДМИН-ПАНЕЛЬ ДЛЯ РАБОТ ====================
 
 @admin.register(Work)
-class WorkAdmin(admin.ModelAdmin):
+class WorkAdmin(RankedSearchAdminMixin, admin.ModelAdmin):
     """Админ-панель для работ"""
     list_display = ['id', 'name', 'unit', 'work_types_count', 'usage_info']
     search_fields = ['name', 'unit']
@@ -153,9 +191,26 @@ class WorkAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        """Счетчик - подзапросом, данные для usage_info - одним prefetch на страницу"""
+        qs = super().get_queryset(request)
+        return qs.annotate(
+            _work_types_count=SubqueryCount(
+                WorkTypeWork.objects.filter(
+                    work=OuterRef('pk')
+                ).order_by().values('work_type').distinct()
+            )
+        ).prefetch_related(
+            Prefetch(
+                'work_type_works',
+                queryset=WorkTypeWork.objects.select_related('work_type', 'work_type__category'),
+                to_attr='usage_work_type_works'
+            )
+        )
+    
     def work_types_count(self, obj):
         """Количество типов работ, использующих эту работу"""
-        count = obj.work_type_works.values('work_type').distinct().count()
+        count = obj._work_types_count
         if count > 0:
             url = reverse('admin:reference_worktype_changelist')
             return format_html(
@@ -164,11 +219,12 @@ class WorkAdmin(admin.ModelAdmin):
             )
         return format_html('<span style="color: #999;">0</span>')
     work_types_count.short_description = "Используется в типах работ"
+    work_types_count.admin_order_field = '_work_types_count'
     
     def usage_info(self, obj):
         """Информация об использовании работы"""
-        work_type_works = obj.work_type_works.select_related('work_type', 'work_type__category')
-        if work_type_works.exists():
+        work_type_works = obj.usage_work_type_works
+        if work_type_works:
             categories = {}
             for wtw in work_type_works[:5]:  # Показываем первые 5
                 cat_name = wtw.work_type.category.name
@@ -190,14 +246,33 @@ class WorkAdmin(admin.ModelAdmin):
 
 # ==================== АДМИН-ПАНЕЛЬ ДЛЯ РЕСУРСОВ ====================
 
+class ResourceSubstitutionForm(forms.Form):
+    """Параметры замены ресурса (действие «Заменить ресурс»)"""
+    target = forms.ModelChoiceField(queryset=Resource.objects.all(), label="Заменить на")
+    coefficient = forms.FloatField(
+        initial=1.0, min_value=0, label="Коэффициент",
+        help_text="Количество нового ресурса = количество заменяемого x коэффициент"
+    )
+    templates = forms.BooleanField(initial=True, required=False, label="В шаблонах (нормы расхода)")
+    estimates = forms.BooleanField(initial=True, required=False, label="В ВОР")
+
+    def __init__(self, *args, admin_site=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        target = self.fields['target']
+        target.widget = AutocompleteSelect(WorkResource._meta.get_field('resource'), admin_site)
+        target.widget.choices = target.choices
+
+
+
 @admin.register(Resource)
-class ResourceAdmin(admin.ModelAdmin):
+class ResourceAdmin(RankedSearchAdminMixin, admin.ModelAdmin):
     """Админ-панель для ресурсов"""
     list_display = ['id', 'name', 'unit', 'work_types_count', 'usage_info']
     search_fields = ['name', 'unit']
     list_display_links = ['name']
     ordering = ['name']
     list_filter = ['unit']
+    actions = ['substitute_resource']
     
     fieldsets = (
         ('Основная информация', {
@@ -206,9 +281,26 @@ class ResourceAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        """Счетчик - подзапросом, данные для usage_info - одним prefetch на страницу"""
+        qs = super().get_queryset(request)
+        return qs.annotate(
+            _work_types_count=SubqueryCount(
+                WorkResource.objects.filter(
+                    resource=OuterRef('pk')
+                ).order_by().values('work_type').distinct()
+            )
+        ).prefetch_related(
+            Prefetch(
+                'work_resources',
+                queryset=WorkResource.objects.select_related('work_type', 'work_type__category', 'work'),
+                to_attr='usage_work_resources'
+            )
+        )
+    
     def work_types_count(self, obj):
         """Количество типов работ, использующих этот ресурс"""
-        count = obj.work_resources.values('work_type').distinct().count()
+        count = obj._work_types_count
         if count > 0:
             url = reverse('admin:reference_worktype_changelist')
             return format_html(
@@ -217,11 +309,12 @@ class ResourceAdmin(admin.ModelAdmin):
             )
         return format_html('<span style="color: #999;">0</span>')
     work_types_count.short_description = "Используется в типах работ"
+    work_types_count.admin_order_field = '_work_types_count'
     
     def usage_info(self, obj):
         """Информация об использовании ресурса"""
-        work_resources = obj.work_resources.select_related('work_type', 'work_type__category', 'work')
-        if work_resources.exists():
+        work_resources = obj.usage_work_resources
+        if work_resources:
             info = []
             for wr in work_resources[:5]:  # Показываем первые 5
                 info.append(
@@ -233,6 +326,43 @@ class ResourceAdmin(admin.ModelAdmin):
         return format_html('<span style="color: #999;">Не используется</span>')
     usage_info.short_description = "Где используется"
 
+    @admin.action(description="Заменить ресурс в шаблонах и ВОР", permissions=['change'])
+    def substitute_resource(self, request, queryset):
+        """Промежуточная страница с выбором нового ресурса, затем замена массовыми UPDATE"""
+        from apps.estimates.substitution import SubstitutionError, substitute_resource
+
+        form = ResourceSubstitutionForm(
+            request.POST if 'apply' in request.POST else None, admin_site=self.admin_site
+        )
+        if 'apply' in request.POST and form.is_valid():
+            target = form.cleaned_data['target']
+            estimates = set()
+            try:
+                for source in queryset.exclude(pk=target.pk):
+                    result = substitute_resource(
+                        source, target,
+                        coefficient=form.cleaned_data['coefficient'],
+                        templates=form.cleaned_data['templates'],
+                        estimates=form.cleaned_data['estimates'],
+                    )
+                    estimates.update(result['estimates'])
+            except SubstitutionError as e:
+                self.message_user(request, str(e), messages.ERROR)
+                return None
+            self.message_user(
+                request, f"Ресурсы заменены на «{target}», затронуто ВОР: {len(estimates)}", messages.SUCCESS
+            )
+            return None
+        return TemplateResponse(request, 'admin/reference/resource/substitute.html', {
+            **self.admin_site.each_context(request),
+            'title': "Замена ресурса",
+            'opts': self.model._meta,
+            'resources': queryset,
+            'form': form,
+            'media': self.media + form.media,
+            'action_checkbox_name': ACTION_CHECKBOX_NAME,
+        })
+
 
 # ==================== АДМИН-ПАНЕЛЬ ДЛЯ РАБОТ В ТИПАХ РАБОТ ====================
 
@@ -240,11 +370,12 @@ class ResourceAdmin(admin.ModelAdmin):
 class WorkTypeWorkAdmin(admin.ModelAdmin):
     """Админ-панель для связи работ с типами работ"""
     list_display = ['id', 'work_type_link', 'work_link', 'order_index', 'work_volume_display', 'resources_count']
-    list_filter = ['work_type__category', 'work_type']
+    list_filter = ['work_type__category', ('work_type', WorkTypeListFilter)]
     search_fields = ['work_type__name', 'work_type__category__name', 'work__name']
     list_display_links = ['work_link']
     ordering = ['work_type', 'order_index']
     autocomplete_fields = ['work_type', 'work']
+    list_select_related = ['work_type__category', 'work']
     
     fieldsets = (
         ('Связь', {
@@ -284,9 +415,20 @@ class WorkTypeWorkAdmin(admin.ModelAdmin):
         )
     work_volume_display.short_description = "Объем на единицу"
     
+    def get_queryset(self, request):
+        """Количество ресурсов - подзапросом в запросе списка"""
+        qs = super().get_queryset(request)
+        return qs.annotate(
+            _resources_count=SubqueryCount(
+                WorkResource.objects.filter(
+                    work_type=OuterRef('work_type'), work=OuterRef('work')
+                ).order_by().values('pk')
+            )
+        )
+    
     def resources_count(self, obj):
         """Количество ресурсов для этой работы в этом типе работ"""
-        count = obj.work_type.work_resources.filter(work=obj.work).count()
+        count = obj._resources_count
         if count > 0:
             url = reverse('admin:reference_workresource_changelist')
             return format_html(
@@ -300,14 +442,20 @@ class WorkTypeWorkAdmin(admin.ModelAdmin):
 # ==================== АДМИН-ПАНЕЛЬ ДЛЯ РЕСУРСОВ РАБОТ ====================
 
 @admin.register(WorkResource)
-class WorkResourceAdmin(admin.ModelAdmin):
+class WorkResourceAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
     """Админ-панель для связи ресурсов с работами в типах работ"""
     list_display = ['id', 'work_type_link', 'work_link', 'resource_link', 'quantity_display']
-    list_filter = ['work_type__category', 'work_type', 'work', 'resource']
+    list_filter = [
+        'work_type__category',
+        ('work_type', WorkTypeListFilter),
+        ('work', AutocompleteListFilter),
+        ('resource', AutocompleteListFilter),
+    ]
     search_fields = ['work_type__name', 'work__name', 'resource__name']
     list_display_links = ['resource_link']
     ordering = ['work_type', 'work', 'resource']
     autocomplete_fields = ['work_type', 'work', 'resource']
+    list_select_related = ['work_type__category', 'work', 'resource']
     
     fieldsets = (
         ('Связь', {
@@ -0,0 +1,121 @@
+"""
+Вспомогательные классы админки для больших таблиц
+
+- WorkTypeListFilter - фильтр по типу работ без запроса на каждый вариант
+- AutocompleteListFilter - фильтр по FK через autocomplete (select2) вместо
+  списка всех строк связанной таблицы
+- EstimatedCountPaginator - оценка количества строк планировщиком PostgreSQL
+  вместо точного COUNT(*) для больших выборок
+"""
+import json
+
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+from .models import WorkType
+
+
+class WorkTypeListFilter(admin.RelatedFieldListFilter):
+    """Фильтр по типу работ: названия с видом работ одним запросом"""
+
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin) or WorkType._meta.ordering
+        work_types = WorkType.objects.select_related('category').order_by(*ordering)
+        return [(work_type.pk, str(work_type)) for work_type in work_types]
+
+
+class AutocompleteListFilter(admin.FieldListFilter):
+    """
+    Фильтр по внешнему ключу с выбором значения через autocomplete админки
+    Варианты подгружаются по мере ввода, страница списка не рендерит всю связанную таблицу.
+    У ModelAdmin связанной модели должны быть search_fields,
+    а сама админка должна подключать AutocompleteFilterMixin (статика select2).
+    """
+    template = 'admin/autocomplete_list_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        value = params.get(self.lookup_kwarg)
+        if isinstance(value, list):
+            value = value[-1] if value else None
+        self.value = value
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.admin_site = model_admin.admin_site
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def get_facet_counts(self, pk_attname, filtered_qs):
+        return {}
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value is None,
+            'query_string': changelist.get_query_string(remove=[self.lookup_kwarg]),
+            'display': 'Все',
+        }
+
+    def widget_html(self):
+        remote_model = self.field.remote_field.model
+        form_field = forms.ModelChoiceField(
+            queryset=remote_model._default_manager.all(),
+            widget=AutocompleteSelect(self.field, self.admin_site),
+            required=False,
+        )
+        return form_field.widget.render(
+            self.lookup_kwarg,
+            self.value,
+            attrs={'id': f'filter_{self.lookup_kwarg}', 'style': 'width: 100%'}
+        )
+
+
+class AutocompleteFilterMixin:
+    """Подключает статику select2 для AutocompleteListFilter на странице списка"""
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(None, self.admin_site).media + forms.Media(
+            js=['admin/js/autocomplete_list_filter.js']
+        )
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор с оценкой количества строк на PostgreSQL
+    Без фильтров берется pg_class.reltuples, с фильтрами - оценка строк из EXPLAIN.
+    Если оценка меньше threshold (или база не PostgreSQL) - обычный COUNT(*).
+    """
+    threshold = 100_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet) or connections[queryset.db].vendor != 'postgresql':
+            return super().count
+        estimate = self.estimate_count(queryset)
+        if estimate is None or estimate < self.threshold:
+            return super().count
+        return estimate
+
+    @staticmethod
+    def estimate_count(queryset):
+        with connections[queryset.db].cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+                # reltuples = -1, пока таблица ни разу не анализировалась
+                return row[0] if row and row[0] >= 0 else None
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
 from django.utils.translation import gettext_lazy as _
 
 
@@ -6,3 +7,12 @@ class ReferenceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.reference'
     verbose_name = _('📚 Справочники')
+
+    def ready(self):
+        from .catalog import bump_catalog_version
+
+        # Любое изменение справочника меняет его версию (индекс автодополнения и т.п.)
+        for model_name in ('WorkCategory', 'WorkType', 'Work', 'Resource', 'WorkTypeWork', 'WorkResource'):
+            model = self.get_model(model_name)
+            post_save.connect(bump_catalog_version, sender=model, dispatch_uid=f'catalog_version_save_{model_name}')
+            post_delete.connect(bump_catalog_version, sender=model, dispatch_uid=f'catalog_version_delete_{model_name}')
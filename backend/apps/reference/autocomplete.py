@@ -0,0 +1,130 @@
+"""
+Индекс автодополнения по справочникам
+
+Индекс строится в памяти процесса (отсортированные массивы + bisect) и
+перестраивается лениво, когда меняется версия справочника (см. catalog.py).
+Запросы к индексу не обращаются к базе данных.
+"""
+import re
+import threading
+from bisect import bisect_left
+
+from apps import metrics
+
+from .catalog import get_catalog_version
+from .models import WorkCategory, WorkType, Work, Resource
+
+
+NON_WORD_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def normalize(text):
+    """Нормализация названия: нижний регистр, ё → е, только буквы и цифры"""
+    return NON_WORD_RE.sub(' ', text.lower().replace('ё', 'е')).strip()
+
+
+def _work_rows():
+    for pk, name, unit in Work.objects.order_by().values_list('id', 'name', 'unit'):
+        yield name, {'id': pk, 'name': name, 'unit': unit}
+
+
+def _resource_rows():
+    for pk, name, unit in Resource.objects.order_by().values_list('id', 'name', 'unit'):
+        yield name, {'id': pk, 'name': name, 'unit': unit}
+
+
+def _work_type_rows():
+    rows = WorkType.objects.order_by().values_list('id', 'name', 'category_id', 'category__name')
+    for pk, name, category_id, category_name in rows:
+        yield name, {
+            'id': pk, 'name': name,
+            'category': category_id, 'category_name': category_name
+        }
+
+
+def _work_category_rows():
+    for pk, name in WorkCategory.objects.order_by().values_list('id', 'name'):
+        yield name, {'id': pk, 'name': name}
+
+
+# Виды автодополнения: kind -> функция, возвращающая (название, результат)
+KINDS = {
+    'work': _work_rows,
+    'resource': _resource_rows,
+    'work_type': _work_type_rows,
+    'work_category': _work_category_rows,
+}
+
+
+class PrefixIndex:
+    """
+    Префиксный индекс по нормализованным названиям.
+    Сначала ищутся совпадения с началом названия, затем - с началом любого
+    следующего слова ("пленк" найдет "Устройство ПЭ пленки").
+    """
+
+    def __init__(self, rows):
+        self.items = []
+        names = []
+        words = []
+        for name, item in rows:
+            position = len(self.items)
+            self.items.append(item)
+            tokens = normalize(name).split()
+            names.append((' '.join(tokens), position))
+            for i in range(1, len(tokens)):
+                words.append((' '.join(tokens[i:]), position))
+        names.sort()
+        words.sort()
+        self._name_keys = [key for key, _ in names]
+        self._name_positions = [position for _, position in names]
+        self._word_keys = [key for key, _ in words]
+        self._word_positions = [position for _, position in words]
+
+    def __len__(self):
+        return len(self.items)
+
+    def search(self, query, limit=20):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        found = []
+        seen = set()
+        for keys, positions in (
+            (self._name_keys, self._name_positions),
+            (self._word_keys, self._word_positions),
+        ):
+            i = bisect_left(keys, prefix)
+            while i < len(keys) and len(found) < limit and keys[i].startswith(prefix):
+                position = positions[i]
+                if position not in seen:
+                    seen.add(position)
+                    found.append(self.items[position])
+                i += 1
+        return found
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_index(kind):
+    """Индекс для вида kind; перестраивается, если справочник изменился"""
+    version = get_catalog_version()
+    entry = _indexes.get(kind)
+    if entry is not None and entry[0] == version:
+        metrics.cache_requests.inc(cache=f'autocomplete_{kind}', result='hit')
+        return entry[1]
+    with _lock:
+        entry = _indexes.get(kind)
+        if entry is None or entry[0] != version:
+            metrics.cache_requests.inc(cache=f'autocomplete_{kind}', result='miss')
+            entry = (version, PrefixIndex(KINDS[kind]()))
+            _indexes[kind] = entry
+        else:
+            metrics.cache_requests.inc(cache=f'autocomplete_{kind}', result='hit')
+    return entry[1]
+
+
+def autocomplete(kind, query, limit=20):
+    return get_index(kind).search(query, limit)
@@ -0,0 +1,35 @@
+"""
+Версия справочника
+
+Счетчик хранится в кэше Django и увеличивается при любом изменении справочников.
+Процессы сравнивают его со своей версией, чтобы понять, что локальные структуры
+(например, индекс автодополнения) устарели. Для нескольких процессов нужен
+общий бэкенд кэша (Redis/Memcached) - LocMemCache виден только своему процессу.
+"""
+import time
+
+from django.core.cache import cache
+
+
+CATALOG_VERSION_KEY = 'reference:catalog_version'
+
+
+def get_catalog_version():
+    """Текущая версия справочника"""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version(**kwargs):
+    """
+    Отмечает изменение справочника.
+    Подключен к post_save/post_delete моделей справочника; массовые операции
+    (bulk_create, update) сигналы не вызывают и должны вызывать его явно.
+    """
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns(), None)
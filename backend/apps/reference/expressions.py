@@ -0,0 +1,10 @@
+from django.db.models import IntegerField, Subquery
+
+
+class SubqueryCount(Subquery):
+    """
+    Количество строк коррелированного подзапроса одним выражением
+    Пример: SubqueryCount(WorkResource.objects.filter(work=OuterRef('pk')).values('resource').distinct())
+    """
+    template = '(SELECT COUNT(*) FROM (%(subquery)s) _count)'
+    output_field = IntegerField()
@@ -0,0 +1,271 @@
+"""
+Массовая загрузка справочника и норм расхода (CSV / XLSX / JSON)
+
+Формат - плоские строки, по строке на норму расхода ресурса:
+  category, work_type, work, work_unit, order_index, work_volume_per_unit,
+  resource, resource_unit, quantity_per_unit
+Строка без resource задает только работу в типе работ. Пустые order_index и
+work_volume_per_unit у работы, которая уже есть в типе работ, оставляют сохраненные
+значения; у новой - порядок появления работы в типе работ в файле и 1.
+
+Проверки выполняются сразу для всех строк (отрицательные и нечисловые значения -
+массивами NumPy), существующие записи читаются одним запросом на таблицу.
+Виды работ, типы работ, работы и ресурсы сопоставляются по названию (и единице
+измерения), недостающие создаются bulk_create; нормы (WorkTypeWork, WorkResource)
+записываются bulk_create(update_conflicts=True) по unique_together, неизмененные
+строки не пишутся.
+"""
+import csv
+import io
+import json
+import zipfile
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+
+from .catalog import bump_catalog_version
+from .models import WorkCategory, WorkType, Work, Resource, WorkTypeWork, WorkResource
+
+
+BATCH_SIZE = 1000
+COLUMNS = [
+    'category', 'work_type', 'work', 'work_unit', 'order_index', 'work_volume_per_unit',
+    'resource', 'resource_unit', 'quantity_per_unit',
+]
+REQUIRED = ['category', 'work_type', 'work', 'work_unit']
+FORMATS = ['csv', 'xlsx', 'json']
+
+
+class CatalogImportError(ValueError):
+    """Ошибки в загружаемых строках; errors - список сообщений с номерами строк"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        message = '; '.join(errors[:20])
+        if len(errors) > 20:
+            message += f' ... (всего ошибок: {len(errors)})'
+        super().__init__(message)
+
+
+# ---------- чтение файлов ----------
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _read_records(fileobj, file_format):
+    if file_format == 'csv':
+        reader = csv.DictReader(io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline=''))
+        return list(reader)
+    if file_format == 'xlsx':
+        from openpyxl import load_workbook
+
+        sheet = load_workbook(fileobj, read_only=True, data_only=True).worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = [_text(value) for value in next(rows, [])]
+        return [dict(zip(header, row)) for row in rows if any(value is not None for value in row)]
+    data = json.load(fileobj)
+    return data.get('rows', []) if isinstance(data, dict) else data
+
+
+def read_rows(fileobj, file_format):
+    """Строки файла как словари по COLUMNS (значения - строки)"""
+    if file_format not in FORMATS:
+        raise CatalogImportError([f'Неизвестный формат: {file_format}'])
+    try:
+        records = _read_records(fileobj, file_format)
+    # UnicodeDecodeError и JSONDecodeError - подклассы ValueError; KeyError - XLSX без нужных частей
+    except (ValueError, KeyError, csv.Error, zipfile.BadZipFile) as e:
+        raise CatalogImportError([f'Файл {file_format.upper()} не читается: {e}'])
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise CatalogImportError(['JSON: ожидается список объектов или {"rows": [...]}'])
+    return [{column: _text(record.get(column)) for column in COLUMNS} for record in records]
+
+
+# ---------- проверка ----------
+
+def _numbers(rows, column, default, errors, required=None):
+    """Столбец как массив float; пустые - default (или ошибка, если required(row))"""
+    values = np.full(len(rows), np.nan)
+    given = np.zeros(len(rows), dtype=bool)
+    for i, row in enumerate(rows):
+        raw = row[column].replace(',', '.')
+        if not raw:
+            if required is not None and required(row):
+                errors.append(f'Строка {i + 2}: не заполнено {column}')
+            elif default is not None:
+                values[i] = default
+            continue
+        try:
+            values[i] = float(raw)
+            given[i] = True
+        except ValueError:
+            errors.append(f'Строка {i + 2}: {column} - ожидается число')
+    for i in np.flatnonzero(given & ~np.isfinite(values)):
+        errors.append(f'Строка {i + 2}: {column} - ожидается число')
+    for i in np.flatnonzero(given & (values < 0)):
+        errors.append(f'Строка {i + 2}: {column} не может быть отрицательным')
+    return values
+
+
+def validate(rows):
+    """(объемы, порядок, расходы) массивами; ошибки всех строк - CatalogImportError"""
+    errors = []
+    for column in REQUIRED:
+        for i in np.flatnonzero(np.array([not row[column] for row in rows], dtype=bool)):
+            errors.append(f'Строка {i + 2}: не заполнено {column}')
+    for column, max_length in [('category', 255), ('work_type', 255), ('work', 255), ('work_unit', 50),
+                               ('resource', 255), ('resource_unit', 50)]:
+        lengths = np.array([len(row[column]) for row in rows], dtype=np.int64)
+        for i in np.flatnonzero(lengths > max_length):
+            errors.append(f'Строка {i + 2}: {column} длиннее {max_length} символов')
+    for i, row in enumerate(rows):
+        if row['resource'] and not row['resource_unit']:
+            errors.append(f'Строка {i + 2}: не заполнено resource_unit')
+
+    volumes = _numbers(rows, 'work_volume_per_unit', None, errors)
+    orders = _numbers(rows, 'order_index', None, errors)
+    quantities = _numbers(rows, 'quantity_per_unit', None, errors, required=lambda row: row['resource'])
+    bad_orders = np.flatnonzero(~np.isnan(orders) & (orders != np.floor(orders)))
+    errors.extend(f'Строка {i + 2}: order_index - ожидается целое число' for i in bad_orders)
+    if errors:
+        raise CatalogImportError(errors)
+    return volumes, orders, quantities
+
+
+# ---------- запись ----------
+
+def _ensure(model, keys, key_fields, make, stats):
+    """
+    id записей по естественным ключам: существующие - одним запросом,
+    недостающие создаются bulk_create
+    """
+    keys = list(dict.fromkeys(keys))
+    filters = {f'{key_fields[0]}__in': {key[0] for key in keys}}
+    existing = {}
+    for pk, *key in model.objects.filter(**filters).order_by('-pk').values_list('pk', *key_fields):
+        existing[tuple(key)] = pk  # при дублях в базе - запись с меньшим id
+    missing = [key for key in keys if key not in existing]
+    created = model.objects.bulk_create([make(*key) for key in missing], batch_size=BATCH_SIZE)
+    existing.update({key: obj.pk for key, obj in zip(missing, created)})
+    stats[model.__name__] = {'inserted': len(missing), 'updated': 0, 'unchanged': len(keys) - len(missing)}
+    return existing
+
+
+def _fill_templates(template_works, positions):
+    """
+    Пустые order_index / work_volume_per_unit (None): у существующей работы типа работ -
+    сохраненные значения, у новой - позиция в файле и 1
+    """
+    stored = {
+        (work_type_id, work_id): (order_index, volume_per_unit)
+        for work_type_id, work_id, order_index, volume_per_unit in WorkTypeWork.objects.filter(
+            work_type_id__in={key[0] for key in template_works}
+        ).order_by().values_list('work_type_id', 'work_id', 'order_index', 'work_volume_per_unit')
+    }
+    for key, (order_index, volume_per_unit) in template_works.items():
+        stored_order, stored_volume = stored.get(key, (positions[key], 1.0))
+        template_works[key] = (
+            stored_order if order_index is None else order_index,
+            stored_volume if volume_per_unit is None else volume_per_unit,
+        )
+
+
+def _upsert(model, rows, unique_fields, update_fields, stats):
+    """
+    Нормы по unique_together: одно чтение существующих значений, запись только
+    новых и измененных строк через bulk_create(update_conflicts=True)
+    rows - {ключ unique_fields: значения update_fields}
+    """
+    work_type_ids = {key[0] for key in rows}
+    existing = {
+        tuple(values[:len(unique_fields)]): tuple(values[len(unique_fields):])
+        for values in model.objects.filter(work_type_id__in=work_type_ids).order_by()
+        .values_list(*[f'{field}_id' for field in unique_fields], *update_fields)
+    }
+    inserted = [key for key in rows if key not in existing]
+    updated = [key for key in rows if key in existing and existing[key] != rows[key]]
+    model.objects.bulk_create(
+        [
+            model(**{f'{field}_id': value for field, value in zip(unique_fields, key)},
+                  **dict(zip(update_fields, rows[key])))
+            for key in inserted + updated
+        ],
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=update_fields,
+    )
+    stats[model.__name__] = {
+        'inserted': len(inserted), 'updated': len(updated), 'unchanged': len(rows) - len(inserted) - len(updated),
+    }
+
+
+@transaction.atomic
+def import_catalog(rows, dry_run=False):
+    """
+    Загружает строки справочника (см. read_rows); возвращает
+    {модель: {'inserted', 'updated', 'unchanged'}}. dry_run - проверить и посчитать без записи.
+    """
+    volumes, orders, quantities = validate(rows)
+    stats = {}
+
+    categories = _ensure(
+        WorkCategory, [(row['category'],) for row in rows], ['name'],
+        lambda name: WorkCategory(name=name), stats,
+    )
+    work_types = _ensure(
+        WorkType, [(categories[(row['category'],)], row['work_type']) for row in rows], ['category_id', 'name'],
+        lambda category_id, name: WorkType(category_id=category_id, name=name), stats,
+    )
+    works = _ensure(
+        Work, [(row['work'], row['work_unit']) for row in rows], ['name', 'unit'],
+        lambda name, unit: Work(name=name, unit=unit), stats,
+    )
+    resources = _ensure(
+        Resource, [(row['resource'], row['resource_unit']) for row in rows if row['resource']], ['name', 'unit'],
+        lambda name, unit: Resource(name=name, unit=unit), stats,
+    )
+
+    errors = []
+    template_works = {}
+    counters = defaultdict(int)
+    positions = {}
+    norms = {}
+    for i, row in enumerate(rows):
+        work_type_id = work_types[(categories[(row['category'],)], row['work_type'])]
+        key = (work_type_id, works[(row['work'], row['work_unit'])])
+        volume_per_unit = None if np.isnan(volumes[i]) else float(volumes[i])
+        if key not in template_works:
+            counters[work_type_id] += 1
+            positions[key] = counters[work_type_id]
+            template_works[key] = (None if np.isnan(orders[i]) else int(orders[i]), volume_per_unit)
+        elif volume_per_unit is not None:
+            if template_works[key][1] is None:
+                template_works[key] = (template_works[key][0], volume_per_unit)
+            elif template_works[key][1] != volume_per_unit:
+                errors.append(
+                    f"Строка {i + 2}: другой work_volume_per_unit для работы «{row['work']}» в этом типе работ"
+                )
+        if row['resource']:
+            norm_key = (*key, resources[(row['resource'], row['resource_unit'])])
+            if norm_key in norms and norms[norm_key] != (quantities[i],):
+                errors.append(f"Строка {i + 2}: повторная норма ресурса «{row['resource']}» с другим расходом")
+            norms[norm_key] = (float(quantities[i]),)
+    if errors:
+        raise CatalogImportError(errors)
+
+    _fill_templates(template_works, positions)
+    _upsert(WorkTypeWork, template_works, ['work_type', 'work'], ['order_index', 'work_volume_per_unit'], stats)
+    _upsert(WorkResource, norms, ['work_type', 'work', 'resource'], ['quantity_per_unit'], stats)
+
+    if dry_run:
+        transaction.set_rollback(True)
+    elif any(counts['inserted'] or counts['updated'] for counts in stats.values()):
+        transaction.on_commit(bump_catalog_version)
+    return stats
@@ -0,0 +1,41 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.reference.importer import FORMATS, CatalogImportError, import_catalog, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает справочник и нормы расхода из CSV/XLSX/JSON (строка на норму ресурса): '
+        'недостающие записи создаются, нормы обновляются массово'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='Файл справочника')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='Формат (по умолчанию - по расширению файла)')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить и посчитать изменения')
+
+    def handle(self, *args, **options):
+        path = Path(options['file'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError(f"Укажите --format: {', '.join(FORMATS)}")
+        try:
+            with path.open('rb') as f:
+                stats = import_catalog(read_rows(f, file_format), dry_run=options['dry_run'])
+        except CatalogImportError as e:
+            for error in e.errors:
+                self.stderr.write(error)
+            raise CommandError(f'Ошибок в файле: {len(e.errors)}')
+
+        for model_name, counts in stats.items():
+            self.stdout.write(
+                f"{model_name:14} добавлено {counts['inserted']:>7}  обновлено {counts['updated']:>7}  "
+                f"без изменений {counts['unchanged']:>7}"
+            )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Проверка без записи (--dry-run)'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Справочник загружен'))
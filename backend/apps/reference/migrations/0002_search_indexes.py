@@ -0,0 +1,67 @@
+from django.db import migrations
+
+
+# Таблицы справочников с поисковыми индексами по полю name
+SEARCH_TABLES = ['reference_work', 'reference_resource', 'reference_worktype']
+
+
+def create_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table in SEARCH_TABLES:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {table}_name_tsv_idx ON {table} '
+                f"USING gin (to_tsvector('russian'::regconfig, COALESCE(name, '')))"
+            )
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {table}_name_trgm_idx ON {table} '
+                f'USING gin (name gin_trgm_ops)'
+            )
+    elif connection.vendor == 'sqlite':
+        for table in SEARCH_TABLES:
+            fts = f'{table}_fts'
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                f"name, content='{table}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            schema_editor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END'
+            )
+            schema_editor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); END"
+            )
+            schema_editor.execute(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF name ON {table} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, name) VALUES ('delete', old.id, old.name); "
+                f'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END'
+            )
+            schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def drop_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        for table in SEARCH_TABLES:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {table}_name_tsv_idx')
+            schema_editor.execute(f'DROP INDEX IF EXISTS {table}_name_trgm_idx')
+    elif connection.vendor == 'sqlite':
+        for table in SEARCH_TABLES:
+            fts = f'{table}_fts'
+            for suffix in ('ai', 'ad', 'au'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            schema_editor.execute(f'DROP TABLE IF EXISTS {fts}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reference', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,177 @@
+"""
+Полнотекстовый поиск по справочникам (работы, ресурсы, типы работ)
+
+PostgreSQL: tsvector с русской морфологией + триграммы (pg_trgm), оба поиска
+используют GIN-индексы из миграции reference.0002_search_indexes.
+SQLite (разработка): виртуальные таблицы FTS5 с префиксным поиском.
+Результаты аннотируются полем search_rank (больше - релевантнее).
+"""
+import operator
+import re
+from functools import reduce
+
+from django.contrib.admin.views.main import ORDER_VAR
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+from rest_framework import filters
+
+from .models import Work, Resource, WorkType
+
+
+# Модели с поисковыми индексами и поле, по которому они построены
+SEARCH_INDEXES = {
+    Work: 'name',
+    Resource: 'name',
+    WorkType: 'name',
+}
+
+# Конфигурация текстового поиска PostgreSQL (русская морфология)
+SEARCH_CONFIG = 'russian'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+# Префиксы search_fields (DRF и админка) -> lookup; без префикса - icontains
+LOOKUP_PREFIXES = {'^': 'istartswith', '=': 'iexact'}
+
+
+def fts_table_name(model):
+    """Имя виртуальной таблицы FTS5 для модели (SQLite)"""
+    return f'{model._meta.db_table}_fts'
+
+
+def is_searchable(model):
+    return model in SEARCH_INDEXES
+
+
+def ranked_search(queryset, term, also=None):
+    """
+    Фильтрует queryset по поисковой строке и добавляет аннотацию search_rank.
+    also - Q строк, найденных другим способом (например, по остальным search_fields):
+    они тоже попадают в результат, без совпадения по индексу - с рангом 0.
+    Для моделей без поискового индекса используется обычный icontains.
+    """
+    field = SEARCH_INDEXES.get(queryset.model, 'name')
+    tokens = TOKEN_RE.findall(term.lower())
+    if not tokens:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+    also = also if also is not None else Q(pk__in=[])
+
+    if is_searchable(queryset.model):
+        if connection.vendor == 'postgresql':
+            return _postgres_search(queryset, field, ' '.join(tokens), also)
+        if connection.vendor == 'sqlite':
+            return _sqlite_search(queryset, tokens, also)
+
+    conditions = Q()
+    for token in tokens:
+        conditions &= Q(**{f'{field}__icontains': token})
+    return queryset.filter(conditions | also).annotate(
+        search_rank=Value(0.0, output_field=FloatField())
+    )
+
+
+def other_fields_search(model, search_fields, terms):
+    """
+    Q: каждое слово есть хотя бы в одном из search_fields, кроме поля поискового индекса
+    (его проверяет ranked_search по индексу); None, если других полей нет
+    """
+    lookups = []
+    for name in search_fields:
+        lookup = LOOKUP_PREFIXES.get(name[0], 'icontains')
+        name = name.lstrip('^=@$')
+        if name != SEARCH_INDEXES.get(model):
+            lookups.append(f'{name}__{lookup}')
+    if not lookups or not terms:
+        return None
+    return reduce(operator.and_, [
+        reduce(operator.or_, [Q(**{lookup: term}) for lookup in lookups]) for term in terms
+    ])
+
+
+def _postgres_search(queryset, field, term, also):
+    """tsvector (морфология) + word similarity по триграммам"""
+    from django.contrib.postgres.search import (
+        SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+    )
+
+    vector = SearchVector(field, config=SEARCH_CONFIG)
+    query = SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch')
+    return queryset.annotate(
+        search_vector=vector,
+        search_rank=SearchRank(vector, query) + TrigramWordSimilarity(term, field),
+    ).filter(
+        Q(search_vector=query) | Q(**{f'{field}__trigram_word_similar': term}) | also
+    )
+
+
+def _sqlite_search(queryset, tokens, also):
+    """FTS5: все слова запроса как префиксы, ранжирование по bm25"""
+    table = queryset.model._meta.db_table
+    fts_table = fts_table_name(queryset.model)
+    match = ' '.join(f'"{token}"*' for token in tokens)
+    return queryset.filter(
+        Q(pk__in=RawSQL(
+            f'SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH %s',
+            (match,)
+        )) | also
+    ).annotate(
+        search_rank=Coalesce(
+            RawSQL(
+                f'SELECT -bm25({fts_table}) FROM {fts_table} '
+                f'WHERE {fts_table} MATCH %s AND rowid = "{table}"."id"',
+                (match,),
+                output_field=FloatField()
+            ),
+            Value(0.0, output_field=FloatField())
+        )
+    )
+
+
+# ========== DRF ==========
+
+class RankedSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter, использующий поисковые индексы и ранжирование по релевантности;
+    совпадения по остальным search_fields (единица измерения, вид работ) - с рангом 0
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if not is_searchable(queryset.model):
+            return super().filter_queryset(request, queryset, view)
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        also = other_fields_search(queryset.model, self.get_search_fields(view, request) or [], terms)
+        return ranked_search(queryset, ' '.join(terms), also=also)
+
+
+class RankedOrderingFilter(filters.OrderingFilter):
+    """При поиске без явного ?ordering= сортирует по релевантности"""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if request.query_params.get(self.ordering_param):
+            return ordering
+        if 'search_rank' in queryset.query.annotations:
+            return ['-search_rank', *(ordering or [])]
+        return ordering
+
+
+# ========== Admin ==========
+
+class RankedSearchAdminMixin:
+    """
+    Поиск в списке и autocomplete админки через поисковые индексы
+    Список сортируется до поиска, поэтому сортировка по релевантности добавляется здесь;
+    явная сортировка по столбцу (?o=) сохраняется.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not is_searchable(queryset.model):
+            return super().get_search_results(request, queryset, search_term)
+        also = other_fields_search(queryset.model, self.get_search_fields(request), search_term.split())
+        results = ranked_search(queryset, search_term, also=also)
+        if not request.GET.get(ORDER_VAR):
+            results = results.order_by('-search_rank', *queryset.query.order_by)
+        return results, False
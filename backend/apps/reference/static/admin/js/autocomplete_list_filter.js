@@ -0,0 +1,17 @@
+'use strict';
+{
+    // Переход на отфильтрованный список при выборе значения в AutocompleteListFilter
+    const $ = django.jQuery;
+    $(document).ready(function() {
+        $('.autocomplete-list-filter select').on('change', function() {
+            const params = new URLSearchParams(window.location.search);
+            params.delete('p');
+            if (this.value) {
+                params.set(this.name, this.value);
+            } else {
+                params.delete(this.name);
+            }
+            window.location.search = params.toString();
+        });
+    });
+}
@@ -1,3 +1,303 @@
+import csv
+import io
+from unittest import mock, skipIf, skipUnless
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from .admin_utils import EstimatedCountPaginator
+from .autocomplete import PrefixIndex
+from .importer import COLUMNS, CatalogImportError, import_catalog, read_rows
+from .models import WorkCategory, WorkType, Work, Resource, WorkTypeWork, WorkResource
+
+
+class AdminChangelistQueryCountTests(TestCase):
+    """Количество запросов страниц списка в админке не зависит от числа строк"""
+
+    changelists = [
+        'admin:reference_workcategory_changelist',
+        'admin:reference_worktype_changelist',
+        'admin:reference_work_changelist',
+        'admin:reference_resource_changelist',
+        'admin:reference_worktypework_changelist',
+        'admin:reference_workresource_changelist',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def create_catalog(self, count):
+        for i in range(count):
+            category = WorkCategory.objects.create(name=f'Вид {i}')
+            work_type = WorkType.objects.create(category=category, name=f'Тип {i}')
+            work = Work.objects.create(name=f'Работа {i}', unit='м2')
+            resource = Resource.objects.create(name=f'Ресурс {i}', unit='кг')
+            WorkTypeWork.objects.create(work_type=work_type, work=work)
+            WorkResource.objects.create(work_type=work_type, work=work, resource=resource, quantity_per_unit=1)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_changelist_queries_are_bounded(self):
+        self.create_catalog(1)
+        few = {url_name: self.count_queries(reverse(url_name)) for url_name in self.changelists}
+        self.create_catalog(4)
+        for url_name in self.changelists:
+            with self.subTest(url_name):
+                self.assertEqual(self.count_queries(reverse(url_name)), few[url_name])
+
+
+class RankedSearchTests(TestCase):
+    """Поиск по справочникам в списках и autocomplete админки и в API"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        floors = WorkCategory.objects.create(name='Полы')
+        roof = WorkCategory.objects.create(name='Кровля')
+        cls.film = Work.objects.create(name='Укладка пленки', unit='м2')
+        cls.film_roof = Work.objects.create(name='Пленка пароизоляционная на кровле', unit='м2')
+        cls.bolts = Work.objects.create(name='Установка анкеров', unit='шт')
+        Resource.objects.create(name='Пленка полиэтиленовая', unit='м2')
+        WorkType.objects.create(category=floors, name='Стяжка')
+        WorkType.objects.create(category=roof, name='Гидроизоляция')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def changelist(self, model, **params):
+        response = self.client.get(reverse(f'admin:reference_{model}_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['cl'].result_list)
+
+    def test_changelist_search(self):
+        for model in ('work', 'resource', 'worktype'):
+            with self.subTest(model):
+                self.changelist(model, q='плен')
+        results = self.changelist('work', q='пленк')
+        self.assertEqual(set(results), {self.film, self.film_roof})
+        self.assertEqual(self.changelist('work', q='шт'), [self.bolts])
+        self.assertEqual([work_type.name for work_type in self.changelist('worktype', q='Кровл')],
+                         ['Гидроизоляция'])
+        self.assertEqual(len(self.changelist('work', q='пленк', o='1')), 2)
+
+    def test_autocomplete_is_ranked(self):
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'term': 'пленк', 'app_label': 'reference', 'model_name': 'workresource', 'field_name': 'work',
+        })
+        self.assertEqual(response.status_code, 200)
+        ids = [int(result['id']) for result in response.json()['results']]
+        self.assertEqual(set(ids), {self.film.pk, self.film_roof.pk})
+
+    def test_api_search_by_unit_and_category(self):
+        api = APIClient()
+        api.force_authenticate(self.user)
+        response = api.get('/api/works/', {'search': 'шт'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.bolts.pk])
+        response = api.get('/api/work-types/', {'search': 'Кровл'})
+        self.assertEqual([row['name'] for row in response.json()['results']], ['Гидроизоляция'])
+
+    def test_indexed_field_is_not_scanned(self):
+        """Название ищется только по поисковому индексу, LIKE - по остальным полям"""
+        api = APIClient()
+        api.force_authenticate(self.user)
+        requests = [
+            lambda: api.get('/api/works/', {'search': 'бетон'}),
+            lambda: self.client.get(reverse('admin:reference_work_changelist'), {'q': 'бетон'}),
+        ]
+        for request in requests:
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(request().status_code, 200)
+            sql = '\n'.join(query['sql'] for query in context.captured_queries)
+            self.assertIn('"reference_work"."unit"', sql)
+            self.assertNotRegex(sql, r'"reference_work"\."name"::text\)?\) LIKE|"reference_work"\."name" LIKE')
+
+
+class AutocompleteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.film = Work.objects.create(name='Пленка пароизоляционная', unit='м2')
+        cls.laying = Work.objects.create(name='Устройство ПЭ плёнки', unit='м2')
+        Work.objects.create(name='Установка анкеров', unit='шт')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        response = self.client.get('/api/reference/autocomplete/', params)
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.json()]
+
+    def test_prefix_index(self):
+        index = PrefixIndex([(name, name) for name in ['Пленка ПЭ', 'Устройство ПЭ плёнки', 'Пол', 'Плитка']])
+        self.assertEqual(index.search('плен'), ['Пленка ПЭ', 'Устройство ПЭ плёнки'])
+        self.assertEqual(index.search('пэ'), ['Пленка ПЭ', 'Устройство ПЭ плёнки'])
+        self.assertEqual(index.search('п', limit=2), ['Пленка ПЭ', 'Плитка'])
+        self.assertEqual(index.search('  '), [])
+
+    def test_endpoint_and_rebuild_after_changes(self):
+        self.assertEqual(self.search(q='плен'), ['Пленка пароизоляционная', 'Устройство ПЭ плёнки'])
+        self.assertEqual(self.search(q='плен', limit=1), ['Пленка пароизоляционная'])
+        self.film.name = 'Мембрана'
+        self.film.save()
+        self.assertEqual(self.search(q='плен'), ['Устройство ПЭ плёнки'])
+        self.laying.delete()
+        self.assertEqual(self.search(q='плен'), [])
+        Resource.objects.create(name='Пленка ПЭ 200 мкм', unit='м2')
+        self.assertEqual(self.search(kind='resource', q='плен'), ['Пленка ПЭ 200 мкм'])
+
+    def test_invalid_params(self):
+        for params in ({'kind': 'estimate'}, {'limit': 'x'}, {'limit': -1}, {'limit': 0}):
+            with self.subTest(params):
+                response = self.client.get('/api/reference/autocomplete/', params)
+                self.assertEqual(response.status_code, 400)
+
+
+class CatalogImportTests(TestCase):
+
+    def catalog_rows(self, types=2, works=3, resources=2, quantity=1.5, prefix=''):
+        rows = []
+        for t in range(types):
+            for w in range(works):
+                for r in range(resources):
+                    rows.append({
+                        'category': f'{prefix}Полы', 'work_type': f'Тип {t}', 'work': f'{prefix}Работа {w}',
+                        'work_unit': 'м2', 'order_index': '', 'work_volume_per_unit': '0,5',
+                        'resource': f'{prefix}Ресурс {r}',
+                        'resource_unit': 'кг', 'quantity_per_unit': str(quantity),
+                    })
+        return rows
+
+    def as_csv(self, rows):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+        return io.BytesIO(buffer.getvalue().encode())
+
+    def test_insert_then_unchanged_then_update(self):
+        stats = import_catalog(read_rows(self.as_csv(self.catalog_rows()), 'csv'))
+        self.assertEqual(stats['WorkType']['inserted'], 2)
+        self.assertEqual(stats['WorkTypeWork']['inserted'], 6)
+        self.assertEqual(stats['WorkResource']['inserted'], 12)
+        self.assertEqual(WorkTypeWork.objects.filter(work_volume_per_unit=0.5).count(), 6)
+        self.assertEqual(
+            list(WorkTypeWork.objects.filter(work_type__name='Тип 0').values_list('order_index', flat=True)),
+            [1, 2, 3]
+        )
+
+        stats = import_catalog(self.catalog_rows())
+        self.assertEqual(stats['WorkResource'], {'inserted': 0, 'updated': 0, 'unchanged': 12})
+        self.assertEqual(stats['Work'], {'inserted': 0, 'updated': 0, 'unchanged': 3})
+
+        rows = self.catalog_rows()
+        rows[0]['quantity_per_unit'] = '2.5'
+        stats = import_catalog(rows)
+        self.assertEqual(stats['WorkResource'], {'inserted': 0, 'updated': 1, 'unchanged': 11})
+        self.assertEqual(WorkResource.objects.filter(quantity_per_unit=2.5).count(), 1)
+        self.assertEqual(WorkResource.objects.count(), 12)
+
+    def test_query_count_does_not_depend_on_rows(self):
+        with CaptureQueriesContext(connection) as small:
+            import_catalog(self.catalog_rows(types=1, works=1, resources=1))
+        with CaptureQueriesContext(connection) as large:
+            import_catalog(self.catalog_rows(types=5, works=10, resources=4, prefix='Новый '))
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+
+    def test_invalid_rows_are_reported_together(self):
+        rows = self.catalog_rows(types=1, works=2, resources=1)
+        rows[0]['quantity_per_unit'] = '-1'
+        rows[1]['work_volume_per_unit'] = 'abc'
+        with self.assertRaises(CatalogImportError) as context:
+            import_catalog(rows)
+        self.assertEqual(len(context.exception.errors), 2)
+        self.assertTrue(any(error.startswith('Строка 2: quantity_per_unit') for error in context.exception.errors))
+        self.assertFalse(WorkCategory.objects.exists())
+
+    def test_blank_template_values_keep_stored_ones(self):
+        rows = self.catalog_rows(types=1, works=2, resources=1)
+        rows[0]['order_index'] = '10'
+        import_catalog(rows)
+        WorkTypeWork.objects.filter(work__name='Работа 1').update(order_index=20, work_volume_per_unit=3)
+
+        rows = self.catalog_rows(types=1, works=3, resources=1)
+        for row in rows:
+            row['work_volume_per_unit'] = ''
+        stats = import_catalog(rows)
+        self.assertEqual(stats['WorkTypeWork'], {'inserted': 1, 'updated': 0, 'unchanged': 2})
+        self.assertEqual(
+            dict(WorkTypeWork.objects.values_list('work__name', 'order_index')),
+            {'Работа 0': 10, 'Работа 1': 20, 'Работа 2': 3}
+        )
+        self.assertEqual(
+            dict(WorkTypeWork.objects.values_list('work__name', 'work_volume_per_unit')),
+            {'Работа 0': 0.5, 'Работа 1': 3, 'Работа 2': 1}
+        )
+
+    def test_unreadable_files(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        uploads = [
+            ('catalog.json', b'{"rows": [}'),
+            ('catalog.csv', 'category;work_type\nПолы;Стяжка\n'.encode('cp1251')),
+            ('catalog.xlsx', b'not a zip file'),
+        ]
+        for name, content in uploads:
+            with self.subTest(name=name):
+                response = self.client.post('/api/reference/import/', {'file': SimpleUploadedFile(name, content)})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('не читается', response.json()['error'])
+
+    def test_api_dry_run(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        upload = SimpleUploadedFile('catalog.csv', self.as_csv(self.catalog_rows()).getvalue())
+        response = self.client.post('/api/reference/import/', {'file': upload, 'dry_run': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stats']['WorkResource']['inserted'], 12)
+        self.assertFalse(WorkResource.objects.exists())
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    """Оценка количества строк вместо COUNT(*) только на PostgreSQL и только для больших выборок"""
+
+    @classmethod
+    def setUpTestData(cls):
+        Work.objects.bulk_create(Work(name=f'Работа {i}', unit='м2') for i in range(5))
+
+    @skipIf(connection.vendor == 'postgresql', 'точный COUNT(*) на базах кроме PostgreSQL')
+    @mock.patch.object(EstimatedCountPaginator, 'estimate_count')
+    def test_exact_count_without_postgresql(self, estimate_count):
+        self.assertEqual(EstimatedCountPaginator(Work.objects.all(), 2).count, 5)
+        self.assertEqual(EstimatedCountPaginator(list(Work.objects.all()), 2).count, 5)
+        estimate_count.assert_not_called()
+
+    def test_threshold(self):
+        queryset = Work.objects.filter(unit='м2')
+        with (
+            mock.patch.object(connections[queryset.db], 'vendor', 'postgresql'),
+            mock.patch.object(EstimatedCountPaginator, 'estimate_count') as estimate_count,
+        ):
+            for estimate, expected in ((None, 5), (99_999, 5), (100_000, 100_000), (250_000, 250_000)):
+                estimate_count.return_value = estimate
+                self.assertEqual(EstimatedCountPaginator(queryset, 2).count, expected, estimate)
+            estimate_count.assert_called_with(queryset)
 
-# Create your tests here.
+    @skipUnless(connection.vendor == 'postgresql', 'оценка планировщика - только PostgreSQL')
+    def test_estimate_on_postgresql(self):
+        self.assertIsInstance(EstimatedCountPaginator.estimate_count(Work.objects.filter(unit='м2')), int)
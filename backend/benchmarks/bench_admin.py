@@ -0,0 +1,18 @@
+"""Страницы списков в админке"""
+import pytest
+from django.urls import reverse
+
+
+@pytest.mark.parametrize('url_name', [
+    'admin:estimates_estimate_changelist',
+    'admin:estimates_estimatesection_changelist',
+    'admin:estimates_estimatesectionworktype_changelist',
+    'admin:estimates_estimateitem_changelist',
+    'admin:estimates_estimateitemresource_changelist',
+    'admin:reference_work_changelist',
+    'admin:reference_resource_changelist',
+    'admin:reference_worktype_changelist',
+])
+def test_admin_changelist(benchmark, admin_client, url_name):
+    response = benchmark(admin_client.get, reverse(url_name))
+    assert response.status_code == 200
@@ -0,0 +1,21 @@
+"""Списочные и детальные эндпоинты API"""
+import pytest
+
+
+@pytest.mark.parametrize('url', [
+    '/api/estimates/',
+    '/api/estimate-sections/',
+    '/api/estimate-section-work-types/',
+    '/api/estimate-items/',
+    '/api/estimate-item-resources/',
+    '/api/works/?search=работа',
+    '/api/resources/?search=ресурс',
+])
+def test_list_endpoint(benchmark, api_client, url):
+    response = benchmark(api_client.get, url)
+    assert response.status_code == 200
+
+
+def test_estimate_detail_endpoint(benchmark, api_client, estimate):
+    response = benchmark(api_client.get, f'/api/estimates/{estimate.pk}/')
+    assert response.status_code == 200
@@ -0,0 +1,62 @@
+"""Движок ВОР: создание из шаблона и пересчеты"""
+import itertools
+
+from apps.api.serializers import EstimateDetailSerializer
+from apps.api.views import EstimateViewSet
+from apps.estimates.models import (
+    Estimate, EstimateSection, EstimateSectionWorkType
+)
+from apps.reference.models import WorkType
+
+
+def test_template_instantiation(benchmark, db):
+    """Создание типа работ в разделе: работы и ресурсы из шаблона"""
+    work_type = WorkType.objects.order_by('pk').first()
+    counter = itertools.count()
+
+    def setup():
+        estimate = Estimate.objects.create(name=f'bench {next(counter)}', object_name='bench')
+        section = EstimateSection.objects.create(
+            estimate=estimate, work_category=work_type.category, total_area=1000
+        )
+        return (section,), {}
+
+    def instantiate(section):
+        EstimateSectionWorkType.objects.create(section=section, work_type=work_type, percentage=100)
+
+    benchmark.pedantic(instantiate, setup=setup, rounds=20)
+
+
+def test_area_recalculation(benchmark, estimate):
+    """Изменение площади раздела: пересчет всех работ и ресурсов раздела"""
+    section = estimate.sections.first()
+    areas = itertools.cycle([section.total_area * 1.1, section.total_area])
+
+    def recalculate():
+        section.total_area = next(areas)
+        section.save()
+
+    benchmark(recalculate)
+
+
+def test_percentage_recalculation(benchmark, estimate):
+    """Изменение процента типа работ: пересчет работ и ресурсов типа"""
+    section_work_type = EstimateSectionWorkType.objects.filter(section__estimate=estimate).first()
+    percentages = itertools.cycle([section_work_type.percentage + 1, section_work_type.percentage])
+
+    def recalculate():
+        section_work_type.percentage = next(percentages)
+        section_work_type.save()
+
+    benchmark(recalculate)
+
+
+def test_detail_serialization(benchmark, estimate):
+    """Полная сериализация ВОР (как в GET /api/estimates/{id}/)"""
+    queryset = EstimateViewSet.queryset
+
+    def serialize():
+        return EstimateDetailSerializer(queryset.get(pk=estimate.pk)).data
+
+    data = benchmark(serialize)
+    assert data['id'] == estimate.pk
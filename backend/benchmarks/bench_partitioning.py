@@ -0,0 +1,20 @@
+"""
+Запросы по одной ВОР к ресурсам работ: обычная и секционированная таблица
+
+Секционированный вариант - только на PostgreSQL: таблица переводится внутри теста
+(partitioning.partition) и возвращается откатом транзакции теста.
+"""
+import pytest
+from django.db import connection
+
+from apps.estimates import partitioning
+
+
+@pytest.mark.parametrize('query', list(partitioning.BENCHMARK_QUERIES))
+@pytest.mark.parametrize('layout', ['plain', 'partitioned'])
+def test_per_estimate_query(benchmark, estimate, layout, query):
+    if layout == 'partitioned':
+        if connection.vendor != 'postgresql':
+            pytest.skip('секционирование таблиц - только PostgreSQL')
+        partitioning.partition(partitions=8)
+    benchmark(partitioning.BENCHMARK_QUERIES[query], estimate.pk)
@@ -0,0 +1,63 @@
+"""
+Бенчмарки движка ВОР (pytest-benchmark + pytest-django)
+
+База заполняется синтетическими данными один раз на сессию.
+Размер настраивается переменными окружения BENCH_ESTIMATES, BENCH_CATEGORIES,
+BENCH_WORK_TYPES_PER_SECTION, BENCH_WORKS_PER_TYPE, BENCH_RESOURCES_PER_WORK.
+"""
+import os
+
+import pytest
+from django.contrib.auth.models import User
+from django.db.models import Count
+from rest_framework.test import APIClient
+
+from apps.estimates.models import Estimate
+from apps.estimates.synthetic import SyntheticConfig, generate_synthetic_data
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+@pytest.fixture(scope='session')
+def synthetic_config():
+    return SyntheticConfig(
+        estimates=_env_int('BENCH_ESTIMATES', 20),
+        categories=_env_int('BENCH_CATEGORIES', 4),
+        work_types_per_section=_env_int('BENCH_WORK_TYPES_PER_SECTION', 3),
+        works_per_type=_env_int('BENCH_WORKS_PER_TYPE', 8),
+        resources_per_work=_env_int('BENCH_RESOURCES_PER_WORK', 4),
+        name_prefix='BENCH',
+    )
+
+
+@pytest.fixture(scope='session')
+def django_db_setup(django_db_setup, django_db_blocker, synthetic_config):
+    with django_db_blocker.unblock():
+        generate_synthetic_data(synthetic_config)
+        User.objects.create_superuser('bench', 'bench@example.com', 'bench')
+
+
+@pytest.fixture
+def superuser(db):
+    return User.objects.get(username='bench')
+
+
+@pytest.fixture
+def api_client(superuser):
+    client = APIClient()
+    client.force_authenticate(superuser)
+    return client
+
+
+@pytest.fixture
+def admin_client(client, superuser):
+    client.force_login(superuser)
+    return client
+
+
+@pytest.fixture
+def estimate(db):
+    """Самая большая ВОР синтетического набора (по числу ресурсов работ)"""
+    return Estimate.objects.annotate(rows=Count('item_resources')).order_by('-rows', 'pk').first()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+from importlib.util import find_spec
 from pathlib import Path
 from urllib.parse import urlparse
 
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # pg_trgm / полнотекстовый поиск
     'corsheaders',  # CORS для фронтенда
     'drf_spectacular', #swagger
     'rest_framework',  # Django REST Framework
@@ -52,6 +54,12 @@ INSTALLED_APPS = [
 # REST Framework настройки
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # JSON через orjson; application/msgpack - если установлен msgpack
+    'DEFAULT_RENDERER_CLASSES': [
+        'apps.api.renderers.ORJSONRenderer',
+        *(['apps.api.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_FILTER_BACKENDS': [
@@ -80,6 +88,7 @@ SPECTACULAR_SETTINGS = {
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # CORS middleware должен быть в начале
     'django.middleware.security.SecurityMiddleware',
+    'apps.api.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -88,6 +97,46 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Сжатие ответов (brotli/gzip) начиная с указанного размера; потоковые ответы сжимаются всегда
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', 1024))
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.environ.get('RESPONSE_COMPRESSION_BROTLI_QUALITY', 5))
+
+# Инструментирование запросов: X-Query-Count, Server-Timing, лог медленных запросов и N+1
+REQUEST_INSTRUMENTATION = os.environ.get('REQUEST_INSTRUMENTATION', '0') == '1'
+REQUEST_INSTRUMENTATION_SLOW_MS = int(os.environ.get('REQUEST_INSTRUMENTATION_SLOW_MS', 500))
+REQUEST_INSTRUMENTATION_DUPLICATE_THRESHOLD = int(os.environ.get('REQUEST_INSTRUMENTATION_DUPLICATE_THRESHOLD', 5))
+if REQUEST_INSTRUMENTATION:
+    MIDDLEWARE.insert(1, 'apps.api.instrumentation.QueryInstrumentationMiddleware')
+
+# Метрики Prometheus (/metrics): заголовок Authorization: Bearer <METRICS_TOKEN> или вход сотрудника;
+# без токена метрики открыты только при DEBUG
+MIDDLEWARE.insert(0, 'apps.api.instrumentation.MetricsMiddleware')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Профилирование запросов сотрудников по X-Profile: 1 / ?_profile=1 (файлы speedscope)
+REQUEST_PROFILE_DIR = os.environ.get('REQUEST_PROFILE_DIR', str(BASE_DIR / 'profiles'))
+REQUEST_PROFILE_INTERVAL = float(os.environ.get('REQUEST_PROFILE_INTERVAL', 0.001))
+MIDDLEWARE.insert(
+    MIDDLEWARE.index('django.contrib.auth.middleware.AuthenticationMiddleware') + 1,
+    'apps.api.profiling.ProfilingMiddleware'
+)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'apps': {
+            'handlers': ['console'],
+            'level': os.environ.get('APPS_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
 ROOT_URLCONF = 'database.urls'
 
 TEMPLATES = [
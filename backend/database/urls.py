@@ -17,6 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.utils.translation import gettext_lazy as _
+from apps.api.views import metrics_view
 from drf_spectacular.views import (
     SpectacularAPIView,
     SpectacularRedocView,
@@ -34,6 +35,9 @@ urlpatterns = [
     
     # API endpoints
     path('api/', include('apps.api.urls')),
+
+    # Метрики Prometheus
+    path('metrics', metrics_view, name='metrics'),
     
     # Swagger/OpenAPI документация
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),